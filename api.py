@@ -1,12 +1,18 @@
+from datetime import datetime, timezone
 from enum import Enum
-from functools import partial, wraps
+from functools import wraps
 from traceback import format_exception
 
 import mariadb
-from quart import Blueprint, current_app, jsonify, request
+from quart import (Blueprint, Response, current_app, jsonify, make_response,
+                   request)
 
-from db import exceptions, stock
-from db.manage import get_db
+import metrics
+from candles import StockCandles, format_resolution, parse_resolution
+from db import aio, exceptions, sqlite
+from response_cache import cached
+from tick_store import to_columns
+from trade_queue import NoPriceError, TradeQueueFull
 
 
 class ApiError(Enum):
@@ -59,6 +65,7 @@ def handle_db_error(error):
 
 
 @api.errorhandler(mariadb.Error)
+@api.errorhandler(sqlite.Error)
 def handle_mariadb_error(error):
     current_app.logger.error("".join(format_exception(error)))
     return ApiError.DATABASE.as_response(
@@ -68,132 +75,265 @@ def handle_mariadb_error(error):
 
 def return_rowcount(f):
     @wraps(f)
-    def wrapper(*args, **kwargs):
-        value = f(*args, **kwargs)
+    async def wrapper(*args, **kwargs):
+        value = await f(*args, **kwargs)
         if isinstance(value, int):
             return jsonify({"rowcount": value})
         return value
     return wrapper
 
 
+def _tick_store():
+    """Return the market engine's in-memory price store (if running)."""
+    engine = current_app.config.get("MARKET_ENGINE")
+    if engine is None:
+        return None
+    return engine.tick_store
+
+
+def _invalidate_cache():
+    """Drop cached responses after stocks or prices were changed."""
+    cache = current_app.config.get("RESPONSE_CACHE")
+    if cache is not None:
+        cache.invalidate()
+
+
 @api.route('/kurse/verlauf/', defaults={'stock_id': None})
 @api.route('/kurse/verlauf/<int:stock_id>')
-def get_stock_price(stock_id: int = None):
+@cached
+async def get_stock_price(stock_id: int = None):
     # get the stock price history (or preview).
-    db = get_db()
     history_len = request.args.get("eintraege", default=10, type=int)
     if not history_len > 0:
         return ApiError.INPUT.as_response(
             "mindestens ein Eintrag muss abgerufen werden.")
-    get_price = partial(stock.get_price_history, db, fetch_rows=history_len)
+    # "spalten": {"valid_after": [epoch seconds], "price": [cents]} per stock
+    columns = request.args.get("format") == "spalten"
+    if request.args.get("format") not in (None, "zeilen", "spalten"):
+        return ApiError.INPUT.as_response(
+            "Parameter 'format' muss 'zeilen' oder 'spalten' sein.")
+    # "seit": only prices which became valid after the cursor (epoch seconds)
+    since = request.args.get("seit", type=int)
+    if "seit" in request.args and since is None:
+        return ApiError.INPUT.as_response(
+            "Parameter 'seit' muss ein Zeitstempel (Sekunden) sein.")
+    store = _tick_store()
     if stock_id is None:
-        prices = {}
-        for stock_id in stock.list_stock_ids(db):
-            prices[stock_id] = get_price(stock_id)
-        return prices
+        stock_ids = await aio.stock.list_stock_ids(await aio.get_db())
     else:
-        price = get_price(stock_id)
-        if price is None:
-            return ApiError.EMPTY.as_response("kein Verlauf verfügbar")
-        return price
+        stock_ids = [stock_id]
+
+    now = datetime.now(timezone.utc)
+    prices, missing = {}, []
+    for s_id in stock_ids:
+        history = None
+        if store is not None and columns:
+            history = store.get_history_columns(s_id, history_len, now, since)
+        elif store is not None:
+            history = store.get_history(s_id, history_len, now, since)
+        if history is None:
+            missing.append(s_id)
+        prices[s_id] = history
+    cursors = [since or 0]
+    if store is not None:
+        cursors.append(store.cursor(now) or 0)
+    if missing:
+        # not (fully) held in memory, fall back to the database
+        histories = await aio.stock.get_price_histories(
+            await aio.get_db(), missing, fetch_rows=history_len,
+            since=datetime.fromtimestamp(since, timezone.utc) if since else None
+        )
+        cursors.extend(int(rows[0]["valid_after"].timestamp())
+                       for rows in histories.values() if rows)
+        if columns:
+            histories = {s_id: to_columns(rows) for s_id, rows in histories.items()}
+        prices.update(histories)
+
+    if stock_id is not None and prices[stock_id] is None:
+        raise exceptions.StockIdError(stock_id)
+    result = prices if stock_id is None else prices[stock_id]
+    if since is None:
+        return result
+    # pass "cursor" as "seit" to get the prices which became valid since
+    return {"cursor": max(cursors), "kurse": result}
 
 
 @api.route('/kurse/vorschau/', defaults={'stock_id': None})
 @api.route('/kurse/vorschau/<int:stock_id>')
-def get_stock_preview(stock_id: int = None):
-    db = get_db()
-    get_preview = partial(stock.get_price_preview, db, fetch_rows="first")
+@cached
+async def get_stock_preview(stock_id: int = None):
+    store = _tick_store()
     if stock_id is None:
-        previews = {}
-        for stock_id in stock.list_stock_ids(db):
-            previews[stock_id] = get_preview(stock_id)
-        return previews
+        stock_ids = await aio.stock.list_stock_ids(await aio.get_db())
     else:
-        preview = get_preview(stock_id)
-        if preview is None:
-            return ApiError.EMPTY.as_response("keine Vorschau verfügbar")
-        return preview
+        stock_ids = [stock_id]
+
+    previews, missing = {}, []
+    for s_id in stock_ids:
+        if store is not None and s_id in store:
+            previews[s_id] = store.get_preview(s_id)
+        else:
+            missing.append(s_id)
+    if missing:
+        previews.update(
+            await aio.stock.get_price_previews(await aio.get_db(), missing)
+        )
+
+    if stock_id is None:
+        return previews
+    if stock_id not in previews:
+        raise exceptions.StockIdError(stock_id)
+    if previews[stock_id] is None:
+        return ApiError.EMPTY.as_response("keine Vorschau verfügbar")
+    return previews[stock_id]
+
+
+@api.route('/kurse/kerzen/<int:stock_id>')
+@cached
+async def get_stock_candles(stock_id: int):
+    # get open/high/low/close of the stock price per time bucket.
+    try:
+        resolution = parse_resolution(request.args.get("aufloesung", default="1h"))
+    except ValueError:
+        return ApiError.INPUT.as_response(
+            "unzulässige Auflösung (z.B. 15m, 1h oder 1d).")
+    num = request.args.get("eintraege", default=100, type=int)
+    if not num > 0:
+        return ApiError.INPUT.as_response(
+            "mindestens ein Eintrag muss abgerufen werden.")
+
+    engine = current_app.config.get("MARKET_ENGINE")
+    if engine is not None and stock_id in engine.candles:
+        if resolution not in engine.candles.resolutions:
+            return ApiError.INPUT.as_response(
+                "Auflösung wird nicht unterstützt. Verfügbar: " + ", ".join(
+                    map(format_resolution, engine.candles.resolutions)))
+        return engine.candles.get_candles(stock_id, resolution, num)
+
+    # not held in memory, aggregate from the database
+    series = await aio.stock.get_price_series(await aio.get_db(), [stock_id])
+    if stock_id not in series:
+        raise exceptions.StockIdError(stock_id)
+    candles = StockCandles(stock_id, [resolution])
+    candles.set_pending(series[stock_id])
+    candles.advance(datetime.now(timezone.utc))
+    return candles.series[resolution].newest(num)
 
 
 @api.route('/kurse/vorschau/<int:stock_id>', methods=['PUT'])
 @return_rowcount
-def set_stock_preview(stock_id: int):
-    db = get_db()
+async def set_stock_preview(stock_id: int):
+    db = await aio.get_db()
     preview = request.args.get("wert", type=int)
     if preview is None:
         return ApiError.INPUT.as_response("Parameter 'wert' muss ganzzahlig sein.")
-    res = stock.set_price_preview(db, stock_id, preview)
-    # HACK market engine fails when reloading this from within its own context.
-    # no idea why. it gets an old value from the db for some reason.
-    current_app.config["MARKET_ENGINE"].reload_stocks(db)
+    res = await aio.stock.set_price_preview(db, stock_id, preview)
+    _invalidate_cache()
+    await current_app.config["MARKET_ENGINE"].invalidate_stock(stock_id)
+    if "PRICE_STREAM" in current_app.config:
+        current_app.config["PRICE_STREAM"].publish_preview(stock_id)
     return res
 
 
+@api.route('/kurse/stream')
+async def stream_prices():
+    """Stream price changes as server-sent events (see `price_stream`)."""
+    stream = current_app.config.get("PRICE_STREAM")
+    if stream is None:
+        return ApiError.STATE.as_response("Kursstream ist nicht verfügbar.")
+    response = await make_response(
+        stream.events(request.headers.get("Last-Event-ID")),
+        {
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+    response.timeout = None
+    return response
+
+
 @api.route('/aktien/', methods=['POST'])
-def create_stocks():
-    db = get_db()
+async def create_stocks():
+    db = await aio.get_db()
     stock_name = request.args.get("name", type=str).strip()
-    return {"id": stock.create_stock(db, stock_name)}
+    new_id = await aio.stock.create_stock(db, stock_name)
+    _invalidate_cache()
+    if "MARKET_ENGINE" in current_app.config:
+        await current_app.config["MARKET_ENGINE"].invalidate_stock(new_id)
+    return {"id": new_id}
 
 
 @api.route('/aktien/')
-def get_stocks():
-    db = get_db()
-    return stock.list_stocks(db)
+@cached
+async def get_stocks():
+    db = await aio.get_db()
+    return await aio.stock.list_stocks(db)
 
 
 @api.route('/aktien/<int:stock_id>')
-def get_stock(stock_id: int):
-    db = get_db()
-    return stock.show_stock(db, stock_id)
+@cached
+async def get_stock(stock_id: int):
+    db = await aio.get_db()
+    return await aio.stock.show_stock(db, stock_id)
 
 
 @api.route('/aktien/<int:stock_id>/name', methods=['PUT'])
 @return_rowcount
-def set_stock_name(stock_id: int):
-    db = get_db()
+async def set_stock_name(stock_id: int):
+    db = await aio.get_db()
     name = request.args.get("name", type=str).strip()
-    return stock.rename_stock(db, stock_id, name)
+    rowcount = await aio.stock.rename_stock(db, stock_id, name)
+    _invalidate_cache()
+    return rowcount
 
 
 @api.route('/aktien/<int:stock_id>/farbe', methods=['PUT'])
 @return_rowcount
-def set_stock_color(stock_id: int):
-    db = get_db()
+async def set_stock_color(stock_id: int):
+    db = await aio.get_db()
     name = request.args.get("farbe", type=str)
-    return stock.recolor_stock(db, stock_id, name)
+    rowcount = await aio.stock.recolor_stock(db, stock_id, name)
+    _invalidate_cache()
+    return rowcount
 
 # API for purchasing stocks and showing stocks
 
+def _summary_json(summary: dict) -> dict:
+    # Sicherstellen, dass es Zahlen sind
+    return {
+        "total_amount": int(summary["total_amount"]),
+        "buy_volume": int(summary["buy_volume"]),
+        "sell_volume": int(summary["sell_volume"]),
+        "traded_value": float(summary["traded_value"]),
+    }
+
+
+@api.route('/aktien/summary/')
+async def get_stock_summaries():
+    db = await aio.get_db()
+    summaries = await aio.stock.get_transaction_summaries(db)
+    return {s_id: _summary_json(s) for s_id, s in summaries.items()}
+
+
 @api.route('/aktien/<int:stock_id>/summary')
-def get_stock_summary(stock_id):
-    db = get_db()
-    cursor = db.cursor()
-    try:
-        # SQL-Abfrage ausführen
-        cursor.execute(
-            """
-            SELECT
-                SUM(purchase_amount) AS total_amount
-            FROM transactions
-            WHERE stock_id = %s
-            """,
-            (stock_id,)
-        )
-        result = cursor.fetchone()
+async def get_stock_summary(stock_id):
+    db = await aio.get_db()
+    summary = await aio.stock.get_transaction_summary(db, stock_id)
+    return jsonify(_summary_json(summary))
 
-        # Wenn keine Daten gefunden werden, total_amount = 0 zurückgeben
-        total_amount = result[0] if result and result[0] is not None else 0
-        return jsonify({"total_amount": int(total_amount)})  # Sicherstellen, dass es eine Zahl ist
 
-    except Exception as e:
-        # Fehlerbehandlung
-        return jsonify({"error": "Fehler beim Abrufen der Daten", "details": str(e)}), 500
+def _trade_error(error: Exception):
+    if isinstance(error, TradeQueueFull):
+        current_app.logger.warning("Handelswarteschlange voll")
+        return jsonify({"error": "Zu viele Anfragen, bitte erneut versuchen"}), 503
+    if isinstance(error, NoPriceError):
+        return jsonify({"error": "Für diese Aktie gibt es noch keinen Kurs"}), 409
+    return handle_db_error(error)
 
 
 @api.route('/aktien/<int:stock_id>/kaufen', methods=['PUT'])
 async def buy_stock(stock_id):
-    db = get_db()
     try:
         # JSON-Daten asynchron abrufen
         data = await request.get_json()
@@ -204,26 +344,19 @@ async def buy_stock(stock_id):
             current_app.logger.warning(f"Ungültige Anzahl: {amount}")
             return jsonify({"error": "Ungültige Anzahl"}), 400
 
-        cursor = db.cursor()
         current_app.logger.info(f"Kaufanfrage erhalten: stock_id={stock_id}, amount={amount}")
-        cursor.execute(
-            """
-            INSERT INTO transactions (stock_id, purchase_amount, total_purchase_price)
-            VALUES (%s, %s, %s)
-            """,
-            (stock_id, amount, 0)  # Gesamtpreis kann später berechnet werden
-        )
-        db.commit()
+        total_price = await current_app.config["TRADE_QUEUE"].submit(stock_id, amount)
         current_app.logger.info(f"Aktien erfolgreich gekauft: stock_id={stock_id}, amount={amount}")
-        return jsonify({"message": "Aktien erfolgreich gekauft"}), 200
+        return jsonify({"message": "Aktien erfolgreich gekauft",
+                        "total_price": total_price}), 200
+    except (exceptions.DatabaseError, NoPriceError, TradeQueueFull) as e:
+        return _trade_error(e)
     except Exception as e:
-        db.rollback()
         current_app.logger.error(f"Fehler beim Kauf der Aktien: {e}")
         return jsonify({"error": "Fehler beim Kauf der Aktien", "details": str(e)}), 500
 
 @api.route('/aktien/<int:stock_id>/verkaufen', methods=['PUT'])
 async def sell_stock(stock_id):
-    db = get_db()
     try:
         # JSON-Daten asynchron abrufen
         data = await request.get_json()
@@ -234,46 +367,68 @@ async def sell_stock(stock_id):
             current_app.logger.warning(f"Ungültige Verkaufsanzahl: {amount}")
             return jsonify({"error": "Ungültige Verkaufsanzahl"}), 400
 
-        cursor = db.cursor()
         current_app.logger.info(f"Verkaufsanfrage erhalten: stock_id={stock_id}, amount={amount}")
-        cursor.execute(
-            """
-            INSERT INTO transactions (stock_id, purchase_amount, total_purchase_price)
-            VALUES (%s, %s, %s)
-            """,
-            (stock_id, amount, 0)  # Gesamtpreis kann später berechnet werden
-        )
-        db.commit()
+        total_price = await current_app.config["TRADE_QUEUE"].submit(stock_id, amount)
         current_app.logger.info(f"Aktien erfolgreich verkauft: stock_id={stock_id}, amount={amount}")
-        return jsonify({"message": "Aktien erfolgreich verkauft"}), 200
+        return jsonify({"message": "Aktien erfolgreich verkauft",
+                        "total_price": -total_price}), 200
+    except (exceptions.DatabaseError, NoPriceError, TradeQueueFull) as e:
+        return _trade_error(e)
     except Exception as e:
-        db.rollback()
         current_app.logger.error(f"Fehler beim Verkauf der Aktien: {e}")
         return jsonify({"error": "Fehler beim Verkauf der Aktien", "details": str(e)}), 500
 
 
         
 @api.route('/markt/update')
-def reload_market_engine():
-    num_loaded = current_app.config["MARKET_ENGINE"].reload_stocks(get_db())
+async def reload_market_engine():
+    num_loaded = await current_app.config["MARKET_ENGINE"].reload_stocks()
+    _invalidate_cache()
     return jsonify({"num_loaded": num_loaded})
 
 
 @api.route('/markt/status')
-def get_market_engine_status():
-    is_running = current_app.config["MARKET_ENGINE"].is_running()
-    num_loaded = current_app.config["MARKET_ENGINE"].get_num_stocks()
-    return jsonify({"is_running": is_running, "num_loaded": num_loaded})
+async def get_market_engine_status():
+    """Status of the engine and telemetry of its last ticks.
+
+    `eintraege` limits the number of ticks included (default: all kept, see
+    `ENGINE_TICK_HISTORY`); the summary always covers all kept ticks. If the
+    engine runs in another process (see `engine_coordinator`), the status it
+    published is returned.
+    """
+    engine = current_app.config["MARKET_ENGINE"]
+    num_ticks = request.args.get("eintraege", default=None, type=int)
+    if num_ticks is not None and num_ticks < 0:
+        return jsonify({"error": "Ungültige Anzahl an Einträgen"}), 400
+    coordinator = current_app.config.get("ENGINE_COORDINATOR")
+    if coordinator is not None:
+        return jsonify(await coordinator.get_status(num_ticks))
+    is_running = engine.is_running()
+    num_loaded = engine.get_num_stocks()
+    return jsonify({"is_running": is_running, "num_loaded": num_loaded,
+                    "ticks": engine.stats.to_dict(num_ticks)})
 
 
 @api.route('/markt/start')
-def start_market_engine():
-    current_app.config["MARKET_ENGINE"].threadsafe_start()
+async def start_market_engine():
+    coordinator = current_app.config.get("ENGINE_COORDINATOR")
+    if coordinator is not None:
+        await coordinator.set_running(True)
+    else:
+        current_app.config["MARKET_ENGINE"].threadsafe_start()
     return ('', 200)
 
 
 @api.route('/markt/stop')
-def stop_market_engine():
-    current_app.config["MARKET_ENGINE"].threadsafe_stop()
+async def stop_market_engine():
+    coordinator = current_app.config.get("ENGINE_COORDINATOR")
+    if coordinator is not None:
+        await coordinator.set_running(False)
+    else:
+        current_app.config["MARKET_ENGINE"].threadsafe_stop()
     return ('', 200)
 
+
+@api.route('/metrics')
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
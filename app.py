@@ -21,6 +21,9 @@ def create_app(config=None):
 
     app = Quart(__name__, static_folder='static', template_folder='templates')
 
+    from json_provider import FastJSONProvider
+    app.json = FastJSONProvider(app)
+
     app.config.from_pyfile('default_config.py')
     app.config.from_pyfile('config.py', silent=True)
     if config is not None:
@@ -35,9 +38,27 @@ def create_app(config=None):
     from db import manage as db
     db.init_app(app)
 
+    from db import aio
+    aio.init_app(app)
+
     import market_engine
     market_engine.init_app(app)
 
+    import engine_coordinator
+    engine_coordinator.init_app(app)
+
+    import price_stream
+    price_stream.init_app(app)
+
+    import response_cache
+    response_cache.init_app(app)
+
+    import trade_queue
+    trade_queue.init_app(app)
+
+    import metrics
+    metrics.init_app(app)
+
     app.logger.info("Created app.")
 
     return app
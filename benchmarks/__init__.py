@@ -0,0 +1,13 @@
+"""Microbenchmarks of the hot paths of the market engine, database and API.
+
+The benchmarks run offline against in-memory databases of the SQLite backend
+(see `db.sqlite`) and compare their results with the stored
+`baseline.json`::
+
+    python -m benchmarks                    # run and compare with the baseline
+    python -m benchmarks -k api. -o out.json
+    python -m benchmarks --save-baseline    # after intended changes
+
+Timings depend on the machine, so the baseline should be recorded on the
+machine used for the event.
+"""
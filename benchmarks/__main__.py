@@ -0,0 +1,84 @@
+import asyncio
+import json
+import os
+import sys
+
+import click
+
+from db import sqlite
+
+from . import bench_api, bench_data, bench_engine
+from .fixtures import create_app
+from .runner import (compare, format_time, load_results, run_all,
+                     save_results)
+
+MODULES = [bench_engine, bench_data, bench_api]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+async def _run(keyword: str, rounds: int, report) -> dict:
+    app = create_app(sqlite.connect(":memory:"))
+    async with app.app_context():
+        benchmarks = []
+        for module in MODULES:
+            benchmarks += await module.collect(app)
+        benchmarks = [b for b in benchmarks if keyword in b.name]
+        return await run_all(benchmarks, rounds, report)
+
+
+@click.command()
+@click.option("-k", "--keyword", default="",
+              help="Only run benchmarks whose name contains KEYWORD.")
+@click.option("-r", "--rounds", type=int, default=7, show_default=True,
+              help="Number of timed rounds per benchmark.")
+@click.option("-o", "--output", type=click.Path(dir_okay=False),
+              help="Write the results as JSON ('-' for stdout).")
+@click.option("--baseline", type=click.Path(dir_okay=False),
+              default=DEFAULT_BASELINE, show_default=True)
+@click.option("--save-baseline", is_flag=True, default=False,
+              help="Store the results as the new baseline.")
+@click.option("--tolerance", type=float, default=0.25, show_default=True,
+              help="Allowed slowdown (fraction of the baseline).")
+def main(keyword, rounds, output, baseline, save_baseline, tolerance):
+    """Run the benchmarks and compare them with the baseline.
+
+    Exits with status 1 if a benchmark is slower than its baseline by more
+    than the tolerance.
+    """
+    def report(name, result):
+        click.echo(f"{name:<56} {format_time(result['median']):>10} "
+                   f"(min {format_time(result['min'])})", err=True)
+
+    results = asyncio.run(_run(keyword, rounds, report))
+    if output == "-":
+        click.echo(json.dumps(results, indent=2, sort_keys=True))
+    elif output:
+        save_results(output, results)
+    if save_baseline:
+        save_results(baseline, results)
+        click.echo(f"saved baseline to {baseline}", err=True)
+        return
+    if not os.path.exists(baseline):
+        click.echo(f"no baseline at {baseline}", err=True)
+        return
+
+    regressions = 0
+    click.echo(f"\n{'benchmark':<56} {'min':>10} {'baseline':>10} {'ratio':>7}",
+               err=True)
+    for entry in compare(results, load_results(baseline), tolerance):
+        if keyword not in entry["name"]:
+            continue
+        ratio = f"{entry['ratio']:.2f}" if entry["ratio"] is not None else "-"
+        flag = "  REGRESSION" if entry["regressed"] else ""
+        click.echo(f"{entry['name']:<56} {format_time(entry['min']):>10} "
+                   f"{format_time(entry['baseline']):>10} {ratio:>7}{flag}",
+                   err=True)
+        regressions += entry["regressed"]
+    if regressions:
+        click.echo(f"{regressions} benchmarks regressed by more than "
+                   f"{tolerance:.0%}", err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmarks of the `/api/kurse/*` and `/api/aktien/*` handlers.
+
+Requests go through Quart's test client, so routing, the handlers, the JSON
+provider and the database access (via `db.aio`) are included, the network
+isn't. Unless noted otherwise, the response cache is disabled.
+"""
+from datetime import datetime, timezone
+
+from quart import Quart
+from quart.json.provider import DefaultJSONProvider
+
+from response_cache import ResponseCache
+
+from .fixtures import ENGINE_INTERVAL, create_db, create_engine
+from .runner import Benchmark
+
+NUM_STOCKS = 50
+NUM_PRICES = 200
+NUM_TRADES = 20
+
+
+def _get(app: Quart, path: str):
+    client = app.test_client()
+
+    async def request():
+        response = await client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {path} failed with {response.status_code}")
+        await response.get_data()
+    return request
+
+
+def _json_response(provider: DefaultJSONProvider, payload: dict):
+    """Serialize `payload` like a handler returning it (`provider.response`)."""
+    async def respond():
+        await provider.response(payload).get_data()
+    return respond
+
+
+async def collect(app: Quart) -> list[Benchmark]:
+    db = create_db(NUM_STOCKS, NUM_PRICES, num_trades=NUM_TRADES)
+    app.config["BENCHMARK_DB"] = db
+    engine = await create_engine(app, db)
+    app.config["MARKET_ENGINE"] = engine
+    since = int((datetime.now(timezone.utc) - 3 * ENGINE_INTERVAL).timestamp())
+
+    def without_engine():
+        app.config.pop("MARKET_ENGINE")
+
+    def with_engine():
+        app.config["MARKET_ENGINE"] = engine
+
+    def with_cache():
+        cache = ResponseCache(app.config["RESPONSE_CACHE_SIZE"],
+                              app.config["RESPONSE_CACHE_MAX_AGE"])
+        cache.tick_store = engine.tick_store
+        app.config["RESPONSE_CACHE"] = cache
+
+    def without_cache():
+        app.config.pop("RESPONSE_CACHE")
+
+    def get(name: str, path: str, number: int = 20, **kwargs) -> Benchmark:
+        return Benchmark(name, _get(app, path), number=number, **kwargs)
+
+    # the payload of /api/kurse/verlauf/?eintraege=20
+    histories = {stock_id: engine.tick_store.get_history(stock_id, 20)
+                 for stock_id in range(1, NUM_STOCKS + 1)}
+
+    return [
+        Benchmark("api.json_response[orjson]",
+                  _json_response(app.json, histories), number=20),
+        Benchmark("api.json_response[json]",
+                  _json_response(DefaultJSONProvider(app), histories),
+                  number=20),
+        get("api.kurse.verlauf[alle]", "/api/kurse/verlauf/?eintraege=20"),
+        get("api.kurse.verlauf[alle,spalten]",
+            "/api/kurse/verlauf/?eintraege=20&format=spalten"),
+        get("api.kurse.verlauf[alle,seit]",
+            f"/api/kurse/verlauf/?eintraege=20&format=spalten&seit={since}"),
+        get("api.kurse.verlauf[alle,datenbank]", "/api/kurse/verlauf/?eintraege=20",
+            number=5, setup=without_engine, teardown=with_engine),
+        get("api.kurse.verlauf[alle,cache]", "/api/kurse/verlauf/?eintraege=20",
+            number=200, setup=with_cache, teardown=without_cache),
+        get("api.kurse.verlauf[1]", "/api/kurse/verlauf/1?eintraege=20", number=100),
+        get("api.kurse.vorschau[alle]", "/api/kurse/vorschau/"),
+        get("api.kurse.vorschau[1]", "/api/kurse/vorschau/1", number=100),
+        get("api.kurse.kerzen[1,1h]", "/api/kurse/kerzen/1?aufloesung=1h",
+            number=100),
+        get("api.aktien[alle]", "/api/aktien/"),
+        get("api.aktien[1]", "/api/aktien/1", number=100),
+        get("api.aktien.summary[alle]", "/api/aktien/summary/"),
+        get("api.aktien.summary[1]", "/api/aktien/1/summary", number=100),
+    ]
@@ -0,0 +1,27 @@
+"""Benchmarks of the row mapping (and row formats) in `db.read_value`."""
+from quart import Quart
+
+from db import read_value
+
+from .fixtures import create_db
+from .runner import Benchmark
+
+SQL = """SELECT stock_id, valid_after, price FROM prices
+ORDER BY stock_id, valid_after"""
+
+
+async def collect(app: Quart) -> list[Benchmark]:
+    db = create_db(10, 1000)
+    return [
+        Benchmark("db.read_value[first]",
+                  lambda: read_value(db, SQL, fetch_rows="first"), number=200),
+        Benchmark("db.read_value[100]",
+                  lambda: read_value(db, SQL, fetch_rows=100), number=50),
+        Benchmark("db.read_value[all]",
+                  lambda: read_value(db, SQL, fetch_rows="all"), number=2),
+        *(Benchmark(f"db.read_value[all,{row_format}]",
+                    lambda row_format=row_format: read_value(
+                        db, SQL, fetch_rows="all", row_format=row_format
+                    ), number=2)
+          for row_format in ("tuple", "namedtuple", "columns")),
+    ]
@@ -0,0 +1,66 @@
+"""Benchmarks of the market engine's tick."""
+from datetime import datetime, timezone
+
+from quart import Quart
+
+from db import sqlite
+from db import stock as stock_db
+from market_engine import BaseMarketEngine
+
+from .fixtures import ENGINE_PARAMS, create_db, create_engine
+from .runner import Benchmark
+
+NUM_STOCKS = [10, 1000, 10000]
+NUM_PRICES = 10
+
+
+def _reset(engine: BaseMarketEngine, db: sqlite.Connection,
+           histories: dict[int, list[dict]]):
+    """Restore the prices of the last run, without any previews."""
+    with db.cursor() as cursor:
+        cursor.execute("DELETE FROM prices WHERE valid_after > UTC_TIMESTAMP()")
+    for stock in engine._stocks:
+        rows = histories[stock.stock_id]
+        stock.prices.load(rows)
+        engine.tick_store.load_rows(stock.stock_id, rows)
+        engine.candles.set_pending(stock.stock_id, rows)
+
+
+async def _update_stocks_benchmark(app: Quart, num_stocks: int) -> Benchmark:
+    db = create_db(num_stocks, NUM_PRICES, num_previews=0)
+    engine = await create_engine(app, db)
+    histories = stock_db.get_price_histories(db, fetch_rows=NUM_PRICES)
+
+    async def update_stocks():
+        await engine._update_stocks(app)
+
+    return Benchmark(f"engine.update_stocks[{num_stocks}]", update_stocks,
+                     setup=lambda: _reset(engine, db, histories))
+
+
+async def collect(app: Quart) -> list[Benchmark]:
+    benchmarks = [await _update_stocks_benchmark(app, n) for n in NUM_STOCKS]
+
+    db = create_db(1000, NUM_PRICES)
+    for engine_class in ENGINE_PARAMS:
+        engine = await create_engine(app, db, engine_class)
+        stock = engine._stocks[0]
+        benchmarks.append(Benchmark(
+            f"engine.generate_price[{engine_class.__name__}]",
+            lambda engine=engine, stock=stock: engine._generate_price(stock, app),
+            number=1000
+        ))
+        benchmarks.append(Benchmark(
+            f"engine.generate_prices[{engine_class.__name__}][1000]",
+            lambda engine=engine: engine._generate_prices(engine._stocks, app),
+            number=20
+        ))
+
+    stock = engine._stocks[0]
+    now = datetime.now(timezone.utc)
+    benchmarks.append(Benchmark("engine.get_latest_price", stock.get_latest_price,
+                                number=10000))
+    benchmarks.append(Benchmark("engine.get_current_price",
+                                lambda: stock.get_current_price(now),
+                                number=10000))
+    return benchmarks
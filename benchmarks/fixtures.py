@@ -0,0 +1,146 @@
+"""In-memory SQLite databases and an app and market engine using them."""
+import logging
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from quart import Quart, g
+
+from api import api
+from db import aio, sqlite
+from db import stock as stock_db
+from db.tables import _create_tables
+from json_provider import FastJSONProvider
+from market_engine import (BaseMarketEngine, GaussChangeMarketEngine,
+                           MarketEngineDBStock, RandomChangeMarketEngine,
+                           RandomMarketEngine)
+
+ENGINE_INTERVAL = timedelta(minutes=15)
+
+# parameters of every engine class, close to the defaults in `default_config`
+ENGINE_PARAMS = {
+    RandomMarketEngine: {"price_range": range(1, 20)},
+    RandomChangeMarketEngine: {"max_change": 2, "min_value": 1, "start_value": 4},
+    GaussChangeMarketEngine: {"sigma": 1.2, "min_value": 1, "start_value": 4},
+}
+
+
+def create_db(num_stocks: int, num_prices: int, num_previews: int = 1,
+              num_trades: int = 0, now: datetime = None) -> sqlite.Connection:
+    """Create a private in-memory database with `num_stocks` stocks.
+
+    Every stock gets `num_prices` valid prices, one per `ENGINE_INTERVAL` up
+    to `now`, followed by `num_previews` previews and `num_trades`
+    transactions (with matching positions). Prices are a deterministic
+    zig-zag, so repeated runs read the same data.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    now = now.replace(microsecond=0)
+    db = sqlite.connect(":memory:")
+    _create_tables(db)
+    stock_ids = range(1, num_stocks + 1)
+    db.begin()
+    with db.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO stocks (id, name, color) VALUES (?, ?, ?)",
+            [(i, f"Aktie {i}", "#%06X" % (i * 2654435761 % 0xFFFFFF))
+             for i in stock_ids]
+        )
+        cursor.executemany(
+            "INSERT INTO prices (stock_id, valid_after, price) VALUES (?, ?, ?)",
+            ((stock_id, now + (step - num_prices + 1) * ENGINE_INTERVAL,
+              Decimal(400 + (stock_id * 7 + step) % 41 * 5).scaleb(-2))
+             for stock_id in stock_ids
+             for step in range(num_prices + num_previews))
+        )
+    db.commit()
+    trades = [(stock_id, (-1) ** trade * (trade % 5 + 1), trade % 5 + 1)
+              for stock_id in stock_ids for trade in range(num_trades)]
+    if trades:
+        stock_db.add_transactions(db, trades)
+    return db
+
+
+def create_app(db: sqlite.Connection) -> Quart:
+    """Create an app serving the API from `db`.
+
+    The market engine isn't started; benchmarks set `MARKET_ENGINE` as
+    needed (see `create_engine`).
+    """
+    app = Quart("dau_jones_benchmarks")
+    app.json = FastJSONProvider(app)
+    app.config.from_object("default_config")
+    app.config["BENCHMARK_DB"] = db
+    app.logger.setLevel(logging.WARNING)
+    app.register_blueprint(api)
+    aio.init_app(app)
+
+    @app.before_request
+    async def use_benchmark_db():
+        g.db = app.config["BENCHMARK_DB"]
+
+    return app
+
+
+def _benchmark_stock_class(db: sqlite.Connection) -> type[MarketEngineDBStock]:
+
+    class BenchmarkStock(MarketEngineDBStock):
+        """Engine stock writing its previews to the benchmark database."""
+        __slots__ = ()
+
+        def refresh(self):
+            self.prices.load(
+                stock_db.get_prices(db, self.stock_id, fetch_rows=self.prices.maxlen)
+            )
+
+        def _push_value(self, new_price, new_valid):
+            stock_db.add_price_preview(db, self.stock_id, new_valid, new_price)
+            self._apply_value(new_price, new_valid)
+
+        @staticmethod
+        def _write_values(rows):
+            stock_db.add_price_previews(db, rows)
+
+    return BenchmarkStock
+
+
+class _BenchmarkEngineMixin:
+    """Read stocks from `self.db` instead of `db.manage.engine_db`."""
+    db: sqlite.Connection
+
+    def _load_versions(self):
+        return stock_db.list_stock_versions(self.db)
+
+    def _load_histories(self, stock_ids):
+        if not stock_ids:
+            return {}
+        return stock_db.get_price_histories(
+            self.db, stock_ids, fetch_rows=self.tick_store.maxlen,
+            include_previews=True
+        )
+
+    def _load_candles(self, stock_ids):
+        if not stock_ids:
+            return {}
+        return self.candles.load(self.db, stock_ids)
+
+    def _load_prices(self, stock_id):
+        return stock_db.get_prices(self.db, stock_id,
+                                   fetch_rows=self.tick_store.maxlen)
+
+
+async def create_engine(app: Quart, db: sqlite.Connection,
+                        engine_class: type[BaseMarketEngine] = GaussChangeMarketEngine,
+                        **params) -> BaseMarketEngine:
+    """Create an engine of `engine_class` on `db` and load its stocks.
+
+    Has to be called within the app context of `app`.
+    """
+    engine_type = type(engine_class.__name__, (_BenchmarkEngineMixin, engine_class),
+                       {"stock_class": _benchmark_stock_class(db)})
+    params = {"interval": ENGINE_INTERVAL, "seed": 1234,
+              **ENGINE_PARAMS[engine_class], **params}
+    engine = engine_type(app, **params)
+    engine.db = db
+    await engine.reload_stocks()
+    return engine
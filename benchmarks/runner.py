@@ -0,0 +1,137 @@
+import asyncio
+import gc
+import inspect
+import json
+import platform
+import statistics
+import time
+from collections.abc import Callable
+from datetime import datetime, timezone
+from typing import Union
+
+
+class Benchmark:
+    """A timed function with optional setup and teardown.
+
+    `func` is called `number` times per round and the time per call is
+    recorded for each of `rounds` rounds. `setup` and `teardown` run before
+    and after every round and aren't timed. All three may be coroutine
+    functions. Like `timeit`, garbage collection is disabled while timing.
+    """
+    name: str
+    func: Callable
+    setup: Union[Callable, None]
+    teardown: Union[Callable, None]
+    number: int
+
+    def __init__(self, name: str, func: Callable, setup: Callable = None,
+                 teardown: Callable = None, number: int = 1):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.teardown = teardown
+        self.number = number
+
+    async def run(self, rounds: int) -> dict:
+        timings = []
+        for _ in range(rounds):
+            if self.setup is not None:
+                await _call(self.setup)
+            gc.collect()
+            gc.disable()
+            try:
+                elapsed = await self._time()
+            finally:
+                gc.enable()
+            if self.teardown is not None:
+                await _call(self.teardown)
+            timings.append(elapsed / self.number)
+        return {
+            "median": statistics.median(timings),
+            "min": min(timings),
+            "mean": statistics.fmean(timings),
+            "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            "rounds": rounds,
+            "number": self.number,
+        }
+
+    async def _time(self) -> float:
+        if inspect.iscoroutinefunction(self.func):
+            start = time.perf_counter()
+            for _ in range(self.number):
+                await self.func()
+            return time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(self.number):
+            self.func()
+        return time.perf_counter() - start
+
+
+async def _call(func: Callable):
+    result = func()
+    if inspect.isawaitable(result):
+        await result
+
+
+async def run_all(benchmarks: list[Benchmark], rounds: int,
+                  report: Callable = None) -> dict:
+    """Run `benchmarks` and return the results (see `save_results`)."""
+    results = {}
+    for benchmark in benchmarks:
+        results[benchmark.name] = await benchmark.run(rounds)
+        if report is not None:
+            report(benchmark.name, results[benchmark.name])
+        # let pending callbacks (e.g. executor results) settle between runs
+        await asyncio.sleep(0)
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def save_results(path: str, results: dict):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[dict]:
+    """Compare the time per call of every benchmark with `baseline`.
+
+    The fastest round is compared, as it is the least affected by other load
+    on the machine (see `timeit`). A benchmark regressed if it is more than
+    `tolerance` (a fraction) slower than in the baseline. Benchmarks missing
+    from either side are reported with a ratio of None.
+    """
+    comparison = []
+    names = results["results"].keys() | baseline["results"].keys()
+    for name in sorted(names):
+        current = results["results"].get(name)
+        previous = baseline["results"].get(name)
+        ratio = None
+        if current is not None and previous is not None and previous["min"]:
+            ratio = current["min"] / previous["min"]
+        comparison.append({
+            "name": name,
+            "min": current["min"] if current else None,
+            "baseline": previous["min"] if previous else None,
+            "ratio": ratio,
+            "regressed": ratio is not None and ratio > 1 + tolerance,
+        })
+    return comparison
+
+
+def format_time(seconds: Union[float, None]) -> str:
+    if seconds is None:
+        return "-"
+    for unit, factor in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= factor:
+            return f"{seconds / factor:.3g}{unit}"
+    return f"{seconds / 1e-9:.3g}ns"
@@ -0,0 +1,202 @@
+import re
+from array import array
+from bisect import insort
+from datetime import datetime, timezone
+from typing import Union
+
+from mariadb import Connection
+
+from db import stock as stock_db
+from tick_store import _normalize, _to_datetime, _to_decimal
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_resolution(resolution: str) -> int:
+    """Convert a resolution like `15m` or `1h` to seconds.
+
+    Raises ValueError for malformed resolutions.
+    """
+    match = re.fullmatch(r"(\d+)([smhd])", resolution.strip())
+    if match is None or int(match[1]) == 0:
+        raise ValueError(f"invalid resolution: {resolution!r}")
+    return int(match[1]) * _UNITS[match[2]]
+
+
+def format_resolution(seconds: int) -> str:
+    """Inverse of `parse_resolution`, using the largest fitting unit."""
+    for unit, size in sorted(_UNITS.items(), key=lambda u: -u[1]):
+        if seconds % size == 0:
+            return f"{seconds // size}{unit}"
+
+
+class CandleSeries:
+    """OHLC candles of a single stock at a single resolution.
+
+    Buckets are aligned to multiples of `resolution` seconds since the epoch
+    (UTC). Prices have to be added in chronological order, which makes every
+    addition O(1): it either updates the newest candle or starts a new one.
+    """
+    __slots__ = ("resolution", "_starts", "_open", "_high", "_low", "_close")
+    resolution: int
+    _starts: array
+    _open: array
+    _high: array
+    _low: array
+    _close: array
+
+    def __init__(self, resolution: int):
+        self.resolution = resolution
+        self._starts = array("q")
+        self._open = array("q")
+        self._high = array("q")
+        self._low = array("q")
+        self._close = array("q")
+
+    def __len__(self):
+        return len(self._starts)
+
+    def add(self, timestamp: int, cents: int):
+        start = timestamp - timestamp % self.resolution
+        if self._starts and self._starts[-1] == start:
+            self._high[-1] = max(self._high[-1], cents)
+            self._low[-1] = min(self._low[-1], cents)
+            self._close[-1] = cents
+        else:
+            self._starts.append(start)
+            self._open.append(cents)
+            self._high.append(cents)
+            self._low.append(cents)
+            self._close.append(cents)
+
+    def newest(self, num: int) -> list[dict]:
+        """Return the `num` newest candles, newest first."""
+        candles = []
+        for i in range(len(self) - 1, max(len(self) - num, 0) - 1, -1):
+            candles.append({
+                "start": _to_datetime(self._starts[i]),
+                "open": _to_decimal(self._open[i]),
+                "high": _to_decimal(self._high[i]),
+                "low": _to_decimal(self._low[i]),
+                "close": _to_decimal(self._close[i]),
+            })
+        return candles
+
+
+class StockCandles:
+    """Candles of a single stock at every maintained resolution.
+
+    Prices which aren't valid yet (previews) are held back in `_pending` and
+    folded into the candles once they become valid, so candles never reveal
+    future prices. Previews may still be edited until then.
+    """
+    __slots__ = ("stock_id", "series", "_pending", "_folded")
+    stock_id: int
+    series: dict[int, CandleSeries]
+    # (timestamp, cents) of prices which weren't valid at the last fold
+    _pending: list[tuple[int, int]]
+    # timestamp of the newest folded price
+    _folded: int
+
+    def __init__(self, stock_id: int, resolutions: list[int]):
+        self.stock_id = stock_id
+        self.series = {res: CandleSeries(res) for res in resolutions}
+        self._pending = []
+        self._folded = -1
+
+    def push(self, valid_after: datetime, price):
+        """Add a price. Prices older than the newest valid one are ignored."""
+        timestamp, cents = _normalize(valid_after, price)
+        if timestamp <= self._folded:
+            return
+        self._pending = [e for e in self._pending if e[0] != timestamp]
+        insort(self._pending, (timestamp, cents))
+
+    def set_pending(self, rows: list[dict]):
+        """Replace the pending previews with the newer ones of `rows`."""
+        entries = dict(_normalize(r["valid_after"], r["price"]) for r in rows)
+        self._pending = sorted(e for e in entries.items() if e[0] > self._folded)
+
+    def advance(self, now: datetime):
+        """Fold all pending prices which are valid at `now`."""
+        timestamp = now.timestamp()
+        num = 0
+        while num < len(self._pending) and self._pending[num][0] <= timestamp:
+            entry_time, cents = self._pending[num]
+            for series in self.series.values():
+                series.add(entry_time, cents)
+            self._folded = entry_time
+            num += 1
+        if num:
+            del self._pending[:num]
+
+
+class CandleStore:
+    """In-memory OHLC candles of all stocks loaded by the market engine.
+
+    Candles are maintained incrementally: the store is a push listener of the
+    engine and folds pushed prices into the candles of every resolution once
+    they become valid. The full history is only read when a stock is loaded.
+    """
+    resolutions: list[int]
+    _stocks: dict[int, StockCandles]
+
+    def __init__(self, resolutions: list[str]):
+        self.resolutions = sorted({parse_resolution(r) for r in resolutions})
+        self._stocks = {}
+
+    def __contains__(self, stock_id: int):
+        return stock_id in self._stocks
+
+    def load(self, db: Connection, stock_ids: list[int]) -> dict[int, StockCandles]:
+        """Build the candles of `stock_ids` from all their prices.
+
+        This only accesses the database and may be run in a worker thread.
+        Apply the result with `update`.
+        """
+        candles = {}
+        for stock_id, rows in stock_db.get_price_series(db, stock_ids).items():
+            candles[stock_id] = StockCandles(stock_id, self.resolutions)
+            candles[stock_id].set_pending(rows)
+        return candles
+
+    def update(self, candles: dict[int, StockCandles]):
+        self._stocks.update(candles)
+
+    def retain(self, stock_ids):
+        """Drop the candles of all stocks not contained in `stock_ids`."""
+        for stock_id in self._stocks.keys() - set(stock_ids):
+            del self._stocks[stock_id]
+
+    def set_pending(self, stock_id: int, rows: list[dict]):
+        """Replace the previews of a stock (e.g. after they were edited).
+
+        `rows` should contain at least all previews of the stock. Stocks
+        without candles start with `rows` as their full history.
+        """
+        if stock_id not in self._stocks:
+            self._stocks[stock_id] = StockCandles(stock_id, self.resolutions)
+        self._stocks[stock_id].set_pending(rows)
+
+    def on_push(self, stock, new_price, new_valid):
+        """Push listener for `MarketEngineStock.on_push_listeners`."""
+        if stock.stock_id not in self._stocks:
+            self._stocks[stock.stock_id] = StockCandles(stock.stock_id,
+                                                        self.resolutions)
+        self._stocks[stock.stock_id].push(new_valid, new_price)
+
+    def get_candles(self, stock_id: int, resolution: int, num: int,
+                    now: datetime = None) -> Union[list[dict], None]:
+        """Return the `num` newest candles (newest first).
+
+        Returns None if the stock isn't held in memory. The newest candle may
+        still change until its bucket has passed. Raises ValueError if
+        `resolution` (in seconds) isn't maintained.
+        """
+        if resolution not in self.resolutions:
+            raise ValueError(f"resolution not maintained: {resolution}")
+        if stock_id not in self._stocks:
+            return None
+        candles = self._stocks[stock_id]
+        candles.advance(now or datetime.now(timezone.utc))
+        return candles.series[resolution].newest(num)
@@ -1,11 +1,135 @@
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import suppress
+from functools import lru_cache
 from typing import Literal, Union
 from datetime import datetime, timezone
+from weakref import WeakKeyDictionary
 
 import mariadb
 
+from metrics import timed_statement
+
+from . import sqlite
+
+# max. number of prepared statements kept per connection (see `_statement`)
+STATEMENT_CACHE_SIZE = 64
+
+# connection -> {sql: _Statement}, least recently used first
+_statements: WeakKeyDictionary = WeakKeyDictionary()
+_statements_lock = threading.Lock()
+
+
+class _Statement:
+    """A prepared read-only cursor for one statement and its column names."""
+    __slots__ = ("cursor", "fields")
+    cursor: "mariadb.Cursor"
+    fields: Union[tuple[str, ...], None]
+
+    def __init__(self, cursor: "mariadb.Cursor"):
+        self.cursor = cursor
+        self.fields = None
+
+
+def _statement(connection: mariadb.Connection, sql: str) -> _Statement:
+    """Return the cached statement `sql` of the connection, preparing it if
+    necessary.
+
+    A connection is only used by one thread at a time, so only the lookup of
+    its cache is locked.
+    """
+    with _statements_lock:
+        cache = _statements.get(connection)
+        if cache is None:
+            cache = _statements[connection] = OrderedDict()
+    statement = cache.get(sql)
+    if statement is not None:
+        cache.move_to_end(sql)
+        return statement
+    statement = _Statement(connection.cursor(
+        cursor_type=mariadb.constants.CURSOR.READ_ONLY, prepared=True
+    ))
+    cache[sql] = statement
+    if len(cache) > STATEMENT_CACHE_SIZE:
+        _, evicted = cache.popitem(last=False)
+        _close_statement(evicted)
+    return statement
+
+
+def _discard_statement(connection: mariadb.Connection, sql: str):
+    """Remove the statement `sql` from the cache of the connection."""
+    with _statements_lock:
+        statement = _statements.get(connection, {}).pop(sql, None)
+    if statement is not None:
+        _close_statement(statement)
+
+
+def _close_statement(statement: _Statement):
+    # the connection may already be lost
+    with suppress(mariadb.Error):
+        statement.cursor.close()
+
+
+def clear_statements(connection: mariadb.Connection):
+    """Forget the prepared statements of the connection.
+
+    Required after reconnecting, as the server drops them with the session.
+    """
+    with _statements_lock:
+        _statements.pop(connection, None)
+
+
+@lru_cache(maxsize=256)
+def _row_class(fields: tuple[str, ...]) -> type:
+    # aliases like COUNT(*) aren't valid identifiers and are renamed to _<idx>
+    return namedtuple("Row", fields, rename=True)
+
+
+def _utc_column(values: tuple) -> list:
+    return [value.replace(tzinfo=timezone.utc) if value else value
+            for value in values]
+
+
+def _datetime_columns(rows: list[tuple]) -> list[int]:
+    """Return the indices of columns holding datetimes.
+
+    Only the first value which isn't None is checked per column.
+    """
+    indices = []
+    for i, value in enumerate(rows[0]):
+        if value is None:
+            value = next((row[i] for row in rows if row[i] is not None), None)
+        if isinstance(value, datetime):
+            indices.append(i)
+    return indices
+
+
+def _map_rows(rows: list[tuple], fields: tuple[str, ...],
+              row_format: str) -> Union[list, dict[str, list]]:
+    """Convert datetimes to UTC (column by column) and apply `row_format`."""
+    if not rows:
+        return {field: [] for field in fields} if row_format == "columns" else []
+    indices = _datetime_columns(rows)
+    if indices or row_format == "columns":
+        columns = list(zip(*rows))
+        for i in indices:
+            columns[i] = _utc_column(columns[i])
+        if row_format == "columns":
+            return {field: list(values) for field, values in zip(fields, columns)}
+        rows = zip(*columns)
+    if row_format == "dict":
+        return [dict(zip(fields, row)) for row in rows]
+    if row_format == "namedtuple":
+        return list(map(_row_class(fields)._make, rows))
+    return list(map(tuple, rows))
+
+
+RowFormat = Literal["dict", "tuple", "namedtuple", "columns"]
+
 
 def read_value(connection: mariadb.Connection, sql: str, *data,
-               fetch_rows: Union[int, Literal["all", "first"]] = "first"):
+               fetch_rows: Union[int, Literal["all", "first"]] = "first",
+               row_format: RowFormat = "dict"):
     """Execute a readonly statment on the connection.
 
     Map the result to a [list of] dictionary with names based on the selected
@@ -13,32 +137,65 @@ def read_value(connection: mariadb.Connection, sql: str, *data,
      - "first": Retrieve the first row and return it.
      - "all": Retrieve all rows (using fetchall).
      - `int`: Retrieve the specified number of rows.
-    """
-    with connection.cursor(
-            cursor_type=mariadb.constants.CURSOR.READ_ONLY
-    ) as cursor:
-        # print(f"executing SQL:\n{sql}\nwith data: {data}")
 
-        cursor.execute(sql, data)
+    `row_format` selects cheaper representations of the rows:
+     - "dict" (default): a dict per row as described above.
+     - "tuple": a tuple per row, in the order of the selected fields.
+     - "namedtuple": a namedtuple per row (aliases which aren't valid
+       identifiers are renamed to `_<index>`).
+     - "columns": a dict mapping every field to the list of its values. With
+       "first", the row is returned as a dict.
 
-        def try_set_timezones(values):
-            for i in range(len(values)):
-                if values[i] and isinstance(values[i], datetime):
-                    values[i] = values[i].replace(tzinfo=timezone.utc)
-            return values
+    Datetimes are returned in UTC. With MariaDB, statements are prepared once
+    per connection and kept (with their column names) for reuse, see
+    `STATEMENT_CACHE_SIZE`. The latency of the statement is recorded (see
+    `metrics`).
+    """
+    if isinstance(connection, sqlite.Connection):
+        # sqlite3 caches prepared statements itself, and a cursor kept open
+        # after a partial fetch would hold on to its read snapshot
+        with connection.cursor() as cursor:
+            rows = _fetch(cursor, sql, data, fetch_rows)
+            fields = cursor.metadata["field"]
+    else:
+        statement = _statement(connection, sql)
+        try:
+            rows = _fetch(statement.cursor, sql, data, fetch_rows)
+        except BaseException:
+            # the cursor may be unusable (e.g. the connection was lost)
+            _discard_statement(connection, sql)
+            raise
+        if statement.fields is None:
+            statement.fields = tuple(statement.cursor.metadata["field"])
+        fields = statement.fields
 
-        def map_dict(values):
-            return dict(zip(cursor.metadata["field"], values))
+    if fetch_rows == "first":
+        if not rows:
+            return None
+        return _map_rows(rows, fields,
+                         "dict" if row_format == "columns" else row_format)[0]
+    return _map_rows(rows, fields, row_format)
 
-        def parse_values(values):
-            return map_dict(try_set_timezones(list(values)))
 
+def _fetch(cursor, sql: str, data: tuple,
+           fetch_rows: Union[int, Literal["all", "first"]]) -> list[tuple]:
+    with timed_statement(sql):
+        cursor.execute(sql, data)
         if fetch_rows == "first":
-            value = cursor.fetchone()
-            if value is None:
-                return None
-            return parse_values(value)
+            row = cursor.fetchone()
+            return [row] if row is not None else []
         elif fetch_rows == "all":
-            return [parse_values(v) for v in cursor.fetchall()]
-        else:
-            return [parse_values(v) for v in cursor.fetchmany(fetch_rows)]
+            return cursor.fetchall()
+        return cursor.fetchmany(fetch_rows)
+
+
+def execute(cursor, sql: str, data=()):
+    """Execute a (writing) statement on the cursor, recording its latency."""
+    with timed_statement(sql):
+        cursor.execute(sql, data)
+
+
+def execute_many(cursor, sql: str, data):
+    """Like `execute`, for `cursor.executemany`."""
+    with timed_statement(sql):
+        cursor.executemany(sql, data)
@@ -0,0 +1,129 @@
+"""Awaitable access to the (blocking) database functions.
+
+The mariadb connector blocks the calling thread for every statement. To keep
+the event loop responsive, the wrappers in this module run the blocking calls
+on a bounded thread pool. The calling context (and thereby the app context) is
+copied to the worker thread, so `get_db` and `current_app` behave as usual.
+
+Usage mirrors the synchronous functions::
+
+    db = await aio.get_db()
+    history = await aio.stock.get_price_history(db, stock_id, fetch_rows=10)
+
+Pooled connections are reserved on the event loop before a worker checks one
+out (see `reserve_connection`), so workers never wait for an exhausted pool
+while the connections they wait for can't be used or returned.
+"""
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial, wraps
+from types import SimpleNamespace
+
+from quart import Quart, current_app, g
+
+from . import read_value as _read_value
+from . import manage as _manage
+from . import stock as _stock
+
+_executor: ThreadPoolExecutor = None
+# one slot per pooled connection
+_connections: asyncio.Semaphore = None
+_pool_timeout: float = None
+
+
+def init_app(app: Quart):
+    global _executor, _connections, _pool_timeout
+    _executor = ThreadPoolExecutor(
+        max_workers=app.config["DB_EXECUTOR_WORKERS"], thread_name_prefix="db"
+    )
+    _connections = asyncio.Semaphore(app.config["MARIADB_POOL_SIZE"])
+    _pool_timeout = app.config["MARIADB_POOL_TIMEOUT"]
+
+    @app.after_serving
+    async def shutdown_executor():
+        _executor.shutdown(wait=True)
+
+    # registered after `db.manage.close_db`, which returns the connection
+    @app.teardown_appcontext
+    async def release_connection(exception=None):
+        if g.pop("db_reserved", False):
+            _connections.release()
+
+
+async def run_sync(func, *args, **kwargs):
+    """Run the blocking `func` on the database thread pool and await it."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _executor, partial(context.run, func, *args, **kwargs)
+    )
+
+
+def _wrap(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_sync(func, *args, **kwargs)
+    return wrapper
+
+
+async def _reserve():
+    """Wait up to `MARIADB_POOL_TIMEOUT` seconds for a free pooled connection.
+
+    Raises `PoolError` (of `mariadb` or `db.sqlite`) afterwards.
+    """
+    if not _connections.locked():
+        await _connections.acquire()
+        return
+    _manage._count("exhausted")
+    current_app.logger.warning("connection pool exhausted, waiting")
+    start = time.monotonic()
+    try:
+        await asyncio.wait_for(_connections.acquire(), _pool_timeout)
+    except asyncio.TimeoutError:
+        _manage._count("timeouts")
+        raise _manage._driver().PoolError("No connection available in pool") from None
+    _manage._count("wait_seconds", time.monotonic() - start)
+
+
+@asynccontextmanager
+async def reserve_connection():
+    """Reserve a pooled connection for the `with` block.
+
+    For code checking out connections itself (e.g. with
+    `db.manage.pooled_db`) on the thread pool.
+    """
+    await _reserve()
+    try:
+        yield
+    finally:
+        _connections.release()
+
+
+async def get_db():
+    """Return the connection of the current app context, connecting if needed.
+
+    The connection is reserved until the app context is torn down.
+    """
+    if "db" in g:
+        return g.db
+    await _reserve()
+    try:
+        db = await run_sync(_manage.get_db)
+    except BaseException:
+        _connections.release()
+        raise
+    g.db_reserved = True
+    return db
+
+
+read_value = _wrap(_read_value)
+
+# awaitable versions of the public functions in `db.stock`
+stock = SimpleNamespace(**{
+    name: _wrap(func) for name, func in vars(_stock).items()
+    if callable(func) and not name.startswith("_")
+    and getattr(func, "__module__", None) == _stock.__name__
+})
@@ -0,0 +1,95 @@
+"""The lease electing the process which runs the market engine.
+
+Used by `engine_coordinator` if the app runs in several server processes. The
+`engine_lease` table holds one row per lease with its current owner, the time
+the lease expires unless renewed, whether the engine should be running and
+the status last published by the owner.
+"""
+from typing import Union
+
+from mariadb import Connection
+
+from . import execute, read_value
+
+
+def ensure_lease(db: Connection, name: str):
+    """Create the row of the lease `name` if it doesn't exist yet."""
+    with db.cursor() as cursor:
+        execute(cursor, """INSERT IGNORE INTO engine_lease (name) VALUES (?)""",
+                (name,))
+    db.commit()
+
+
+def get_lease(db: Connection, name: str) -> Union[dict, None]:
+    """Return the lease `name`.
+
+    `active` is true if the lease has an owner and hasn't expired yet,
+    according to the database's clock.
+    """
+    return read_value(db,
+        """SELECT *,
+        (owner IS NOT NULL AND expires_at >= UTC_TIMESTAMP()) AS active
+        FROM engine_lease WHERE name = (?)
+        """,
+        name, fetch_rows="first"
+    )
+
+
+def acquire_lease(db: Connection, name: str, owner: str,
+                  duration: float) -> Union[dict, None]:
+    """Acquire or renew the lease `name` for `owner` for `duration` seconds.
+
+    The lease is taken over if it has no owner or expired. Expiry is computed
+    and checked with the database's clock only, so differences between the
+    clocks of the processes don't matter. Returns the lease afterwards, so
+    `owner` holds the lease if its `owner` column matches.
+    """
+    with db.cursor() as cursor:
+        execute(cursor,
+            """UPDATE engine_lease
+            SET owner = (?), expires_at = UTC_TIMESTAMP() + INTERVAL (?) SECOND
+            WHERE name = (?)
+            AND (owner = (?) OR owner IS NULL OR expires_at < UTC_TIMESTAMP())
+            """,
+            (owner, duration, name, owner)
+        )
+    db.commit()
+    return get_lease(db, name)
+
+
+def release_lease(db: Connection, name: str, owner: str):
+    """Give up the lease `name` if it is held by `owner`."""
+    with db.cursor() as cursor:
+        execute(cursor,
+            """UPDATE engine_lease
+            SET owner = NULL, expires_at = NULL
+            WHERE name = (?) AND owner = (?)
+            """,
+            (name, owner)
+        )
+        db.commit()
+        return cursor.rowcount
+
+
+def set_lease_running(db: Connection, name: str, running: bool):
+    """Request the owner of the lease `name` to start or stop the engine."""
+    with db.cursor() as cursor:
+        execute(cursor,
+            """UPDATE engine_lease SET running = (?) WHERE name = (?)""",
+            (running, name)
+        )
+        db.commit()
+        return cursor.rowcount
+
+
+def set_lease_status(db: Connection, name: str, owner: str, status: str):
+    """Publish the engine's `status` (JSON) if `owner` holds the lease."""
+    with db.cursor() as cursor:
+        execute(cursor,
+            """UPDATE engine_lease SET status = (?)
+            WHERE name = (?) AND owner = (?)
+            """,
+            (status, name, owner)
+        )
+        db.commit()
+        return cursor.rowcount
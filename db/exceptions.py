@@ -22,4 +22,4 @@ class DBValueError(DatabaseError, ValueError):
         if message is None:
             message = str(column) + ": " + ("null" if value is None else str(value))
         self.message = message
-        super.__init__(self.message)
+        super().__init__(self.message)
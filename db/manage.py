@@ -1,11 +1,49 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
 import click
 import mariadb
 from quart import cli, current_app, g
 
+from . import clear_statements, sqlite
 from .tables import _create_tables, _drop_tables
 
+_pool: mariadb.ConnectionPool = None
+_pool_lock = threading.Lock()
+_pool_stats = {
+    "checkouts": 0,
+    "returns": 0,
+    "failed_health_checks": 0,
+    "exhausted": 0,
+    "timeouts": 0,
+    "wait_seconds": 0.0,
+}
+
+_engine_db: mariadb.Connection = None
+_engine_db_lock = threading.RLock()
+
+
+def _backend() -> str:
+    backend = current_app.config.get("DB_BACKEND", "mariadb")
+    if backend not in ("mariadb", "sqlite"):
+        raise ValueError(f"unknown DB_BACKEND: {backend!r}")
+    return backend
+
+
+def _driver():
+    """Return the module implementing the configured backend.
 
-def _connect_db(use_db=True, include_user=True):
+    Either `mariadb` or `db.sqlite`, which provides the same interface.
+    """
+    return sqlite if _backend() == "sqlite" else mariadb
+
+
+def _connect_db(use_db=True, include_user=True, **kwargs):
+    if _backend() == "sqlite":
+        # opened through the pool to share an in-memory database
+        return _get_pool().connect()
     conf = current_app.config["MARIADB_CONNECTION"].copy()
     if not use_db:
         conf.pop("db", None)
@@ -13,33 +51,176 @@ def _connect_db(use_db=True, include_user=True):
     if not include_user:
         conf.pop("user", None)
         conf.pop("password", None)
-    connection = mariadb.connect(**conf)
+    connection = mariadb.connect(**conf, **kwargs)
     return connection
 
 
+def _get_pool() -> mariadb.ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None and _backend() == "sqlite":
+            _pool = sqlite.ConnectionPool(
+                pool_name="dau_jones",
+                pool_size=current_app.config["MARIADB_POOL_SIZE"],
+                database=current_app.config["SQLITE_DATABASE"],
+            )
+        elif _pool is None:
+            # connections aren't reset when returned (see `_release`), which
+            # would drop their prepared statements (see `db.read_value`)
+            _pool = mariadb.ConnectionPool(
+                pool_name="dau_jones",
+                pool_size=current_app.config["MARIADB_POOL_SIZE"],
+                pool_reset_connection=False,
+                **current_app.config["MARIADB_CONNECTION"],
+            )
+        return _pool
+
+
+def _count(stat, value=1):
+    with _pool_lock:
+        _pool_stats[stat] += value
+
+
+def _is_healthy(connection: mariadb.Connection) -> bool:
+    try:
+        connection.ping()
+        return True
+    except (mariadb.Error, sqlite.Error):
+        return False
+
+
+def _checkout() -> mariadb.Connection:
+    """Take a healthy connection from the pool.
+
+    Waits up to `MARIADB_POOL_TIMEOUT` seconds if all connections are in use
+    and raises `PoolError` (of `mariadb` or `db.sqlite`) afterwards.
+    """
+    pool = _get_pool()
+    start = time.monotonic()
+    deadline = start + current_app.config["MARIADB_POOL_TIMEOUT"]
+    exhausted = False
+    while True:
+        try:
+            connection = pool.get_connection()
+        except (mariadb.PoolError, sqlite.PoolError):
+            connection = None
+        if connection is not None:
+            break
+        if not exhausted:
+            exhausted = True
+            _count("exhausted")
+            current_app.logger.warning("connection pool exhausted, waiting")
+        if time.monotonic() >= deadline:
+            _count("timeouts")
+            raise _driver().PoolError("No connection available in pool")
+        time.sleep(0.01)
+    if exhausted:
+        _count("wait_seconds", time.monotonic() - start)
+    if not _is_healthy(connection):
+        _count("failed_health_checks")
+        connection.reconnect()
+        clear_statements(connection)
+    _count("checkouts")
+    return connection
+
+
+def _release(connection: mariadb.Connection):
+    """Return the connection to the pool.
+
+    The pool doesn't reset connections, so an open transaction (and its
+    snapshot for reads) is rolled back here.
+    """
+    try:
+        connection.rollback()
+    finally:
+        # returns the connection to the pool
+        connection.close()
+        _count("returns")
+
+
+def pool_stats() -> dict:
+    """Return counters of the connection pool (since process start)."""
+    with _pool_lock:
+        stats = dict(_pool_stats)
+        stats["in_use"] = stats["checkouts"] - stats["returns"]
+        if _pool is not None:
+            stats["size"] = _pool.pool_size
+    return stats
+
+
 def close_db(exception=None):
     db = g.pop('db', None)
 
     if db is not None:
         # FIXME causes an error when db is closed earlier
-        db.close()
+        try:
+            _release(db)
+        except (mariadb.Error, sqlite.Error):
+            # must not keep `db.aio` from releasing its reservation
+            current_app.logger.exception("returning a connection failed")
 
 
 def get_db():
     if 'db' not in g:
-        g.db = _connect_db()
+        g.db = _checkout()
     return g.db
 
 
+@contextmanager
+def pooled_db():
+    """Borrow a connection from the pool outside of an app context's `g`.
+
+    For long-running background tasks which must not hold a connection
+    between uses.
+    """
+    connection = _checkout()
+    try:
+        yield connection
+    finally:
+        _release(connection)
+
+
+@contextmanager
+def engine_db():
+    """Use the dedicated connection of the market engine.
+
+    The connection isn't shared with request handlers and is held across app
+    contexts. Access is serialized, so nested use within a thread is fine but
+    other threads block until the connection is released. Autocommit is
+    enabled so that reads aren't answered from a stale transaction snapshot.
+    """
+    global _engine_db
+    with _engine_db_lock:
+        if _engine_db is None:
+            _engine_db = _connect_db(autocommit=True)
+        elif not _is_healthy(_engine_db):
+            current_app.logger.warning("reconnecting market engine database")
+            _engine_db.reconnect()
+            clear_statements(_engine_db)
+        yield _engine_db
+
+
 def init_app(app):
     app.teardown_appcontext(close_db)
+
+    @app.before_serving
+    async def create_sqlite_tables():
+        # embedded databases are set up on start, in-memory ones are empty
+        if app.config.get("DB_BACKEND") == "sqlite":
+            with pooled_db() as db:
+                _create_tables(db, skip_existing=True)
+
     app.cli.add_command(init_db)
+    app.cli.add_command(rebuild_positions)
+    app.cli.add_command(archive_prices)
 
 
 @click.command('init-db')
 @click.option('--overwrite/--no-overwrite', default=False)
+@click.option('--upgrade', is_flag=True, default=False,
+              help="Only create tables which don't exist yet.")
 @cli.with_appcontext
-def init_db(overwrite=False):
+def init_db(overwrite=False, upgrade=False):
     """Connect to database and initialize table structure.
 
     This requires a valid user with access to the database to be configured in
@@ -50,5 +231,44 @@ def init_db(overwrite=False):
     if overwrite:
         num_dropped = _drop_tables(db, fail_on_missing=False)
         click.echo(f"dropped {num_dropped} tables.")
-    num_created = _create_tables(db)
+    num_created = _create_tables(db, skip_existing=upgrade)
     click.echo(f"created {num_created} tables.")
+
+
+@click.command('rebuild-positions')
+@cli.with_appcontext
+def rebuild_positions():
+    """Recompute the per-stock position totals from all transactions.
+
+    Needed once after adding the `positions` table to an existing database.
+    """
+    from .stock import rebuild_positions as _rebuild_positions
+    num_stocks = _rebuild_positions(get_db())
+    click.echo(f"rebuilt positions of {num_stocks} stocks.")
+
+
+@click.command('archive-prices')
+@click.option('--keep-hours', type=float, default=None,
+              help="Keep prices of the last hours in the hot table "
+              "(default: PRICE_RETENTION_HOURS).")
+@click.option('--downsample-minutes', type=int, default=None,
+              help="Only archive the last price per stock and interval "
+              "(default: PRICE_ARCHIVE_DOWNSAMPLE_MINUTES, 0 keeps all).")
+@cli.with_appcontext
+def archive_prices(keep_hours=None, downsample_minutes=None):
+    """Move old prices from `prices` to the compressed `prices_archive`.
+
+    The newest valid price of each stock always stays in `prices`. Reads of
+    histories reaching past the retained prices fall back to the archive.
+    """
+    from .stock import archive_prices as _archive_prices
+    if keep_hours is None:
+        keep_hours = current_app.config["PRICE_RETENTION_HOURS"]
+    if downsample_minutes is None:
+        downsample_minutes = current_app.config["PRICE_ARCHIVE_DOWNSAMPLE_MINUTES"]
+    before = datetime.now(timezone.utc) - timedelta(hours=keep_hours)
+    num_removed, num_archived = _archive_prices(
+        get_db(), before, downsample=downsample_minutes * 60
+    )
+    click.echo(f"removed {num_removed} prices before {before:%Y-%m-%d %H:%M} "
+               f"UTC, archived {num_archived}.")
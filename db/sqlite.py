@@ -0,0 +1,296 @@
+"""Embedded SQLite backend with the interface of the mariadb connector.
+
+Selected with `DB_BACKEND = "sqlite"` (see `db.manage`). `connect` and
+`ConnectionPool` mirror the parts of `mariadb` used by the `db` package and
+the MariaDB specific SQL of `db.stock` is translated per statement, so the
+query functions work unchanged on both backends.
+
+File databases use WAL journaling, so readers don't block the writer and
+every pooled connection reads committed data only. The in-memory database
+(`":memory:"`) lives in a single SQLite connection which is shared by all
+connections of a pool; transactions on it are serialized by a lock.
+
+Like MariaDB, statements are committed immediately unless a transaction was
+started with `begin()`, DATETIME values are returned as naive datetimes in
+UTC and DECIMAL values as `Decimal`.
+"""
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+from typing import Union
+
+Error = sqlite3.Error
+
+
+class PoolError(Error):
+    """Raised if no connection is available in the pool."""
+
+
+PRICE_QUANTUM = Decimal("0.01")
+
+# (pattern, replacement) applied to every statement, in order
+_TRANSLATIONS = [
+    (re.compile(r"UTC_TIMESTAMP\(\) \+ INTERVAL \(\?\) SECOND"),
+     "datetime('now', (?) || ' seconds')"),
+    (re.compile(r"UTC_TIMESTAMP\(\)"), "datetime('now')"),
+    (re.compile(r"INSERT IGNORE"), "INSERT OR IGNORE"),
+    # only used for `positions`, whose key is stock_id
+    (re.compile(r"ON DUPLICATE KEY UPDATE"), "ON CONFLICT (stock_id) DO UPDATE SET"),
+    (re.compile(r"VALUES\((\w+)\)"), r"excluded.\1"),
+    (re.compile(r"TIMESTAMPDIFF\(SECOND, '1970-01-01', (\w+)\)"),
+     r"CAST(strftime('%s', \1) AS INTEGER)"),
+    (re.compile(r"\bDIV\b"), "/"),
+    (re.compile(r"\bGREATEST\("), "MAX("),
+    (re.compile(r"\bLEAST\("), "MIN("),
+]
+
+
+@lru_cache(maxsize=256)
+def translate(sql: str) -> str:
+    """Rewrite a MariaDB statement of `db.stock` for SQLite."""
+    for pattern, replacement in _TRANSLATIONS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def _adapt_datetime(value: datetime) -> str:
+    # stored like MariaDB's DATETIME: UTC, without fractional seconds
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _to_datetime(value) -> Union[datetime, None]:
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _to_decimal(value) -> Union[Decimal, None]:
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(PRICE_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_adapter(Decimal, str)
+
+# SQLite doesn't keep the type of expressions (e.g. `MAX(valid_after)`), so
+# DATETIME and DECIMAL values are converted by column name.
+COLUMN_TYPES = {
+    "valid_after": _to_datetime,
+    "created_at": _to_datetime,
+    "updated_at": _to_datetime,
+    "expires_at": _to_datetime,
+    "price": _to_decimal,
+    "total_purchase_price": _to_decimal,
+    "traded_value": _to_decimal,
+}
+
+
+def _open(database: str, timeout: float) -> sqlite3.Connection:
+    connection = sqlite3.connect(database, timeout=timeout, isolation_level=None,
+                                 check_same_thread=False)
+    connection.execute("PRAGMA foreign_keys = ON")
+    if database != ":memory:":
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+    return connection
+
+
+class Cursor:
+    """Cursor with the `mariadb.Cursor` attributes used by the `db` package."""
+    _connection: "Connection"
+    _cursor: sqlite3.Cursor
+    _converters: list
+    metadata: dict
+
+    def __init__(self, connection: "Connection"):
+        self._connection = connection
+        self._cursor = connection._connection.cursor()
+        self._converters = []
+        self.metadata = {"field": ()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self) -> int:
+        return self._cursor.lastrowid
+
+    def _update_metadata(self):
+        fields = tuple(column[0] for column in self._cursor.description or ())
+        self.metadata = {"field": fields}
+        self._converters = [(i, COLUMN_TYPES[field]) for i, field in enumerate(fields)
+                            if field in COLUMN_TYPES]
+
+    def _convert(self, row: tuple) -> tuple:
+        if not self._converters:
+            return row
+        row = list(row)
+        for i, convert in self._converters:
+            row[i] = convert(row[i])
+        return tuple(row)
+
+    def execute(self, sql: str, data=()):
+        with self._connection._lock:
+            self._cursor.execute(translate(sql), tuple(data))
+        self._update_metadata()
+
+    def executemany(self, sql: str, data):
+        with self._connection._lock:
+            self._cursor.executemany(translate(sql), data)
+        self._update_metadata()
+
+    def fetchone(self) -> Union[tuple, None]:
+        with self._connection._lock:
+            row = self._cursor.fetchone()
+        return self._convert(row) if row is not None else None
+
+    def fetchmany(self, size: int) -> list[tuple]:
+        with self._connection._lock:
+            rows = self._cursor.fetchmany(size)
+        return [self._convert(row) for row in rows]
+
+    def fetchall(self) -> list[tuple]:
+        with self._connection._lock:
+            rows = self._cursor.fetchall()
+        return [self._convert(row) for row in rows]
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    """A connection to a SQLite database (see `connect`).
+
+    Connections of a pool are returned to it by `close`.
+    """
+    database: str
+    _connection: sqlite3.Connection
+    # held from `begin` until `commit` / `rollback`, shared if the SQLite
+    # connection is shared
+    _lock: threading.RLock
+    _shared: bool
+    _pool: Union["ConnectionPool", None]
+    _in_transaction: bool
+
+    def __init__(self, database: str, timeout: float = 5,
+                 shared: tuple[sqlite3.Connection, threading.RLock] = None,
+                 pool: "ConnectionPool" = None):
+        self.database = database
+        self._timeout = timeout
+        if shared is not None:
+            self._connection, self._lock = shared
+        else:
+            self._connection, self._lock = _open(database, timeout), threading.RLock()
+        self._shared = shared is not None
+        self._pool = pool
+        self._in_transaction = False
+
+    def cursor(self, cursor_type=None, **kwargs) -> Cursor:
+        return Cursor(self)
+
+    def begin(self):
+        self._lock.acquire()
+        try:
+            self._connection.execute("BEGIN")
+        except BaseException:
+            self._lock.release()
+            raise
+        self._in_transaction = True
+
+    def _end(self, statement: str):
+        if not self._in_transaction:
+            return
+        try:
+            self._connection.execute(statement)
+        finally:
+            self._in_transaction = False
+            self._lock.release()
+
+    def commit(self):
+        self._end("COMMIT")
+
+    def rollback(self):
+        self._end("ROLLBACK")
+
+    def ping(self):
+        with self._lock:
+            self._connection.execute("SELECT 1")
+
+    def reconnect(self):
+        if not self._shared:
+            self._connection.close()
+            self._connection = _open(self.database, self._timeout)
+
+    def close(self):
+        self.rollback()
+        if self._pool is not None:
+            self._pool._release(self)
+        elif not self._shared:
+            self._connection.close()
+
+
+def connect(database: str, timeout: float = 5, autocommit: bool = True,
+            **kwargs) -> Connection:
+    """Open a connection to the SQLite database file `database`.
+
+    `":memory:"` opens a new, private in-memory database (use
+    `ConnectionPool.connect` to share one). Statements outside of transactions
+    are always committed immediately, regardless of `autocommit`.
+    """
+    return Connection(database, timeout)
+
+
+class ConnectionPool:
+    """A fixed number of connections to `database`, like `mariadb.ConnectionPool`.
+
+    All connections of the pool to `":memory:"` share one database.
+    """
+    pool_name: str
+    pool_size: int
+    database: str
+    _shared: Union[tuple[sqlite3.Connection, threading.RLock], None]
+    _idle: list[Connection]
+    _pool_lock: threading.Lock
+
+    def __init__(self, pool_name: str, pool_size: int = 5,
+                 database: str = ":memory:", timeout: float = 5, **kwargs):
+        self.pool_name = pool_name
+        self.pool_size = pool_size
+        self.database = database
+        self._timeout = timeout
+        self._shared = None
+        if database == ":memory:":
+            self._shared = (_open(database, timeout), threading.RLock())
+        self._idle = [Connection(database, timeout, self._shared, pool=self)
+                      for _ in range(pool_size)]
+        self._pool_lock = threading.Lock()
+
+    def get_connection(self) -> Connection:
+        with self._pool_lock:
+            if not self._idle:
+                raise PoolError("No connection available in pool")
+            return self._idle.pop()
+
+    def _release(self, connection: Connection):
+        with self._pool_lock:
+            self._idle.append(connection)
+
+    def connect(self) -> Connection:
+        """Open an additional connection to the pool's database.
+
+        It isn't part of the pool (and not limited by `pool_size`).
+        """
+        return Connection(self.database, self._timeout, self._shared)
@@ -1,11 +1,11 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Literal, Union
 
 from mariadb import Connection
 from quart import current_app
 from string import hexdigits
 
-from . import read_value, exceptions
+from . import execute, execute_many, read_value, exceptions
 
 
 def _ensure_stock(db: Connection, stock_id: int):
@@ -14,13 +14,34 @@ def _ensure_stock(db: Connection, stock_id: int):
         raise exceptions.StockIdError(stock_id)
 
 
+def _with_archived(db: Connection, columns: str, stock_id: int, rows: list[dict],
+                   fetch_rows: Union[int, Literal["all", "first"]]):
+    """Continue `rows` (newest first) with archived prices if necessary.
+
+    `prices` always holds the newest valid price of each stock (see
+    `archive_prices`), so single rows never have to be read from the archive.
+    """
+    if fetch_rows == "first" or (fetch_rows != "all" and len(rows) >= fetch_rows):
+        return rows
+    conditions, data = ["stock_id = (?)"], [stock_id]
+    if rows:
+        conditions.append("valid_after < (?)")
+        data.append(rows[-1]["valid_after"])
+    sql = f"""SELECT {columns} FROM prices_archive
+    WHERE {" AND ".join(conditions)}
+    ORDER BY valid_after DESC"""
+    remaining = fetch_rows if fetch_rows == "all" else fetch_rows - len(rows)
+    return rows + read_value(db, sql, *data, fetch_rows=remaining)
+
+
 def get_prices(db: Connection, stock_id: int,
                fetch_rows: Union[int, Literal["all", "first"]] = 1):
     sql = """SELECT valid_after, price FROM prices
     WHERE stock_id = (?)
     ORDER BY valid_after DESC"""
     _ensure_stock(db, stock_id)
-    return read_value(db, sql, stock_id, fetch_rows=fetch_rows)
+    rows = read_value(db, sql, stock_id, fetch_rows=fetch_rows)
+    return _with_archived(db, "valid_after, price", stock_id, rows, fetch_rows)
 
 
 def get_price_current(db: Connection, stock_id: int):
@@ -39,7 +60,8 @@ def get_price_history(db: Connection, stock_id: int,
     ORDER BY valid_after DESC
     """
     _ensure_stock(db, stock_id)
-    return read_value(db, sql, stock_id, fetch_rows=fetch_rows)
+    rows = read_value(db, sql, stock_id, fetch_rows=fetch_rows)
+    return _with_archived(db, "*", stock_id, rows, fetch_rows)
 
 
 def get_price_preview(db: Connection, stock_id: int,
@@ -56,24 +78,233 @@ def get_price_preview(db: Connection, stock_id: int,
     return read_value(db, sql, stock_id, fetch_rows=fetch_rows)
 
 
+def _placeholders(values: list) -> str:
+    return ", ".join("?" * len(values))
+
+
+def _count_changes(cursor, stock_ids: list[int], edited: bool = True):
+    """Count a change of every stock in `stock_ids` (see `list_stock_versions`).
+
+    Has to run in the transaction making the changes. `edited` is unset for
+    changes which only add prices after the furthest one.
+    """
+    execute_many(cursor,
+        """INSERT INTO stock_versions (stock_id, version, edits)
+        VALUES (?, 1, ?)
+        ON DUPLICATE KEY UPDATE
+        version = version + 1,
+        edits = edits + VALUES(edits)""",
+        [(stock_id, int(edited)) for stock_id in stock_ids]
+    )
+
+
+def get_price_histories(db: Connection, stock_ids: Union[list[int], None] = None,
+                        fetch_rows: int = 1, include_previews: bool = False,
+                        since: datetime = None) -> dict[int, list[dict]]:
+    """Return the `fetch_rows` newest valid prices of several stocks at once.
+
+    Uses a single statement regardless of the number of stocks. If
+    `stock_ids` is None, all stocks are included. The result maps every
+    existing stock to its history (newest first, empty if there is none).
+    Unknown stock ids are left out. With `include_previews`, prices which
+    aren't valid yet are included as well (like `get_prices`). With `since`,
+    only prices valid after `since` are included.
+    """
+    if stock_ids is not None and not stock_ids:
+        return {}
+    conditions, since_data, stock_where = [], [], ""
+    if not include_previews:
+        conditions.append("valid_after <= UTC_TIMESTAMP()")
+    if since is not None:
+        conditions.append("valid_after > (?)")
+        since_data.append(since)
+    if stock_ids is not None:
+        conditions.append(f"stock_id IN ({_placeholders(stock_ids)})")
+        stock_where = f"WHERE s.id IN ({_placeholders(stock_ids)})"
+    price_where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    sql = f"""SELECT s.id AS stock_id, p.valid_after, p.price
+    FROM stocks s
+    LEFT JOIN (
+        SELECT stock_id, valid_after, price, ROW_NUMBER() OVER (
+            PARTITION BY stock_id ORDER BY valid_after DESC
+        ) AS row_num
+        FROM prices
+        {price_where}
+    ) p ON p.stock_id = s.id AND p.row_num <= (?)
+    {stock_where}
+    ORDER BY s.id, p.valid_after DESC
+    """
+    data = [*since_data, *(stock_ids or []), fetch_rows, *(stock_ids or [])]
+    histories = {}
+    for row in read_value(db, sql, *data, fetch_rows="all"):
+        history = histories.setdefault(row["stock_id"], [])
+        if row["valid_after"] is not None:
+            history.append(row)
+
+    # continue short histories with archived prices
+    short = [s_id for s_id, rows in histories.items() if len(rows) < fetch_rows]
+    if short:
+        sql = f"""SELECT stock_id, valid_after, price FROM (
+            SELECT stock_id, valid_after, price, ROW_NUMBER() OVER (
+                PARTITION BY stock_id ORDER BY valid_after DESC
+            ) AS row_num
+            FROM prices_archive
+            WHERE stock_id IN ({_placeholders(short)})
+            {"AND valid_after > (?)" if since is not None else ""}
+        ) a
+        WHERE row_num <= (?)
+        ORDER BY stock_id, valid_after DESC
+        """
+        for row in read_value(db, sql, *short, *since_data, fetch_rows,
+                              fetch_rows="all"):
+            history = histories[row["stock_id"]]
+            if len(history) < fetch_rows and (
+                    not history or row["valid_after"] < history[-1]["valid_after"]):
+                history.append(row)
+    return histories
+
+
+def get_price_series(db: Connection, stock_ids: Union[list[int], None] = None
+                     ) -> dict[int, list[dict]]:
+    """Return all prices (including previews and archived prices) of several
+    stocks, oldest first.
+
+    Like `get_price_histories`, every existing stock is included.
+    """
+    if stock_ids is not None and not stock_ids:
+        return {}
+    stock_where = ""
+    if stock_ids is not None:
+        stock_where = f"WHERE s.id IN ({_placeholders(stock_ids)})"
+    sql = f"""SELECT s.id AS stock_id, p.valid_after, p.price
+    FROM stocks s
+    LEFT JOIN (
+        SELECT stock_id, valid_after, price FROM prices
+        UNION ALL
+        SELECT stock_id, valid_after, price FROM prices_archive
+    ) p ON p.stock_id = s.id
+    {stock_where}
+    ORDER BY s.id, p.valid_after ASC
+    """
+    series = {}
+    for row in read_value(db, sql, *(stock_ids or []), fetch_rows="all"):
+        rows = series.setdefault(row["stock_id"], [])
+        if row["valid_after"] is not None:
+            rows.append(row)
+    return series
+
+
+def get_price_previews(db: Connection, stock_ids: Union[list[int], None] = None
+                       ) -> dict[int, Union[dict, None]]:
+    """Return the next preview of several stocks at once.
+
+    Counterpart of `get_price_histories` for `get_price_preview`. Stocks
+    without a preview map to None.
+    """
+    if stock_ids is not None and not stock_ids:
+        return {}
+    stock_where = ""
+    if stock_ids is not None:
+        stock_where = f"WHERE s.id IN ({_placeholders(stock_ids)})"
+    sql = f"""SELECT s.id AS stock_id, p.price, p.valid_after
+    FROM stocks s
+    LEFT JOIN (
+        SELECT stock_id, MIN(valid_after) AS valid_after
+        FROM prices
+        WHERE valid_after > UTC_TIMESTAMP()
+        GROUP BY stock_id
+    ) n ON n.stock_id = s.id
+    LEFT JOIN prices p ON p.stock_id = n.stock_id AND p.valid_after = n.valid_after
+    {stock_where}
+    ORDER BY s.id
+    """
+    previews = {}
+    for row in read_value(db, sql, *(stock_ids or []), fetch_rows="all"):
+        stock_id = row.pop("stock_id")
+        previews[stock_id] = row if row["valid_after"] is not None else None
+    return previews
+
+
+def archive_prices(db: Connection, before: datetime,
+                   downsample: int = 0) -> tuple[int, int]:
+    """Move prices valid before `before` from `prices` to `prices_archive`.
+
+    The newest valid price of every stock always stays in `prices`. With
+    `downsample` (seconds), only the last price of each stock per interval is
+    archived and the others are dropped. Returns the number of prices removed
+    from `prices` and the number of prices archived.
+    """
+    if before.tzinfo is not None:
+        before = before.astimezone(timezone.utc).replace(tzinfo=None)
+    sql = """SELECT stock_id, MAX(valid_after) AS valid_after FROM prices
+    WHERE valid_after <= UTC_TIMESTAMP()
+    GROUP BY stock_id"""
+    cutoffs = [(row["stock_id"], min(before, row["valid_after"].replace(tzinfo=None)))
+               for row in read_value(db, sql, fetch_rows="all")]
+    if downsample:
+        archive_sql = """INSERT IGNORE INTO prices_archive (stock_id, valid_after, price)
+        SELECT stock_id, valid_after, price FROM (
+            SELECT stock_id, valid_after, price, ROW_NUMBER() OVER (
+                PARTITION BY TIMESTAMPDIFF(SECOND, '1970-01-01', valid_after) DIV ?
+                ORDER BY valid_after DESC
+            ) AS row_num
+            FROM prices
+            WHERE stock_id = (?) AND valid_after < (?)
+        ) p
+        WHERE row_num = 1"""
+    else:
+        archive_sql = """INSERT IGNORE INTO prices_archive (stock_id, valid_after, price)
+        SELECT stock_id, valid_after, price FROM prices
+        WHERE stock_id = (?) AND valid_after < (?)"""
+    num_removed = num_archived = 0
+    try:
+        db.begin()
+        with db.cursor() as cursor:
+            for stock_id, cutoff in cutoffs:
+                data = (stock_id, cutoff)
+                execute(cursor, archive_sql,
+                        (downsample, *data) if downsample else data)
+                num_archived += cursor.rowcount
+                execute(cursor,
+                    """DELETE FROM prices
+                    WHERE stock_id = (?) AND valid_after < (?)""",
+                    data
+                )
+                num_removed += cursor.rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    current_app.logger.info("archived %d of %d prices before %s",
+                            num_archived, num_removed, before)
+    return num_removed, num_archived
+
+
 def set_price_preview(db: Connection, stock_id: int, new_price: Union[int, float]):
     if not isinstance(new_price, (int, float)):
         raise exceptions.DBValueError("price", new_price)
     _ensure_stock(db, stock_id)
-    with db.cursor() as cursor:
-        preview = get_price_preview(db, stock_id, fetch_rows="first")
-        if not preview:
-            raise exceptions.RowNotFoundError()
-        timestmp = preview["valid_after"]
-        cursor.execute(
-            """UPDATE prices
-            SET price = (?)
-            WHERE stock_id = (?) AND valid_after = (?)
-            """,
-            (new_price, stock_id, timestmp)
-        )
+    preview = get_price_preview(db, stock_id, fetch_rows="first")
+    if not preview:
+        raise exceptions.RowNotFoundError()
+    timestmp = preview["valid_after"]
+    try:
+        db.begin()
+        with db.cursor() as cursor:
+            execute(cursor,
+                """UPDATE prices
+                SET price = (?)
+                WHERE stock_id = (?) AND valid_after = (?)
+                """,
+                (new_price, stock_id, timestmp)
+            )
+            rowcount = cursor.rowcount
+            _count_changes(cursor, [stock_id])
         db.commit()
-        return cursor.rowcount
+    except Exception:
+        db.rollback()
+        raise
+    return rowcount
 
 
 def add_price_preview(db: Connection, stock_id: int, valid_after: datetime,
@@ -83,16 +314,60 @@ def add_price_preview(db: Connection, stock_id: int, valid_after: datetime,
     if not isinstance(price, (int, float)):
         raise exceptions.DBValueError("price", price)
     _ensure_stock(db, stock_id)
-    with db.cursor() as cursor:
-        cursor.execute(
-            """INSERT INTO prices (stock_id, valid_after, price)
-            VALUES (?, ?, ?)""",
-            (stock_id, valid_after, price)
-        )
+    try:
+        db.begin()
+        with db.cursor() as cursor:
+            execute(cursor,
+                """INSERT INTO prices (stock_id, valid_after, price)
+                VALUES (?, ?, ?)""",
+                (stock_id, valid_after, price)
+            )
+            rowcount = cursor.rowcount
+            _count_changes(cursor, [stock_id], edited=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    current_app.logger.info("pushed new preview (%.2f). valid_after: %s %s",
+                            price, valid_after, valid_after.tzname())
+    return rowcount
+
+
+def add_price_previews(db: Connection,
+                       previews: list[tuple[int, datetime, Union[int, float]]]):
+    """Insert several price previews in a single transaction.
+
+    `previews` is a list of `(stock_id, valid_after, price)` tuples. Unlike
+    `add_price_preview`, stock ids aren't checked beforehand. An unknown
+    stock_id violates the foreign key constraint and rolls back the whole
+    batch.
+    """
+    for _stock_id, valid_after, price in previews:
+        if not isinstance(valid_after, datetime):
+            raise exceptions.DBValueError("valid_after", valid_after)
+        if not isinstance(price, (int, float)):
+            raise exceptions.DBValueError("price", price)
+    if not previews:
+        return 0
+    try:
+        # explicit transaction, in case the connection is in autocommit mode
+        db.begin()
+        with db.cursor() as cursor:
+            execute_many(cursor,
+                """INSERT INTO prices (stock_id, valid_after, price)
+                VALUES (?, ?, ?)""",
+                previews
+            )
+            rowcount = cursor.rowcount
+            _count_changes(cursor, list(dict.fromkeys(p[0] for p in previews)),
+                           edited=False)
         db.commit()
-        current_app.logger.info("pushed new preview (%.2f). valid_after: %s %s",
-                                price, valid_after, valid_after.tzname())
-        return cursor.rowcount
+    except Exception:
+        db.rollback()
+        raise
+    current_app.logger.info("pushed %d new previews. valid_after: %s",
+                            len(previews), previews[0][1])
+    return rowcount
 
 
 def show_stock(db: Connection, stock_id: int):
@@ -104,8 +379,45 @@ def list_stocks(db: Connection):
     return read_value(db, """SELECT * FROM stocks""", fetch_rows="all")
 
 
+def list_stock_versions(db: Connection) -> dict[int, dict]:
+    """Return `updated_at`, the number of edits and the furthest price of
+    every stock.
+
+    Used to detect which stocks changed since they were last loaded. `edits`
+    counts the changes other than new prices after the furthest one (e.g.
+    edited previews), which can't be told from the furthest price. Stocks
+    without prices have `valid_after` and `price` set to None.
+    """
+    sql = """SELECT s.id AS stock_id, s.updated_at, COALESCE(v.edits, 0) AS edits,
+        p.valid_after, p.price
+    FROM stocks s
+    LEFT JOIN stock_versions v ON v.stock_id = s.id
+    LEFT JOIN (
+        SELECT stock_id, MAX(valid_after) AS valid_after
+        FROM prices
+        GROUP BY stock_id
+    ) l ON l.stock_id = s.id
+    LEFT JOIN prices p ON p.stock_id = l.stock_id AND p.valid_after = l.valid_after
+    ORDER BY s.id
+    """
+    return {row.pop("stock_id"): row for row in read_value(db, sql, fetch_rows="all")}
+
+
+def get_change_marker(db: Connection) -> tuple[int, int]:
+    """Return a value which changes with every change counted for a stock.
+
+    Cheap compared to `list_stock_versions`, as it doesn't depend on the
+    number of prices, so it can be polled before reading the versions.
+    """
+    sql = """SELECT COUNT(*) AS num_stocks, COALESCE(SUM(version), 0) AS version
+    FROM stock_versions"""
+    row = read_value(db, sql, fetch_rows="first")
+    return row["num_stocks"], row["version"]
+
+
 def list_stock_ids(db: Connection):
-    return [stock["id"] for stock in list_stocks(db)]
+    return [stock["id"] for stock in
+            read_value(db, """SELECT id FROM stocks""", fetch_rows="all")]
 
 
 def create_stock(db: Connection, name: str, color: str = None):
@@ -113,11 +425,17 @@ def create_stock(db: Connection, name: str, color: str = None):
         raise exceptions.DBValueError("name", None)
     if color is not None and not _is_hexcolor(color):
         raise exceptions.DBValueError("color", color)
-    with db.cursor() as cursor:
-        cursor.execute("""INSERT INTO stocks (name, color) VALUES (?, ?)""",
-                       (name, color))
-        new_id = cursor.lastrowid
-    db.commit()
+    try:
+        db.begin()
+        with db.cursor() as cursor:
+            execute(cursor, """INSERT INTO stocks (name, color) VALUES (?, ?)""",
+                    (name, color))
+            new_id = cursor.lastrowid
+            _count_changes(cursor, [new_id])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
     return new_id
 
 
@@ -125,16 +443,23 @@ def rename_stock(db: Connection, stock_id: int, new_name: str):
     if new_name is None:
         raise exceptions.DBValueError("name", None)
     _ensure_stock(db, stock_id)
-    with db.cursor() as cursor:
-        cursor.execute(
-            """UPDATE stocks
-            SET name = (?)
-            WHERE id = (?)
-            """,
-            (new_name, stock_id)
-        )
+    try:
+        db.begin()
+        with db.cursor() as cursor:
+            execute(cursor,
+                """UPDATE stocks
+                SET name = (?)
+                WHERE id = (?)
+                """,
+                (new_name, stock_id)
+            )
+            rowcount = cursor.rowcount
+            _count_changes(cursor, [stock_id])
         db.commit()
-        return cursor.rowcount
+    except Exception:
+        db.rollback()
+        raise
+    return rowcount
 
 
 def _is_hexcolor(s: str):
@@ -151,13 +476,162 @@ def recolor_stock(db: Connection, stock_id: int, new_color: str):
     if new_color is not None and not _is_hexcolor(new_color):
         raise exceptions.DBValueError("color", new_color)
     _ensure_stock(db, stock_id)
-    with db.cursor() as cursor:
-        cursor.execute(
-            """UPDATE stocks
-            SET color = (?)
-            WHERE id = (?)
-            """,
-            (new_color.upper(), stock_id)
-        )
+    try:
+        db.begin()
+        with db.cursor() as cursor:
+            execute(cursor,
+                """UPDATE stocks
+                SET color = (?)
+                WHERE id = (?)
+                """,
+                (new_color.upper(), stock_id)
+            )
+            rowcount = cursor.rowcount
+            _count_changes(cursor, [stock_id])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return rowcount
+
+
+_SUMMARY_COLUMNS = """COALESCE(p.shares_outstanding, 0) AS total_amount,
+    COALESCE(p.buy_volume, 0) AS buy_volume,
+    COALESCE(p.sell_volume, 0) AS sell_volume,
+    COALESCE(p.traded_value, 0) AS traded_value"""
+
+
+def get_transaction_summary(db: Connection, stock_id: int):
+    """Return the running totals of all transactions of a stock.
+
+    `total_amount` is the number of shares outstanding (bought minus sold).
+    """
+    sql = f"""SELECT {_SUMMARY_COLUMNS}
+    FROM stocks s
+    LEFT JOIN positions p ON p.stock_id = s.id
+    WHERE s.id = (?)
+    """
+    summary = read_value(db, sql, stock_id, fetch_rows="first")
+    if summary is None:
+        raise exceptions.StockIdError(stock_id)
+    return summary
+
+
+def get_transaction_summaries(db: Connection) -> dict[int, dict]:
+    """Return the summaries (see `get_transaction_summary`) of all stocks."""
+    sql = f"""SELECT s.id AS stock_id, {_SUMMARY_COLUMNS}
+    FROM stocks s
+    LEFT JOIN positions p ON p.stock_id = s.id
+    ORDER BY s.id
+    """
+    return {row.pop("stock_id"): row for row in read_value(db, sql, fetch_rows="all")}
+
+
+def rebuild_positions(db: Connection) -> int:
+    """Recompute the running totals of all stocks from `transactions`."""
+    try:
+        db.begin()
+        with db.cursor() as cursor:
+            execute(cursor, """DELETE FROM positions""")
+            execute(cursor,
+                """INSERT INTO positions
+                (stock_id, shares_outstanding, buy_volume, sell_volume, traded_value)
+                SELECT stock_id,
+                    SUM(purchase_amount),
+                    SUM(GREATEST(purchase_amount, 0)),
+                    SUM(GREATEST(-purchase_amount, 0)),
+                    COALESCE(SUM(ABS(total_purchase_price)), 0)
+                FROM transactions
+                GROUP BY stock_id"""
+            )
+            rowcount = cursor.rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return rowcount
+
+
+def add_transaction(db: Connection, stock_id: int, amount: int,
+                    total_price: Union[int, float] = 0):
+    """Record the purchase (positive `amount`) or sale (negative) of shares.
+
+    The running totals in `positions` are updated in the same transaction.
+    """
+    if not isinstance(amount, int) or amount == 0:
+        raise exceptions.DBValueError("purchase_amount", amount)
+    try:
+        db.begin()
+        with db.cursor() as cursor:
+            execute(cursor,
+                """INSERT INTO transactions
+                (stock_id, purchase_amount, total_purchase_price)
+                VALUES (?, ?, ?)""",
+                (stock_id, amount, total_price)
+            )
+            new_id = cursor.lastrowid
+            execute(cursor,
+                """INSERT INTO positions
+                (stock_id, shares_outstanding, buy_volume, sell_volume, traded_value)
+                VALUES (?, ?, ?, ?, ?)
+                ON DUPLICATE KEY UPDATE
+                shares_outstanding = shares_outstanding + VALUES(shares_outstanding),
+                buy_volume = buy_volume + VALUES(buy_volume),
+                sell_volume = sell_volume + VALUES(sell_volume),
+                traded_value = traded_value + VALUES(traded_value)""",
+                (stock_id, amount, max(amount, 0), max(-amount, 0),
+                 abs(total_price))
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return new_id
+
+
+def add_transactions(db: Connection,
+                     trades: list[tuple[int, int, Union[int, float]]]) -> int:
+    """Record several trades in a single transaction.
+
+    `trades` is a list of `(stock_id, amount, total_price)` tuples (see
+    `add_transaction`). The running totals are updated once per stock. Like
+    `add_price_previews`, an unknown stock_id rolls back the whole batch.
+    """
+    for _stock_id, amount, _total_price in trades:
+        if not isinstance(amount, int) or amount == 0:
+            raise exceptions.DBValueError("purchase_amount", amount)
+    if not trades:
+        return 0
+    totals = {}
+    for stock_id, amount, total_price in trades:
+        total = totals.setdefault(stock_id, [stock_id, 0, 0, 0, 0])
+        total[1] += amount
+        total[2] += max(amount, 0)
+        total[3] += max(-amount, 0)
+        total[4] += abs(total_price)
+    try:
+        db.begin()
+        with db.cursor() as cursor:
+            execute_many(cursor,
+                """INSERT INTO transactions
+                (stock_id, purchase_amount, total_purchase_price)
+                VALUES (?, ?, ?)""",
+                trades
+            )
+            rowcount = cursor.rowcount
+            execute_many(cursor,
+                """INSERT INTO positions
+                (stock_id, shares_outstanding, buy_volume, sell_volume, traded_value)
+                VALUES (?, ?, ?, ?, ?)
+                ON DUPLICATE KEY UPDATE
+                shares_outstanding = shares_outstanding + VALUES(shares_outstanding),
+                buy_volume = buy_volume + VALUES(buy_volume),
+                sell_volume = sell_volume + VALUES(sell_volume),
+                traded_value = traded_value + VALUES(traded_value)""",
+                [tuple(total) for total in totals.values()]
+            )
         db.commit()
-        return cursor.rowcount
+    except Exception:
+        db.rollback()
+        raise
+    return rowcount
@@ -1,5 +1,7 @@
 import mariadb
 
+from . import sqlite
+
 tables = {
     "stocks": """
         CREATE TABLE stocks (
@@ -20,6 +22,17 @@ tables = {
             PRIMARY KEY (stock_id, valid_after)
         )
     """,
+    # prices moved out of `prices` by `archive-prices` (see
+    # `db.stock.archive_prices`), compressed as they are rarely read
+    "prices_archive": """
+        CREATE TABLE prices_archive (
+            stock_id INT NOT NULL,
+            valid_after DATETIME NOT NULL,
+            price DECIMAL(65,2) NOT NULL,
+            FOREIGN KEY (stock_id) REFERENCES stocks(id),
+            PRIMARY KEY (stock_id, valid_after)
+        ) ROW_FORMAT=COMPRESSED
+    """,
     "transactions": """
         CREATE TABLE transactions (
             id INT NOT NULL AUTO_INCREMENT,
@@ -31,41 +44,170 @@ tables = {
             PRIMARY KEY (id)
         )
     """,
+    # running totals of `transactions`, updated in the same transaction
+    "positions": """
+        CREATE TABLE positions (
+            stock_id INT NOT NULL,
+            shares_outstanding BIGINT NOT NULL DEFAULT 0,
+            buy_volume BIGINT NOT NULL DEFAULT 0,
+            sell_volume BIGINT NOT NULL DEFAULT 0,
+            traded_value DECIMAL(65,2) NOT NULL DEFAULT 0,
+            FOREIGN KEY (stock_id) REFERENCES stocks(id),
+            PRIMARY KEY (stock_id)
+        )
+    """,
+    # counts the changes of every stock, so other processes can detect them
+    # (see `db.stock.list_stock_versions`)
+    "stock_versions": """
+        CREATE TABLE stock_versions (
+            stock_id INT NOT NULL,
+            version BIGINT NOT NULL DEFAULT 0,
+            edits BIGINT NOT NULL DEFAULT 0,
+            FOREIGN KEY (stock_id) REFERENCES stocks(id),
+            PRIMARY KEY (stock_id)
+        )
+    """,
+    # elects the process running the market engine (see `db.engine`)
+    "engine_lease": """
+        CREATE TABLE engine_lease (
+            name VARCHAR(64) NOT NULL,
+            owner VARCHAR(255),
+            expires_at DATETIME,
+            running BOOLEAN NOT NULL DEFAULT FALSE,
+            status TEXT,
+            PRIMARY KEY (name)
+        )
+    """,
+}
+
+# the same tables for the SQLite backend (see `db.sqlite`), each as a list of
+# statements
+sqlite_tables = {
+    "stocks": [
+        """
+        CREATE TABLE stocks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(255) NOT NULL,
+            color VARCHAR(10),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # ON UPDATE CURRENT_TIMESTAMP (only if a value changed, like MariaDB)
+        """
+        CREATE TRIGGER stocks_updated_at AFTER UPDATE OF name, color ON stocks
+        FOR EACH ROW
+        WHEN NEW.updated_at IS OLD.updated_at
+            AND (NEW.name IS NOT OLD.name OR NEW.color IS NOT OLD.color)
+        BEGIN
+            UPDATE stocks SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+        END
+        """,
+    ],
+    "prices": ["""
+        CREATE TABLE prices (
+            stock_id INT NOT NULL REFERENCES stocks(id),
+            valid_after DATETIME DEFAULT CURRENT_TIMESTAMP,
+            price DECIMAL(65,2) NOT NULL,
+            PRIMARY KEY (stock_id, valid_after)
+        )
+    """],
+    "prices_archive": ["""
+        CREATE TABLE prices_archive (
+            stock_id INT NOT NULL REFERENCES stocks(id),
+            valid_after DATETIME NOT NULL,
+            price DECIMAL(65,2) NOT NULL,
+            PRIMARY KEY (stock_id, valid_after)
+        )
+    """],
+    "transactions": ["""
+        CREATE TABLE transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stock_id INT NOT NULL REFERENCES stocks(id),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            purchase_amount INT NOT NULL,
+            total_purchase_price DECIMAL(65,2)
+        )
+    """],
+    "positions": ["""
+        CREATE TABLE positions (
+            stock_id INT NOT NULL PRIMARY KEY REFERENCES stocks(id),
+            shares_outstanding BIGINT NOT NULL DEFAULT 0,
+            buy_volume BIGINT NOT NULL DEFAULT 0,
+            sell_volume BIGINT NOT NULL DEFAULT 0,
+            traded_value DECIMAL(65,2) NOT NULL DEFAULT 0
+        )
+    """],
+    "stock_versions": ["""
+        CREATE TABLE stock_versions (
+            stock_id INT NOT NULL PRIMARY KEY REFERENCES stocks(id),
+            version BIGINT NOT NULL DEFAULT 0,
+            edits BIGINT NOT NULL DEFAULT 0
+        )
+    """],
+    "engine_lease": ["""
+        CREATE TABLE engine_lease (
+            name VARCHAR(64) NOT NULL PRIMARY KEY,
+            owner VARCHAR(255),
+            expires_at DATETIME,
+            running BOOLEAN NOT NULL DEFAULT FALSE,
+            status TEXT
+        )
+    """],
 }
 
 
+def _is_sqlite(db) -> bool:
+    return isinstance(db, sqlite.Connection)
+
+
+def _table_exists(cursor, table, use_sqlite=False):
+    if use_sqlite:
+        check_stmt = """
+            SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?
+        """
+    else:
+        check_stmt = """
+            SELECT COUNT(*)
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ?
+        """
+    cursor.execute(check_stmt, (table,))
+    return cursor.fetchone()[0] > 0
+
+
 def _drop_tables(db, fail_on_missing=True):
     drop_stmt = """DROP TABLE {};"""
-    check_stmt = """
-        SELECT COUNT(*)
-        FROM information_schema.TABLES
-        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ?
-    """
+    use_sqlite = _is_sqlite(db)
     num_tables = 0
     with db.cursor() as cursor:
         try:
             for table in reversed(tables):
-                if not fail_on_missing:
-                    cursor.execute(check_stmt, (table,))
-                    if cursor.fetchone()[0] == 0:
-                        continue
+                if not fail_on_missing and not _table_exists(cursor, table,
+                                                             use_sqlite):
+                    continue
                 cursor.execute(drop_stmt.format(table))
                 num_tables += 1
-        except mariadb.Error as e:
+        except (mariadb.Error, sqlite.Error) as e:
             raise Exception(
                 f"Error dropping tables.\nSQL: {cursor.statment}\nError: {e}"
             ) from e
     return num_tables
 
 
-def _create_tables(db):
+def _create_tables(db, skip_existing=False):
+    use_sqlite = _is_sqlite(db)
+    schema = sqlite_tables if use_sqlite else {t: [sql] for t, sql in tables.items()}
     num_tables = 0
     with db.cursor() as cursor:
-        for table, sql in tables.items():
+        for table, statements in schema.items():
+            if skip_existing and _table_exists(cursor, table, use_sqlite):
+                continue
             try:
-                cursor.execute(sql)
+                for sql in statements:
+                    cursor.execute(sql)
                 num_tables += 1
-            except mariadb.Error as e:
+            except (mariadb.Error, sqlite.Error) as e:
                 raise Exception(f"Error creating table '{table}'.\nSQL: {sql}\n"
                                 f"Error: {e}") from e
     return num_tables
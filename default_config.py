@@ -4,6 +4,12 @@ from datetime import timedelta
 
 from market_engine import GaussChangeMarketEngine
 
+# storage backend: "mariadb" (see MARIADB_CONNECTION) or "sqlite", an embedded
+# database in the file SQLITE_DATABASE (":memory:" keeps all data in memory
+# and loses it on exit). Tables of the embedded database are created on start.
+DB_BACKEND = "mariadb"
+SQLITE_DATABASE = "dau_jones.sqlite3"
+
 MARIADB_CONNECTION = {
     "user": "dau_jones",
     "host": "localhost",
@@ -11,6 +17,16 @@ MARIADB_CONNECTION = {
     "database": "dau_jones",
 }
 
+# number of pooled connections shared by the request handlers and seconds to
+# wait for a free connection before failing (for both backends). The market
+# engine uses an additional, dedicated connection.
+MARIADB_POOL_SIZE = 16
+MARIADB_POOL_TIMEOUT = 5
+
+# size of the thread pool running blocking database calls for async code (see
+# `db.aio`). Should not exceed MARIADB_POOL_SIZE.
+DB_EXECUTOR_WORKERS = 8
+
 
 class MakeRotatingFileHandler(logging.handlers.RotatingFileHandler):
     def __init__(self, filename, mode='a', maxBytes=0, backupCount=0,  # noqa: N803
@@ -52,4 +68,55 @@ MARKET_ENGINE_PARAMS = {
     "sigma": 1.2,
     "min_value": 1,
     "start_value": 4,
+    # "lookahead": 4,  # number of previews generated ahead of time
+    # "seed": 1234,  # reproducible prices
+    # "missed_ticks": "catch_up",  # generate missed prices ("skip" by default)
 }
+
+# how the market engine is run if the server has several processes (see
+# `engine_coordinator`): "local" runs it in every process (single process
+# only), "election" elects one process through a lease in the database and
+# "follower" never runs it (for web workers next to a dedicated engine server).
+# The leader renews its lease every ENGINE_POLL_SECONDS, others take over
+# after ENGINE_LEASE_SECONDS without renewal. A leader which can't renew its
+# lease stops two polls earlier, so ENGINE_LEASE_SECONDS has to be longer than
+# two polls.
+ENGINE_MODE = "local"
+ENGINE_LEASE_SECONDS = 15
+ENGINE_POLL_SECONDS = 2
+
+# number of engine ticks whose telemetry (duration per phase, delay, failed
+# stocks) is kept for /api/markt/status (see `engine_stats.EngineStats`)
+ENGINE_TICK_HISTORY = 100
+
+# number of prices per stock held in memory by the market engine (see
+# `tick_store.TickStore`). Older prices are read from the database.
+TICK_STORE_SIZE = 200
+
+# resolutions of the OHLC candles maintained in memory (see `candles.py`),
+# available through /api/kurse/kerzen/<id>?aufloesung=...
+CANDLE_RESOLUTIONS = ["5m", "15m", "1h", "4h", "1d"]
+
+# cached API responses (see `response_cache.ResponseCache`): max. number of
+# responses and seconds a response is cached if no preview is known.
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_MAX_AGE = 5
+
+# server-sent price events (see `price_stream.PriceStream`): number of events
+# kept for clients resuming via Last-Event-ID and seconds between heartbeats.
+PRICE_STREAM_BACKLOG = 1000
+PRICE_STREAM_HEARTBEAT = 15
+
+# buy / sell requests are committed in batches (see `trade_queue.TradeQueue`):
+# max. trades per commit, seconds to wait for more trades, max. pending trades
+# and seconds a request waits for room in a full queue before it is rejected.
+TRADE_BATCH_SIZE = 200
+TRADE_BATCH_DELAY = 0.005
+TRADE_QUEUE_SIZE = 2000
+TRADE_QUEUE_TIMEOUT = 2
+
+# `quart archive-prices` moves prices older than PRICE_RETENTION_HOURS to the
+# archive table, keeping only the last price per stock and
+# PRICE_ARCHIVE_DOWNSAMPLE_MINUTES (0 archives every price).
+PRICE_RETENTION_HOURS = 48
+PRICE_ARCHIVE_DOWNSAMPLE_MINUTES = 0
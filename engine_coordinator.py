@@ -0,0 +1,289 @@
+"""Runs the market engine in only one of several server processes.
+
+Every process (e.g. every Hypercorn worker) creates a market engine, but with
+`ENGINE_MODE` set to "election" only the process holding the engine lease in
+the database (see `db.engine`) ticks. The lease is renewed every
+`ENGINE_POLL_SECONDS` and taken over by another process once it wasn't
+renewed for `ENGINE_LEASE_SECONDS`, e.g. because the leader crashed. The
+expiry is computed by the database, so the clocks of the processes don't
+have to agree, and a leader which couldn't renew its lease stops the engine
+two polls before it expires, so two engines never tick at the same time. All
+other processes follow the prices written by the leader (see
+`BaseMarketEngine.sync_stocks`), so their tick stores, candles, price streams
+and response caches stay up to date without generating prices themselves.
+Stocks and previews edited through another process are reloaded within one
+poll as well (see `BaseMarketEngine.add_reload_listener`). Polls only read a
+cheap marker of the changes (see `db.stock.get_change_marker`) and the
+versions of all stocks only after it changed.
+
+With "follower", a process never takes the lease. This allows running the
+engine in a dedicated (single worker) server in "election" mode while the
+web workers only follow it.
+
+Starting and stopping the engine is requested through the lease, so the
+control endpoints work in every process. The leader publishes its status
+(including the telemetry of its last ticks) in the lease as well.
+
+The default mode "local" runs the engine in every process, as a single
+server process did before.
+"""
+import asyncio
+import json
+import os
+import socket
+import traceback
+import uuid
+from collections.abc import Callable
+from datetime import timedelta
+from typing import Union
+
+from quart import Quart, current_app
+
+from db import aio
+from db import engine as engine_db_api
+from db import stock as stock_db
+from db.manage import engine_db
+from market_engine import BaseMarketEngine
+
+ENGINE_MODES = ("local", "election", "follower")
+
+LEASE_NAME = "market_engine"
+
+# number of ticks included in the published status
+PUBLISHED_TICKS = 10
+
+
+def init_app(app: Quart):
+
+    @app.before_serving
+    async def start_coordinator():
+        mode = app.config.get("ENGINE_MODE", "local")
+        if mode not in ENGINE_MODES:
+            raise ValueError(f"ENGINE_MODE must be one of {ENGINE_MODES}")
+        if mode == "local":
+            return
+        coordinator = EngineCoordinator(
+            app.config["MARKET_ENGINE"], mode,
+            lease_duration=timedelta(seconds=app.config["ENGINE_LEASE_SECONDS"]),
+            poll_interval=app.config["ENGINE_POLL_SECONDS"],
+            dumps=app.json.dumps,
+        )
+        await coordinator.start()
+        app.config["ENGINE_COORDINATOR"] = coordinator
+
+    @app.after_serving
+    async def stop_coordinator():
+        coordinator = app.config.pop("ENGINE_COORDINATOR", None)
+        if coordinator is not None:
+            await coordinator.close()
+
+
+class EngineCoordinator:
+    """Elects the process running the engine and routes control requests."""
+    engine: BaseMarketEngine
+    mode: str
+    owner: str
+    lease_duration: timedelta
+    poll_interval: float
+    is_leader: bool
+    _dumps: Callable[[dict], str]
+    # steps down before the lease expires unless it is renewed
+    _expiry: Union[asyncio.TimerHandle, None]
+    # (number of ticks, last tick, is_running, num_loaded) when last published
+    _published: Union[tuple, None]
+    # `db.stock.get_change_marker` when the engine last caught up with the
+    # database
+    _change_marker: Union[tuple, None]
+    _task: Union[asyncio.Task, None]
+
+    def __init__(self, engine: BaseMarketEngine, mode: str,
+                 lease_duration: timedelta = timedelta(seconds=15),
+                 poll_interval: float = 2, dumps=json.dumps):
+        if mode not in ("election", "follower"):
+            raise ValueError(f"unsupported mode: {mode}")
+        if lease_duration.total_seconds() <= 2 * poll_interval:
+            raise ValueError("the lease must last longer than two polls")
+        self.engine = engine
+        self.mode = mode
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_duration = lease_duration
+        self.poll_interval = poll_interval
+        self.is_leader = False
+        self._dumps = dumps
+        self._expiry = None
+        self._published = None
+        self._change_marker = None
+        self._task = None
+
+    async def start(self):
+        await aio.run_sync(self._ensure_lease)
+        await self._poll()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        if self.is_leader:
+            self._step_down("shutting down")
+            # let another process take over right away (blocking, as the
+            # database executor may already be shut down)
+            self._release_lease()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self._poll()
+            except Exception:
+                current_app.logger.error(traceback.format_exc())
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        # the database sets the expiry after this point in time, so the lease
+        # lasts at least `lease_duration` from here
+        polled = loop.time()
+        if self.mode == "election":
+            lease = await aio.run_sync(self._acquire_lease)
+        else:
+            lease = await aio.run_sync(self._get_lease)
+        # leave two polls for a running tick and the rates of both clocks
+        held_until = polled + self.lease_duration.total_seconds() - 2 * self.poll_interval
+        if lease["owner"] == self.owner and loop.time() < held_until:
+            self._hold_until(held_until)
+            if not self.is_leader:
+                await self._lead()
+            # stocks may have been added or edited by other processes
+            await self._follow(self.engine.reload_stocks)
+            if self.is_leader:
+                self._apply(lease)
+                await self._publish_status()
+        else:
+            if self.is_leader:
+                self._step_down("renewing the lease took too long"
+                                if lease["owner"] == self.owner
+                                else f"lease was taken over by {lease['owner']}")
+            await self._follow(self.engine.sync_stocks)
+
+    async def _follow(self, synchronize: Callable):
+        """Run `synchronize` (e.g. `engine.sync_stocks`) unless no stock
+        changed since it last ran."""
+        marker = await aio.run_sync(self._get_change_marker)
+        if marker == self._change_marker:
+            return
+        await synchronize()
+        # changes in between both reads are synchronized by the next poll
+        self._change_marker = marker
+
+    def _hold_until(self, deadline: float):
+        """Step down at `deadline` (loop time) unless the lease is renewed."""
+        if self._expiry is not None:
+            self._expiry.cancel()
+        self._expiry = asyncio.get_running_loop().call_at(deadline, self._expire)
+
+    def _expire(self):
+        self._expiry = None
+        if self.is_leader:
+            self._step_down("lease couldn't be renewed in time")
+
+    async def _lead(self):
+        current_app.logger.info("%s runs the market engine", self.owner)
+        self.is_leader = True
+        self._published = None
+        # prices written by the previous leader
+        await self.engine.sync_stocks()
+
+    def _step_down(self, reason: str):
+        current_app.logger.warning("%s stops running the market engine: %s",
+                                   self.owner, reason)
+        self.is_leader = False
+        if self.engine.is_running():
+            self.engine.stop()
+
+    def _apply(self, lease: dict):
+        if lease["running"] and not self.engine.is_running():
+            self.engine.start()
+        elif not lease["running"] and self.engine.is_running():
+            self.engine.stop()
+
+    async def _publish_status(self):
+        state = (len(self.engine.stats), self.engine.stats.latest(),
+                 self.engine.is_running(), self.engine.get_num_stocks())
+        if state == self._published:
+            return
+        status = self._dumps(self._local_status(PUBLISHED_TICKS))
+        await aio.run_sync(self._set_lease_status, status)
+        self._published = state
+
+    def _local_status(self, num_ticks: int = None) -> dict:
+        return {"is_running": self.engine.is_running(),
+                "num_loaded": self.engine.get_num_stocks(),
+                "ticks": self.engine.stats.to_dict(num_ticks)}
+
+    async def get_status(self, num_ticks: int = None) -> dict:
+        """Return the status of the engine, as published by the leader.
+
+        Only the last `PUBLISHED_TICKS` ticks are available from other
+        processes.
+        """
+        if self.is_leader:
+            status = self._local_status(num_ticks)
+            leader = self.owner
+        else:
+            lease = await aio.run_sync(self._get_lease)
+            leader = self._active_owner(lease)
+            status = json.loads(lease["status"]) if lease["status"] else {}
+            ticks = status.get("ticks")
+            if ticks is not None and num_ticks is not None:
+                ticks["ticks"] = ticks["ticks"][-num_ticks:] if num_ticks > 0 else []
+            status["is_running"] = (leader is not None and bool(lease["running"])
+                                    and status.get("is_running", False))
+            status["num_loaded"] = self.engine.get_num_stocks()
+        status.update(mode=self.mode, leader=leader, is_leader=self.is_leader)
+        return status
+
+    @staticmethod
+    def _active_owner(lease: dict) -> Union[str, None]:
+        return lease["owner"] if lease["active"] else None
+
+    async def set_running(self, running: bool):
+        """Request the leader to start or stop the engine.
+
+        Applied right away in the leader, otherwise within one poll.
+        """
+        await aio.run_sync(self._set_lease_running, running)
+        if self.is_leader:
+            self._apply({"running": running})
+            await self._publish_status()
+
+    def _get_change_marker(self) -> tuple:
+        with engine_db() as db:
+            return stock_db.get_change_marker(db)
+
+    def _ensure_lease(self):
+        with engine_db() as db:
+            engine_db_api.ensure_lease(db, LEASE_NAME)
+
+    def _get_lease(self) -> dict:
+        with engine_db() as db:
+            return engine_db_api.get_lease(db, LEASE_NAME)
+
+    def _acquire_lease(self) -> dict:
+        with engine_db() as db:
+            return engine_db_api.acquire_lease(db, LEASE_NAME, self.owner,
+                                               self.lease_duration.total_seconds())
+
+    def _release_lease(self):
+        with engine_db() as db:
+            engine_db_api.release_lease(db, LEASE_NAME, self.owner)
+
+    def _set_lease_running(self, running: bool):
+        with engine_db() as db:
+            engine_db_api.set_lease_running(db, LEASE_NAME, running)
+
+    def _set_lease_status(self, status: str):
+        with engine_db() as db:
+            engine_db_api.set_lease_status(db, LEASE_NAME, self.owner, status)
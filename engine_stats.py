@@ -0,0 +1,151 @@
+"""Telemetry of the market engine's ticks.
+
+Every tick records when it was scheduled and when it actually started, the
+drift of the event loop's clock, missed ticks, how long it took in total and
+how that time was split between generating the prices, writing them to the
+database and notifying the push listeners. The last ticks are kept in memory
+(see `EngineStats`) and exposed through `/api/markt/status` and
+`/api/metrics`.
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Union
+
+import metrics
+
+PHASES = ("generate", "write", "notify")
+
+
+class TickRecord:
+    """Measurements of a single tick.
+
+    Durations are in seconds. `scheduled` is None for ticks which weren't
+    started by the engine's timer (e.g. benchmarks).
+    """
+    __slots__ = ("scheduled", "started", "clock_skew", "missed_ticks", "duration",
+                 "phases", "num_stocks", "num_updates", "failed_stocks", "error",
+                 "_start")
+
+    scheduled: Union[datetime, None]
+    started: datetime
+    # change of the offset between UTC and the event loop's clock (seconds)
+    clock_skew: float
+    # tick boundaries passed since the previous tick without a tick
+    missed_ticks: int
+    duration: Union[float, None]
+    phases: dict[str, float]
+    num_stocks: int
+    num_updates: int
+    # stock id -> error message
+    failed_stocks: dict[int, str]
+    error: Union[str, None]
+
+    def __init__(self, scheduled: datetime = None, started: datetime = None):
+        self.scheduled = scheduled
+        self.started = started or datetime.now(timezone.utc)
+        self.clock_skew = 0.0
+        self.missed_ticks = 0
+        self.duration = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.num_stocks = 0
+        self.num_updates = 0
+        self.failed_stocks = {}
+        self.error = None
+        self._start = time.perf_counter()
+
+    @property
+    def delay(self) -> Union[float, None]:
+        """Seconds the tick started after it was scheduled."""
+        if self.scheduled is None:
+            return None
+        return (self.started - self.scheduled).total_seconds()
+
+    @contextmanager
+    def phase(self, name: str):
+        """Add the duration of the `with` block to the phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def finish(self, error: BaseException = None):
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> dict:
+        return {
+            "scheduled": self.scheduled,
+            "started": self.started,
+            "delay": self.delay,
+            "clock_skew": self.clock_skew,
+            "missed_ticks": self.missed_ticks,
+            "duration": self.duration,
+            "phases": self.phases,
+            "num_stocks": self.num_stocks,
+            "num_updates": self.num_updates,
+            "failed_stocks": self.failed_stocks,
+            "error": self.error,
+        }
+
+
+class EngineStats:
+    """The last `size` ticks of a market engine, oldest first."""
+    interval: timedelta
+    _ticks: deque[TickRecord]
+
+    def __init__(self, interval: timedelta, size: int = 100):
+        self.interval = interval
+        self._ticks = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._ticks)
+
+    def begin(self, scheduled: datetime = None, started: datetime = None
+              ) -> TickRecord:
+        return TickRecord(scheduled, started)
+
+    def finish(self, record: TickRecord, error: BaseException = None):
+        """Complete `record`, keep it and update the metrics."""
+        record.finish(error)
+        self._ticks.append(record)
+        metrics.ENGINE_TICK_SECONDS.observe(record.duration, "total")
+        for name, seconds in record.phases.items():
+            metrics.ENGINE_TICK_SECONDS.observe(seconds, name)
+        if record.delay is not None:
+            metrics.ENGINE_TICK_DELAY.set(value=record.delay)
+        metrics.ENGINE_TICK_BUDGET.set(value=self.budget_used(record))
+        metrics.ENGINE_TICKS.inc("error" if record.error else "ok")
+        metrics.ENGINE_CLOCK_SKEW.set(value=record.clock_skew)
+        if record.missed_ticks:
+            metrics.ENGINE_MISSED_TICKS.inc(amount=record.missed_ticks)
+        if record.failed_stocks:
+            metrics.ENGINE_STOCK_FAILURES.inc(amount=len(record.failed_stocks))
+
+    def latest(self) -> Union[TickRecord, None]:
+        return self._ticks[-1] if self._ticks else None
+
+    def budget_used(self, record: TickRecord) -> float:
+        """Fraction of the interval taken by the tick `record`."""
+        return record.duration / self.interval.total_seconds()
+
+    def to_dict(self, num: int = None) -> dict:
+        """Summarize the ticks and include the last `num` (default: all)."""
+        ticks = list(self._ticks)
+        if num is not None:
+            ticks = ticks[-num:] if num > 0 else []
+        durations = [tick.duration for tick in self._ticks]
+        max_duration = max(durations, default=None)
+        return {
+            "interval": self.interval.total_seconds(),
+            "num_ticks": len(self._ticks),
+            "max_duration": max_duration,
+            "mean_duration": (sum(durations) / len(durations)
+                              if durations else None),
+            "max_budget_used": (max_duration / self.interval.total_seconds()
+                                if max_duration is not None else None),
+            "ticks": [tick.to_dict() for tick in ticks],
+        }
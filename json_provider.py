@@ -0,0 +1,38 @@
+from quart.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library is used instead
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider using orjson if it is installed.
+
+    Values are serialized like by the default provider: decimals as strings,
+    dates as HTTP dates and non-string keys (e.g. stock ids) as strings. Unlike
+    the default provider, the output has no spaces after separators and
+    non-ASCII characters are written as UTF-8 instead of `\\u` escapes.
+    Compact `separators` (as passed for responses) are orjson's output
+    anyway. Calls with arguments orjson doesn't support (e.g. `ensure_ascii`,
+    other `separators` or indents other than 2) fall back to the default
+    implementation.
+    """
+    _SUPPORTED_ARGS = {"indent", "sort_keys", "separators"}
+
+    def dumps(self, obj, **kwargs) -> str:
+        if (orjson is None or kwargs.keys() - self._SUPPORTED_ARGS
+                or kwargs.get("indent") not in (None, 2)
+                or kwargs.get("separators") not in (None, (",", ":"))):
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
@@ -1,16 +1,29 @@
 import asyncio
+import math
 import random
 import traceback
 from abc import ABC, abstractmethod
 from collections.abc import Callable
 from datetime import datetime, timedelta, timezone
+from itertools import repeat
 from typing import Self, Union
 
-import mariadb
+import numpy as np
 from quart import Quart, current_app, has_app_context
 
+from db import aio
 from db import stock as stock_db
-from db.manage import get_db
+from db.manage import engine_db
+from candles import CandleStore
+from engine_stats import EngineStats, TickRecord
+from tick_store import PriceSeries, TickStore
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# timers may fire slightly before their deadline (loop clock resolution)
+_TIMER_TOLERANCE = timedelta(milliseconds=5)
+
+MISSED_TICK_POLICIES = ("skip", "catch_up")
 
 
 def flush_all_handlers(logger):
@@ -26,20 +39,29 @@ def init_app(app: Quart):
         engine_params = app.config["MARKET_ENGINE_PARAMS"]
 
         engine = engine_class(app, **engine_params)
-        engine.reload_stocks(get_db())
+        await engine.reload_stocks()
 
         app.config["MARKET_ENGINE"] = engine
 
 
 class MarketEngineStock(ABC):
+    """A stock as seen by the market engine.
+
+    The most recent `HISTORY_LEN` prices are kept in a compact `PriceSeries`,
+    so the latest price, current price and preview can be looked up in
+    constant time. The series has room for `lookahead` previews on top of
+    these, so previews never push the current price out of it.
+    """
+    __slots__ = ("stock_id", "on_push_listeners", "prices")
     stock_id: int
     on_push_listeners: set[Callable]
-    prices: list[tuple[float, datetime]]
+    prices: PriceSeries
+    HISTORY_LEN: int = 10
 
-    def __init__(self, stock_id):
+    def __init__(self, stock_id, lookahead: int = 1):
         self.stock_id = stock_id
         self.on_push_listeners = set()
-        self.prices = []
+        self.prices = PriceSeries(stock_id, self.HISTORY_LEN + lookahead)
 
     def __eq__(self, o):
         if isinstance(o, self.__class__):
@@ -54,20 +76,66 @@ class MarketEngineStock(ABC):
         self._push_value(new_price, new_valid)
         self._on_push(new_price, new_valid)
 
+    @classmethod
+    async def push_values(cls, updates: list[tuple[Self, float, datetime]]
+                          ) -> dict[int, str]:
+        """Push new values to several stocks at once.
+
+        `updates` is a list of `(stock, new_price, new_valid)` tuples. The
+        listeners of each stock are notified once all values were pushed (see
+        `_notify`).
+        """
+        await cls._push_values(updates)
+        return cls._notify(updates)
+
+    @staticmethod
+    def _notify(updates: list[tuple[Self, float, datetime]]) -> dict[int, str]:
+        """Notify the listeners of every stock in `updates`.
+
+        A failing listener doesn't keep the other stocks from being notified.
+        Failures are logged and returned as a dict of stock id to error.
+        """
+        failed = {}
+        for stock, new_price, new_valid in updates:
+            try:
+                stock._on_push(new_price, new_valid)
+            except Exception as e:
+                current_app.logger.error("notifying listeners of stock %d failed:\n%s",
+                                         stock.stock_id, traceback.format_exc())
+                failed[stock.stock_id] = f"{type(e).__name__}: {e}"
+        return failed
+
     @abstractmethod
     def _push_value(self, new_price, new_valid):
         pass
 
+    @classmethod
+    async def _push_values(cls, updates: list[tuple[Self, float, datetime]]):
+        """Push values to several stocks. Subclasses may batch this."""
+        for stock, new_price, new_valid in updates:
+            await aio.run_sync(stock._push_value, new_price, new_valid)
+
     def _on_push(self, new_price, new_valid):
         for listener in self.on_push_listeners:
             listener(self, new_price, new_valid)
 
-    def get_latest_price(self):
-        try:
-            after_sort = sorted(self.prices, key=lambda p: p[0], reverse=True)
-            return after_sort[0][1]
-        except IndexError:
-            return None
+    def get_latest_valid(self) -> Union[datetime, None]:
+        """Return the validity of the furthest pushed price (if any)."""
+        latest = self.prices.latest()
+        return latest[0] if latest is not None else None
+
+    def get_latest_price(self) -> Union[float, None]:
+        """Return the furthest pushed price (which may be a preview)."""
+        return self.prices.latest_price()
+
+    def get_current_price(self, now: datetime = None) -> Union[float, None]:
+        """Return the price valid at `now` (default: now(utc))."""
+        current = self.prices.current(now or datetime.now(timezone.utc))
+        return float(current[1]) if current is not None else None
+
+    def get_preview(self, now: datetime = None) -> Union[dict, None]:
+        """Return the next preview after `now` (default: now(utc))."""
+        return self.prices.preview(now or datetime.now(timezone.utc))
 
 
 class MarketEngineDBStock(MarketEngineStock):
@@ -77,28 +145,29 @@ class MarketEngineDBStock(MarketEngineStock):
     pushes of new values. Tracks the most recently pushed preview. TODO It may
     be beneficial to track the preview furthest in the future.
     """
-    prices: list[tuple[float, datetime]]
-    HISTORY_LEN: int = 10
+    __slots__ = ()
 
-    def __init__(self, stock_id):
-        super().__init__(stock_id)
+    def __init__(self, stock_id, prices: list[dict] = None, lookahead: int = 1):
+        """Create the stock and load its prices.
 
-        self.refresh()
-
-    @staticmethod
-    def all_from_db(db: mariadb.Connection) -> list[Self]:
-        stock_ids = stock_db.list_stock_ids(db)
-        return [MarketEngineDBStock(stock_id) for stock_id in stock_ids]
+        `prices` are rows as returned by `db.stock.get_prices`. If omitted,
+        they are read from the database. `lookahead` is the engine's number
+        of previews (see `MarketEngineStock`).
+        """
+        super().__init__(stock_id, lookahead)
 
-    def _safe_get_db(self):
-        return get_db()
+        if prices is None:
+            self.refresh()
+        else:
+            self.prices.load(prices)
 
     def refresh(self):
         try:
-            prices = stock_db.get_prices(
-                self._safe_get_db(), self.stock_id, fetch_rows=self.HISTORY_LEN
-            )
-            self.prices = [(v["valid_after"], int(v["price"])) for v in prices]
+            with engine_db() as db:
+                prices = stock_db.get_prices(
+                    db, self.stock_id, fetch_rows=self.prices.maxlen
+                )
+            self.prices.load(prices)
         except Exception as e:
             raise RuntimeError(
                 f"Unable to refresh stock {self.stock_id} from database"
@@ -106,57 +175,344 @@ class MarketEngineDBStock(MarketEngineStock):
 
     def _push_value(self, new_price, new_valid):
         try:
-            stock_db.add_price_preview(
-                self._safe_get_db(), self.stock_id, new_valid, new_price
-            )
-            self.refresh()
+            with engine_db() as db:
+                stock_db.add_price_preview(db, self.stock_id, new_valid, new_price)
+            self._apply_value(new_price, new_valid)
         except Exception as e:
             raise RuntimeError(
                 f"Unable to push new preview to stock {self.stock_id}"
             ) from e
 
+    @classmethod
+    async def _push_values(cls, updates: list[tuple[Self, float, datetime]]):
+        """Write all values in one transaction and apply them locally."""
+        if not updates:
+            return
+        rows = [(stock.stock_id, new_valid, new_price)
+                for stock, new_price, new_valid in updates]
+        try:
+            await aio.run_sync(cls._write_values, rows)
+        except Exception as e:
+            raise RuntimeError(
+                f"Unable to push new previews to {len(updates)} stocks"
+            ) from e
+        for stock, new_price, new_valid in updates:
+            stock._apply_value(new_price, new_valid)
+
+    @staticmethod
+    def _write_values(rows: list[tuple[int, datetime, float]]):
+        with engine_db() as db:
+            stock_db.add_price_previews(db, rows)
+
+    def _apply_value(self, new_price, new_valid):
+        """Record a pushed value without re-reading it from the database."""
+        self.prices.push(new_valid, new_price)
+
 
 # FIXME not thread-safe!
 class BaseMarketEngine(ABC):
     _app: Quart
     _loop: asyncio.BaseEventLoop
     _timers: dict[Callable, asyncio.TimerHandle]
+    _tick_task: Union[asyncio.Task, None]
+    _update_lock: asyncio.Lock
+    # utc time the next tick is scheduled for
+    _next_run: Union[datetime, None]
+    # UTC minus loop clock (seconds) when the next tick was scheduled
+    _clock_offset: float
+    # boundary of the last tick since the engine was started
+    _last_tick: Union[datetime, None]
     # FIXME thread-safety!
     interval: float
+    lookahead: int
+    missed_ticks: str
+    _rng: np.random.Generator
+    _random: random.Random
     _stocks: list[MarketEngineStock]
+    # `stocks.updated_at` and the number of edits (see
+    # `db.stock.list_stock_versions`) of every loaded stock when it was read
+    _versions: dict[int, tuple[datetime, int]]
+    _push_listeners: set[Callable]
+    _reload_listeners: set[Callable]
+    tick_store: TickStore
+    stats: EngineStats
+    stock_class: type[MarketEngineStock] = MarketEngineDBStock
 
     # TODO define update function (or listeners) from caller?
     # TODO define overridable get_next_interval function?
-    def __init__(self, app: Quart, interval: timedelta):
+    def __init__(self, app: Quart, interval: timedelta, lookahead: int = 1,
+                 seed: int = None, missed_ticks: str = "skip"):
         """Initialize the market engine.
 
         The market engine is responsible for generating new stock prices and
         queuing the next generation step. Stock price validity is usually dated
         into the future. Algorithms may be defined through subclasses.
 
-        Updates are done every `interval` unless stopped. Each update will come
-        into effect when the automatically generated SQL timestamp is reached.
-        Update notifications and the next update are triggered when the
-        internal event loop clock reaches the equivalent internal timestamp.
+        Updates are done every `interval` unless stopped, at fixed wall clock
+        boundaries (multiples of `interval` since the epoch, e.g. :00, :15,
+        :30 and :45 for 15 minutes), so the duration of an update doesn't
+        delay the following ones and prices are valid from these boundaries.
+        Each update will come into effect when the automatically generated SQL
+        timestamp is reached. Update notifications and the next update are
+        triggered when the internal event loop clock reaches the equivalent
+        internal timestamp.
 
         Note that differences in time measurement (e.g. leap seconds, system
         time settings) may cause the system time and event loop time to become
-        unaligned.
+        unaligned. The offset is measured for every scheduled update and
+        updates whose timer fires before the boundary (in UTC) are postponed.
+
+        If updates are missed (e.g. because an update took longer than
+        `interval` or the event loop was blocked), `missed_ticks` decides
+        what happens: "skip" continues with the next boundary, leaving a gap in
+        the prices, "catch_up" generates the missed prices in one batch with
+        the next update.
+
+        Each update tops up the previews of every stock so that `lookahead`
+        future prices are known at any time. Values greater than 1 allow
+        clients to show previews even if an update is delayed.
+
+        Random prices are drawn from generators seeded with `seed`, so a fixed
+        seed reproduces the same prices for the same stocks.
 
         """
         self._app = app
         self._loop = asyncio.get_running_loop()
         self._timers: dict[Callable, asyncio.TimerHandle] = {}
+        self._tick_task = None
+        # serializes ticks and reloads, which both change the loaded prices
+        self._update_lock = asyncio.Lock()
+        self._next_run = None
         self.interval = interval
+        if lookahead < 1:
+            raise ValueError("lookahead must be at least 1")
+        self.lookahead = lookahead
+        if missed_ticks not in MISSED_TICK_POLICIES:
+            raise ValueError(f"missed_ticks must be one of {MISSED_TICK_POLICIES}")
+        self.missed_ticks = missed_ticks
+        self._clock_offset = 0.0
+        self._last_tick = None
+        self._rng = np.random.default_rng(seed)
+        self._random = random.Random(seed)
         self._stocks = []
+        self._versions = {}
+        self.tick_store = TickStore(app.config.get("TICK_STORE_SIZE", 200))
+        self.candles = CandleStore(app.config.get("CANDLE_RESOLUTIONS", ["1h"]))
+        self._push_listeners = {self.tick_store.on_push, self.candles.on_push}
+        self._reload_listeners = set()
+        self.stats = EngineStats(interval, app.config.get("ENGINE_TICK_HISTORY", 100))
+
+    def add_push_listener(self, listener: Callable):
+        """Register `listener` with every stock, including stocks loaded later."""
+        self._push_listeners.add(listener)
+        for stock in self._stocks:
+            stock.on_push_listeners.add(listener)
+
+    def add_reload_listener(self, listener: Callable):
+        """Register `listener(stock_ids, stocks_changed)` for stocks re-read
+        by `reload_stocks`.
+
+        Called with the ids of the stocks whose prices were re-read because
+        they were changed outside of this engine (e.g. a preview edited in
+        another process). `stocks_changed` is set if stocks were added,
+        removed or renamed as well. Changes announced through
+        `invalidate_stock` may be reported once more by the next reload.
+        """
+        self._reload_listeners.add(listener)
+
+    async def reload_stocks(self, versions: dict[int, dict] = None):
+        """Synchronize the loaded stocks with the database (see
+        `_reload_stocks`)."""
+        async with self._update_lock:
+            return await self._reload_stocks(versions)
+
+    async def _reload_stocks(self, versions: dict[int, dict] = None):
+        """Synchronize the loaded stocks with the database.
+
+        Only stocks which were added or changed since they were last read are
+        loaded (in a single query). Unchanged stocks keep their in-memory
+        prices and listeners, stocks removed from the database are dropped.
+        A stock counts as changed if its row was updated, its prices were
+        edited (e.g. a preview edited in another process) or its furthest
+        price differs from the one in memory. The reload listeners are
+        notified of the changes (see `add_reload_listener`).
+
+        `versions` (see `_load_versions`) are read if not given.
+
+        Returns the number of loaded stocks.
+        """
+        if versions is None:
+            versions = await aio.run_sync(self._load_versions)
+        known = {stock.stock_id: stock for stock in self._stocks}
+        stale = [stock_id for stock_id, version in versions.items()
+                 if self._is_stale(known.get(stock_id), version)]
+        histories = await aio.run_sync(self._load_histories, stale)
+        candles = await aio.run_sync(
+            self._load_candles,
+            [stock_id for stock_id in stale if stock_id not in self.candles]
+        )
+
+        stocks = []
+        stocks_changed = False
+        for stock_id, version in versions.items():
+            stock = known.get(stock_id)
+            if stock_id in histories:
+                rows = histories[stock_id]
+                known_version = self._versions.get(stock_id)
+                if known_version is None or known_version[0] != version["updated_at"]:
+                    # added or renamed
+                    stocks_changed = True
+                if stock is None:
+                    stock = self._create_stock(stock_id, rows)
+                else:
+                    stock.prices.load(rows)
+                self.tick_store.load_rows(stock_id, rows)
+                if stock_id in candles:
+                    self.candles.update({stock_id: candles[stock_id]})
+                else:
+                    self.candles.set_pending(stock_id, rows)
+            elif stock is None:
+                # deleted in between both queries
+                continue
+            self._versions[stock_id] = self._version_key(version)
+            stocks.append(stock)
+        self._stocks = stocks
+        loaded_ids = [stock.stock_id for stock in stocks]
+        self.tick_store.retain(loaded_ids)
+        self.candles.retain(loaded_ids)
+        for stock_id in self._versions.keys() - set(loaded_ids):
+            del self._versions[stock_id]
+
+        num_removed = len(known.keys() - set(loaded_ids))
+        if histories or num_removed:
+            for listener in self._reload_listeners:
+                listener(list(histories), stocks_changed or num_removed > 0)
 
-    # FIXME thread-safety!
-    def reload_stocks(self, db: mariadb.Connection):
-        self._stocks = MarketEngineDBStock.all_from_db(db)
         num_loaded = len(self._stocks)
-        current_app.logger.info(f"loaded {num_loaded} stocks from db")
+        current_app.logger.info("loaded %d stocks from db (%d changed, %d removed)",
+                                num_loaded, len(histories), num_removed)
         return num_loaded
 
+    async def sync_stocks(self) -> int:
+        """Follow the prices written by the engine of another process.
+
+        Prices added after the furthest price in memory are applied like
+        pushed values, so the push listeners (tick store, candles, price
+        stream, ...) are notified. Everything else is left to
+        `reload_stocks`. Used instead of ticking by processes which don't run
+        the engine (see `engine_coordinator`).
+
+        Returns the number of loaded stocks.
+        """
+        async with self._update_lock:
+            return await self._sync_stocks()
+
+    async def _sync_stocks(self) -> int:
+        versions = await aio.run_sync(self._load_versions)
+        advanced = {}
+        for stock in self._stocks:
+            version = versions.get(stock.stock_id)
+            latest = stock.get_latest_valid()
+            if (version is not None and latest is not None
+                    and version["valid_after"] is not None
+                    and version["valid_after"] > latest
+                    and self._versions.get(stock.stock_id) == self._version_key(version)):
+                advanced[stock.stock_id] = stock
+        if advanced:
+            since = min(stock.get_latest_valid() for stock in advanced.values())
+            histories = await aio.run_sync(self._load_new_prices,
+                                           list(advanced), since)
+            updates = []
+            for stock_id, rows in histories.items():
+                stock = advanced[stock_id]
+                # a full page may have a gap to the prices in memory
+                if len(rows) >= self.tick_store.maxlen:
+                    continue
+                latest = stock.get_latest_valid()
+                updates.extend((stock, float(row["price"]), row["valid_after"])
+                               for row in reversed(rows)
+                               if row["valid_after"] > latest)
+            for stock, new_price, new_valid in updates:
+                stock._apply_value(new_price, new_valid)
+            self.stock_class._notify(updates)
+        return await self._reload_stocks(versions)
+
+    def _is_stale(self, stock: Union[MarketEngineStock, None], version: dict) -> bool:
+        if stock is None or stock.stock_id not in self.tick_store:
+            return True
+        if self._versions.get(stock.stock_id) != self._version_key(version):
+            return True
+        return not stock.prices.is_latest(version["valid_after"], version["price"])
+
+    @staticmethod
+    def _version_key(version: dict) -> tuple[datetime, int]:
+        return version["updated_at"], version["edits"]
+
+    def _load_versions(self) -> dict[int, dict]:
+        """Read the version of every stock (blocking, run in a worker)."""
+        with engine_db() as db:
+            return stock_db.list_stock_versions(db)
+
+    def _load_histories(self, stock_ids: list[int]) -> dict[int, list[dict]]:
+        """Read the prices of several stocks (blocking, run in a worker)."""
+        if not stock_ids:
+            return {}
+        with engine_db() as db:
+            return stock_db.get_price_histories(
+                db, stock_ids, fetch_rows=self.tick_store.maxlen,
+                include_previews=True
+            )
+
+    def _load_new_prices(self, stock_ids: list[int], since: datetime
+                         ) -> dict[int, list[dict]]:
+        """Read the prices valid after `since` (blocking, run in a worker)."""
+        with engine_db() as db:
+            return stock_db.get_price_histories(
+                db, stock_ids, fetch_rows=self.tick_store.maxlen,
+                include_previews=True, since=since
+            )
+
+    def _load_candles(self, stock_ids: list[int]) -> dict:
+        """Build the candles of several stocks (blocking, run in a worker)."""
+        if not stock_ids:
+            return {}
+        with engine_db() as db:
+            return self.candles.load(db, stock_ids)
+
+    async def invalidate_stock(self, stock_id: int):
+        """Re-read a stock which was changed outside of the engine.
+
+        The engine applies its own pushes locally and never re-reads them.
+        Changes made by others (e.g. an admin editing a preview) have to be
+        announced through this method. Stocks unknown to the engine are added.
+        """
+        # a tick or reload in between could apply older rows after these
+        async with self._update_lock:
+            rows = await aio.run_sync(self._load_prices, stock_id)
+            stock = self.get_stock(stock_id)
+            if stock is None:
+                stock = self._create_stock(stock_id, rows)
+                self._stocks.append(stock)
+                current_app.logger.info("added stock %d to engine", stock_id)
+            else:
+                stock.prices.load(rows)
+            self.tick_store.load_rows(stock_id, rows)
+            self.candles.set_pending(stock_id, rows)
+
+    def _load_prices(self, stock_id: int) -> list[dict]:
+        """Read the prices of a single stock (blocking, run in a worker)."""
+        with engine_db() as db:
+            return stock_db.get_prices(db, stock_id, fetch_rows=self.tick_store.maxlen)
+
+    def _create_stock(self, stock_id: int, rows: list[dict]) -> MarketEngineStock:
+        """Create a stock with room for `self.lookahead` previews."""
+        stock = self.stock_class(stock_id, rows, lookahead=self.lookahead)
+        stock.on_push_listeners |= self._push_listeners
+        return stock
+
+    def get_stock(self, stock_id: int) -> Union[MarketEngineStock, None]:
+        return next((s for s in self._stocks if s.stock_id == stock_id), None)
+
     def get_num_stocks(self):
         return len(self._stocks)
 
@@ -184,10 +540,23 @@ class BaseMarketEngine(ABC):
             self, when: datetime, callback: Callable
     ) -> asyncio.TimerHandle:
         # http://stackoverflow.com/questions/55592067/ddg#55593284
-        return self._schedule(when - datetime.now(timezone.utc), callback)
+        # the offset between both clocks is measured anew for every timer, as
+        # the wall clock may be adjusted while the loop clock is monotonic
+        offset = datetime.now(timezone.utc).timestamp() - self._loop.time()
+        self._clock_offset = offset
+        return self._schedule(when.timestamp() - offset - self._loop.time(),
+                              callback)
+
+    def _floor_tick(self, when: datetime) -> datetime:
+        """Return the last tick boundary at or before `when`."""
+        return when - (when - _EPOCH) % self.interval
+
+    def _next_tick(self, after: datetime) -> datetime:
+        """Return the first tick boundary after `after`."""
+        return self._floor_tick(after) + self.interval
 
     def is_running(self):
-        return len(self._timers) > 0
+        return len(self._timers) > 0 or self._tick_task is not None
 
     def start(self, when: Union[float, None] = None):
         """Start the engine.
@@ -195,11 +564,12 @@ class BaseMarketEngine(ABC):
         Generate and apply prices every `self.interval`. If `when` is None,
         start the engine at `now(utc) + 1`.
         """
-        if self._timers:
+        if self.is_running():
             raise RuntimeError("Engine is already running")
         if when is None:
             when = datetime.now(timezone.utc) + timedelta(seconds=1)
         current_app.logger.debug(f"starting engine at {when}.")
+        self._next_run = when
         self._schedule_at_utc(when, self._run)
 
     def threadsafe_start(self, *args):
@@ -209,89 +579,241 @@ class BaseMarketEngine(ABC):
         for timer in self._timers.values():
             timer.cancel()
         self._timers = {}
+        # a running update isn't interrupted (its DB write may already be
+        # committed) but won't schedule another run.
+        self._tick_task = None
+        # prices aren't caught up across a stop
+        self._last_tick = None
         current_app.logger.debug("stopped engine.")
 
     def threadsafe_stop(self, *args):
         self._loop.call_soon_threadsafe(self.stop, *args)
 
     def _run(self):
-        """Recursively update price previews."""
+        """Start an update of the price previews (timer callback).
+
+        The update itself runs as a task on the event loop so that database
+        access can be awaited (see `db.aio`). If the wall clock fell behind the
+        loop clock since the timer was scheduled, the update is postponed
+        until the scheduled time is reached in UTC.
+        """
         if not has_app_context():
             raise RuntimeError("Not within app context")
+        now = datetime.now(timezone.utc)
+        if self._next_run is not None and now < self._next_run - _TIMER_TOLERANCE:
+            current_app.logger.info("timer fired %.3fs early; rescheduling",
+                                    (self._next_run - now).total_seconds())
+            self._schedule_at_utc(self._next_run, self._run)
+            return
+        clock_skew = now.timestamp() - self._loop.time() - self._clock_offset
+        self._tick_task = self._loop.create_task(
+            self._tick(self._next_run, now, clock_skew)
+        )
+
+    async def _tick(self, scheduled: datetime = None, started: datetime = None,
+                    clock_skew: float = 0.0):
+        """Recursively update price previews.
 
+        The tick is recorded in `self.stats`, including the time it was
+        `scheduled` for, the time the timer actually `started` it and the
+        change of the offset between UTC and the loop clock since it was
+        scheduled (`clock_skew`). Prices are generated for the last tick
+        boundary and the next tick is scheduled at the following boundary,
+        regardless of how long this tick took.
+        """
         current_app.logger.info("running engine internally")
+        started = started or datetime.now(timezone.utc)
+        record = self.stats.begin(scheduled, started)
+        record.clock_skew = clock_skew
+        # timers may fire slightly early, so the scheduled boundary is used
+        boundary = self._floor_tick(max(started, scheduled or started))
+        previous, self._last_tick = self._last_tick, boundary
+        if previous is not None:
+            record.missed_ticks = max(round((boundary - previous) / self.interval) - 1, 0)
+        if record.missed_ticks:
+            current_app.logger.warning("missed %d ticks (%s)", record.missed_ticks,
+                                       self.missed_ticks)
+        catch_up_from = previous if self.missed_ticks == "catch_up" else None
+        error = None
         try:
-            self._update_stocks(current_app)
-            current_app.logger.info("updated stocks; scheduling next run in %dmin %ds",
-                                    self.interval.total_seconds() // 60,
-                                    self.interval.total_seconds() % 60)
-            next_run = datetime.now(timezone.utc) + self.interval
+            async with self._update_lock:
+                await self._update_stocks(current_app, record, now=boundary,
+                                          catch_up_from=catch_up_from)
+            if self._tick_task is not asyncio.current_task():
+                current_app.logger.info("updated stocks; engine was stopped")
+                return
+            next_run = self._next_tick(datetime.now(timezone.utc))
+            current_app.logger.info("updated stocks; scheduling next run in %.1fs",
+                                    (next_run - datetime.now(timezone.utc)
+                                     ).total_seconds())
+            self._next_run = next_run
             self._schedule_at_utc(next_run, self._run)
             current_app.logger.info("scheduled next run at %s", next_run)
-        except Exception:
+        except Exception as e:
+            error = e
             current_app.logger.error(traceback.format_exc())
-
-    def _update_stocks(self, context):
-        """Update all the stocks managed by this instance."""
+        finally:
+            self.stats.finish(record, error)
+            if self._tick_task is asyncio.current_task():
+                self._tick_task = None
+
+    async def _update_stocks(self, context, record: TickRecord = None,
+                             now: datetime = None, catch_up_from: datetime = None):
+        """Top up the price previews of all stocks managed by this instance.
+
+        Stocks are grouped by their furthest preview. For every group the
+        missing ticks up to `self.lookahead` intervals ahead are generated
+        step by step, each step for all stocks of the group at once via
+        `self._generate_prices`. All previews are then pushed as one batch via
+        `stock_class.push_values`. If no preview is pending (e.g. on start or
+        after a stall), new previews start at the tick boundary following
+        `now` (default: now(utc)). Anchors are aligned to tick boundaries, so
+        prices from before the alignment are continued at the next boundary.
+
+        With `catch_up_from` (the previous tick's boundary), stocks without a
+        pending preview are continued from their latest price (but not from
+        before `catch_up_from`) instead, generating the missed prices too.
+
+        The time spent per phase and stocks whose listeners failed are
+        recorded in `record` (if given).
+        """
+        if record is None:
+            record = TickRecord()
         try:
+            now = self._floor_tick(now or datetime.now(timezone.utc))
+            groups: dict[datetime, list[MarketEngineStock]] = {}
             for stock in self._stocks:
-                self._update_stock(stock, context)
+                latest = stock.get_latest_valid()
+                if latest is not None and latest > now:
+                    anchor = latest
+                elif latest is not None and catch_up_from is not None:
+                    anchor = max(latest, catch_up_from)
+                else:
+                    anchor = now
+                groups.setdefault(self._floor_tick(anchor), []).append(stock)
+
+            updates = []
+            with record.phase("generate"):
+                for anchor, stocks in groups.items():
+                    # rounded, so that timers firing slightly early or late
+                    # don't skip or duplicate a tick
+                    num_ahead = round((anchor - now) / self.interval)
+                    last_prices = None
+                    for step in range(1, self.lookahead - num_ahead + 1):
+                        new_valid = anchor + step * self.interval
+                        new_prices = self._generate_prices(stocks, context,
+                                                           last_prices)
+                        updates.extend(zip(stocks, new_prices.tolist(),
+                                           repeat(new_valid)))
+                        last_prices = new_prices
+            record.num_stocks = len(self._stocks)
+            record.num_updates = len(updates)
+            with record.phase("write"):
+                await self.stock_class._push_values(updates)
+            with record.phase("notify"):
+                record.failed_stocks.update(self.stock_class._notify(updates))
         except Exception as e:
             raise RuntimeError("Error occured while updating stocks") from e
 
-    def _update_stock(self, stock: MarketEngineStock, context):
-        """Generate a new price preview for `stock` and push it.
+    def _latest_prices(self, stocks: list[MarketEngineStock], default: float,
+                       last_prices: np.ndarray = None) -> np.ndarray:
+        """Return the latest price of every stock (`default` if unset).
 
-        Default behavior is to call `self._generate_price`, set the validity to
-        `now(utc) + self.interval` and push via `stock.push_value`.
+        If `last_prices` is given (when generating several ticks ahead), it is
+        returned instead.
+        """
+        if last_prices is not None:
+            return last_prices
+        return np.fromiter((stock.get_latest_price() or default for stock in stocks),
+                           dtype=float, count=len(stocks))
+
+    def _generate_prices(self, stocks: list[MarketEngineStock], context,
+                         last_prices: np.ndarray = None) -> np.ndarray:
+        """Generate new prices for all `stocks` at once.
+
+        `last_prices` holds the previous prices of the stocks if they haven't
+        been pushed yet (see `_latest_prices`). The default implementation
+        calls `self._generate_price` for every stock, passing its previous
+        price along. Subclasses should override this with a vectorized version
+        using `self._rng`.
         """
-        current_app.logger.debug("updating stock %d", stock.stock_id)
-        new_price = self._generate_price(stock, context)
-        new_valid = datetime.now(timezone.utc) + self.interval
-        stock.push_value(new_price, new_valid)
+        if last_prices is None:
+            last_prices = repeat(None)
+        else:
+            last_prices = last_prices.tolist()
+        return np.fromiter((self._generate_price(stock, context, last_price)
+                            for stock, last_price in zip(stocks, last_prices)),
+                           dtype=float, count=len(stocks))
 
     @abstractmethod
-    def _generate_price(self, stock, context) -> float:
+    def _generate_price(self, stock, context, last_price: float = None) -> float:
+        """Generate a new price for `stock`.
+
+        `last_price` is the previous price if it hasn't been pushed yet,
+        otherwise the latest price of `stock` applies.
+        """
         pass
 
 
 class RandomMarketEngine(BaseMarketEngine):
-    def __init__(self, app, interval, price_range: range):
-        super().__init__(app, interval)
+    def __init__(self, app, interval, price_range: range, **kwargs):
+        super().__init__(app, interval, **kwargs)
         self.price_range = price_range
 
-    def _generate_price(self, _stock, _context) -> int:
-        return random.choice(self.price_range)
+    def _generate_prices(self, stocks, _context, _last_prices=None) -> np.ndarray:
+        return self._rng.choice(np.asarray(self.price_range, dtype=float),
+                                size=len(stocks))
+
+    def _generate_price(self, _stock, _context, _last_price=None) -> int:
+        return self._random.choice(self.price_range)
 
 
 class RandomChangeMarketEngine(BaseMarketEngine):
     def __init__(self, app, interval, max_change: int, min_value: int,
-                 start_value: int, step: float = 1):
-        super().__init__(app, interval)
+                 start_value: int, step: float = 1, **kwargs):
+        super().__init__(app, interval, **kwargs)
         self.max_change = max_change
         self.min_value = min_value
         self.start_value = start_value
         self.step = step
 
-    def _generate_price(self, _stock: MarketEngineStock, _context) -> int:
-        last_price = _stock.get_latest_price() or self.start_value
+    def _generate_prices(self, stocks, _context, last_prices=None) -> np.ndarray:
+        last_prices = self._latest_prices(stocks, self.start_value, last_prices)
+        max_prices = last_prices + self.max_change
+        min_prices = np.maximum(self.min_value, last_prices - self.max_change)
+        # same distribution as randrange(min_price, max_price, step)
+        num_steps = np.maximum(np.ceil((max_prices - min_prices) / self.step), 1)
+        return min_prices + self.step * self._rng.integers(num_steps)
+
+    def _generate_price(self, _stock: MarketEngineStock, _context,
+                        last_price: float = None) -> int:
+        last_price = last_price or _stock.get_latest_price() or self.start_value
         max_price = last_price + self.max_change
         min_price = max(self.min_value, last_price - self.max_change)
-        return random.randrange(min_price, max_price, self.step)
+        # randrange(min_price, max_price, step) rejects non-integer prices
+        num_steps = max(math.ceil((max_price - min_price) / self.step), 1)
+        return min_price + self.step * self._random.randrange(num_steps)
 
 
 class GaussChangeMarketEngine(BaseMarketEngine):
     def __init__(self, app, interval, sigma: float, min_value: int,
-                 start_value: int, step: float = 1):
-        super().__init__(app, interval)
+                 start_value: int, step: float = 1, **kwargs):
+        super().__init__(app, interval, **kwargs)
         self.sigma = sigma
         self.min_value = min_value
         self.start_value = start_value
         self.step = step
 
-    def _generate_price(self, _stock: MarketEngineStock, _context) -> int:
-        last_price = _stock.get_latest_price() or self.start_value
-        price = random.gauss(last_price, self.sigma)
+    def _generate_prices(self, stocks, _context, last_prices=None) -> np.ndarray:
+        last_prices = self._latest_prices(stocks, self.start_value, last_prices)
+        prices = self._rng.normal(last_prices, self.sigma)
+        rounded = self.step * np.round(prices / self.step)
+        return np.maximum(self.min_value, rounded)
+
+    def _generate_price(self, _stock: MarketEngineStock, _context,
+                        last_price: float = None) -> int:
+        last_price = last_price or _stock.get_latest_price() or self.start_value
+        price = self._random.gauss(last_price, self.sigma)
         rounded = self.step * round(price / self.step)
         # if rounded < last_price:
         #     rounded += self.step
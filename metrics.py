@@ -0,0 +1,306 @@
+"""Low overhead metrics, exported in the Prometheus text format.
+
+Metrics are process-wide (like the pool statistics in `db.manage`) and safe to
+update from the database worker threads. Recording a value takes a lock and,
+for histograms, a binary search over the buckets, so instrumentation can stay
+enabled during events. The metrics are served on `/api/metrics`.
+"""
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections.abc import Callable
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Union
+
+from quart import Quart, g, request
+
+# seconds, for database statements and requests
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: Union[int, float]) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    type_name: str
+    name: str
+    help: str
+    label_names: tuple[str, ...]
+    _lock: threading.Lock
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}",
+                f"# TYPE {self.name} {self.type_name}"]
+
+    @abstractmethod
+    def render(self) -> list[str]:
+        pass
+
+
+class Counter(_Metric):
+    type_name = "counter"
+    _values: dict[tuple, Union[int, float]]
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, *labels, amount: Union[int, float] = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(v)}"
+            for labels, v in values
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, *labels, value: Union[int, float]):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels, amount: Union[int, float] = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    """Histogram with fixed upper bounds (`buckets`, in ascending order)."""
+    type_name = "histogram"
+    buckets: tuple[float, ...]
+    # label values -> [count per bucket (not cumulative, last is +Inf), sum]
+    _values: dict[tuple, list]
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value: float, *labels):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][idx] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = [(labels, list(counts), total)
+                      for labels, (counts, total) in self._values.items()]
+        lines = self._header()
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket"
+                             f"{_format_labels(self.label_names, labels, le)} "
+                             f"{cumulative}")
+            label_str = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics of the process and callbacks updating gauges on export."""
+    _metrics: dict[str, _Metric]
+    _collectors: list[Callable]
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Callable):
+        """Call `collector()` before every export (e.g. to set gauges)."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+DB_STATEMENT_SECONDS = REGISTRY.register(Histogram(
+    "dau_jones_db_statement_seconds",
+    "Latency of database statements (including fetching the rows).",
+    labels=("statement",),
+))
+DB_STATEMENT_ERRORS = REGISTRY.register(Counter(
+    "dau_jones_db_statement_errors_total",
+    "Database statements which raised an error.",
+    labels=("statement",),
+))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "dau_jones_http_request_seconds",
+    "Latency of HTTP requests until the response is returned.",
+    labels=("endpoint", "method", "status"),
+))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "dau_jones_http_requests_in_flight",
+    "HTTP requests currently being handled.",
+    labels=("endpoint",),
+))
+DB_POOL = REGISTRY.register(Gauge(
+    "dau_jones_db_pool",
+    "Statistics of the connection pool (see `db.manage.pool_stats`).",
+    labels=("stat",),
+))
+RESPONSE_CACHE_ENTRIES = REGISTRY.register(Gauge(
+    "dau_jones_response_cache_entries", "Responses held by the response cache.",
+))
+ENGINE_STOCKS = REGISTRY.register(Gauge(
+    "dau_jones_engine_stocks", "Stocks loaded by the market engine.",
+))
+ENGINE_LEADER = REGISTRY.register(Gauge(
+    "dau_jones_engine_leader",
+    "Whether this process runs the market engine (see `engine_coordinator`).",
+))
+ENGINE_TICK_SECONDS = REGISTRY.register(Histogram(
+    "dau_jones_engine_tick_seconds",
+    "Duration of the market engine's ticks (total and per phase).",
+    labels=("phase",),
+    buckets=LATENCY_BUCKETS + (30, 60, 120, 300, 600, 900),
+))
+ENGINE_TICK_DELAY = REGISTRY.register(Gauge(
+    "dau_jones_engine_tick_delay_seconds",
+    "Seconds the last tick started after it was scheduled.",
+))
+ENGINE_TICK_BUDGET = REGISTRY.register(Gauge(
+    "dau_jones_engine_tick_budget_ratio",
+    "Duration of the last tick relative to the engine's interval.",
+))
+ENGINE_CLOCK_SKEW = REGISTRY.register(Gauge(
+    "dau_jones_engine_clock_skew_seconds",
+    "Change of UTC relative to the event loop's clock during the last interval.",
+))
+ENGINE_MISSED_TICKS = REGISTRY.register(Counter(
+    "dau_jones_engine_missed_ticks_total",
+    "Tick boundaries passed without a tick of the market engine.",
+))
+ENGINE_TICKS = REGISTRY.register(Counter(
+    "dau_jones_engine_ticks_total", "Ticks of the market engine by result.",
+    labels=("result",),
+))
+ENGINE_STOCK_FAILURES = REGISTRY.register(Counter(
+    "dau_jones_engine_stock_failures_total",
+    "Stocks whose update failed during a tick.",
+))
+
+
+@lru_cache(maxsize=1024)
+def statement_label(sql: str) -> str:
+    """Normalize `sql` to a label, e.g. collapsing `IN (?, ?, ...)` lists."""
+    sql = " ".join(sql.split())
+    return re.sub(r"\((?:\?, )+\?\)", "(...)", sql)
+
+
+@contextmanager
+def timed_statement(sql: str):
+    """Record the latency (and failure) of the statement `sql`."""
+    label = statement_label(sql)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        DB_STATEMENT_ERRORS.inc(label)
+        raise
+    finally:
+        DB_STATEMENT_SECONDS.observe(time.perf_counter() - start, label)
+
+
+def init_app(app: Quart):
+    """Record the latency of every request of every blueprint."""
+
+    @app.before_request
+    async def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_endpoint = request.endpoint or "unknown"
+        HTTP_REQUESTS_IN_FLIGHT.inc(g.metrics_endpoint)
+
+    @app.after_request
+    async def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    async def record_request(exception=None):
+        if "metrics_start" not in g:
+            return
+        duration = time.perf_counter() - g.pop("metrics_start")
+        endpoint = g.pop("metrics_endpoint")
+        HTTP_REQUESTS_IN_FLIGHT.dec(endpoint)
+        HTTP_REQUEST_SECONDS.observe(duration, endpoint, request.method,
+                                     str(g.pop("metrics_status", 500)))
+
+    REGISTRY.add_collector(lambda: _collect_app(app))
+
+
+def _collect_app(app: Quart):
+    # imported here, as the db package imports this module
+    from db.manage import pool_stats
+    for stat, value in pool_stats().items():
+        DB_POOL.set(stat, value=value)
+    cache = app.config.get("RESPONSE_CACHE")
+    if cache is not None:
+        RESPONSE_CACHE_ENTRIES.set(value=len(cache))
+    engine = app.config.get("MARKET_ENGINE")
+    if engine is not None:
+        ENGINE_STOCKS.set(value=engine.get_num_stocks())
+    coordinator = app.config.get("ENGINE_COORDINATOR")
+    ENGINE_LEADER.set(value=int(coordinator.is_leader if coordinator is not None
+                                else engine is not None))
+
@@ -0,0 +1,198 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Union
+
+from quart import Quart
+
+from tick_store import TickStore
+
+# delay before browsers reconnect to a closed stream
+RECONNECT_DELAY_MS = 5000
+
+
+def init_app(app: Quart):
+
+    @app.before_serving
+    async def start_stream():
+        engine = app.config["MARKET_ENGINE"]
+        stream = PriceStream(engine.tick_store, app.json.dumps,
+                             backlog=app.config["PRICE_STREAM_BACKLOG"],
+                             heartbeat=app.config["PRICE_STREAM_HEARTBEAT"])
+        engine.add_push_listener(stream.on_push)
+        engine.add_reload_listener(stream.on_reload)
+        app.config["PRICE_STREAM"] = stream
+
+    @app.after_serving
+    async def stop_stream():
+        stream = app.config.pop("PRICE_STREAM", None)
+        if stream is not None:
+            stream.close()
+
+
+class _Subscription:
+    """Event queue of a single streaming client.
+
+    A client which doesn't keep up with the events is disconnected (by
+    enqueuing `None`) rather than buffering without bounds. Browsers reconnect
+    automatically and resume via `Last-Event-ID`.
+    """
+    queue: asyncio.Queue
+
+    def __init__(self, maxsize: int):
+        self.queue = asyncio.Queue(maxsize)
+
+    def put(self, event: bytes):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class PriceStream:
+    """Fan out market engine pushes to server-sent event streams.
+
+    Two kinds of events are sent, both carrying `stock_id`, `valid_after` and
+    `price` as data:
+     - `vorschau`: the engine pushed a new preview (or it was edited).
+     - `kurs`: a preview became valid, i.e. the current price changed.
+
+    The last `backlog` events are kept so that reconnecting clients can
+    resume from their `Last-Event-ID`. Clients whose ID can't be resumed from
+    receive a `reset` event and should re-fetch their state. `reset` is sent
+    to all clients as well if the engine reloaded stocks which were added,
+    removed or renamed by another process.
+    """
+    _store: TickStore
+    _dumps: Callable[[dict], str]
+    _loop: asyncio.AbstractEventLoop
+    heartbeat: float
+    _boot_id: str
+    _next_id: int
+    _backlog: deque[tuple[int, bytes]]
+    _subscriptions: set[_Subscription]
+    _pending: dict[datetime, set[int]]
+    _timers: dict[datetime, asyncio.TimerHandle]
+
+    def __init__(self, store: TickStore, dumps: Callable[[dict], str],
+                 backlog: int = 1000, heartbeat: float = 15):
+        self._store = store
+        self._dumps = dumps
+        self._loop = asyncio.get_running_loop()
+        self.heartbeat = heartbeat
+        # event ids are prefixed so ids from before a restart aren't resumed
+        self._boot_id = str(int(time.time()))
+        self._next_id = 1
+        self._backlog = deque(maxlen=backlog)
+        self._subscriptions = set()
+        self._pending = {}
+        self._timers = {}
+
+    def _parse_event_id(self, event_id: Union[str, None]) -> Union[int, None]:
+        if not event_id:
+            return None
+        boot_id, _, num = event_id.partition("-")
+        if boot_id != self._boot_id or not num.isdigit():
+            return None
+        return int(num)
+
+    def _format(self, event_id: int, event: str, data: dict) -> bytes:
+        return (f"id: {self._boot_id}-{event_id}\n"
+                f"event: {event}\n"
+                f"data: {self._dumps(data)}\n\n").encode()
+
+    def publish(self, event: str, data: dict):
+        event_id = self._next_id
+        self._next_id += 1
+        message = self._format(event_id, event, data)
+        self._backlog.append((event_id, message))
+        for subscription in self._subscriptions:
+            subscription.put(message)
+
+    def on_push(self, stock, new_price, new_valid):
+        """Push listener for `MarketEngineStock.on_push_listeners`."""
+        self.publish_preview(stock.stock_id)
+        self._schedule_current(stock.stock_id, new_valid)
+
+    def on_reload(self, stock_ids: list[int], stocks_changed: bool):
+        """Reload listener (see `BaseMarketEngine.add_reload_listener`)."""
+        if stocks_changed:
+            self.publish("reset", {})
+            return
+        for stock_id in stock_ids:
+            self.publish_preview(stock_id)
+
+    def publish_preview(self, stock_id: int):
+        """Send the stock's preview as held by the tick store."""
+        preview = self._store.get_preview(stock_id)
+        if preview is not None:
+            self.publish("vorschau", {"stock_id": stock_id, **preview})
+
+    def _schedule_current(self, stock_id: int, valid_after: datetime):
+        # all stocks pushed in one tick share a single timer
+        valid_after = valid_after.replace(microsecond=0)
+        self._pending.setdefault(valid_after, set()).add(stock_id)
+        if valid_after not in self._timers:
+            delay = (valid_after - datetime.now(timezone.utc)).total_seconds()
+            self._timers[valid_after] = self._loop.call_later(
+                max(delay, 0), self._publish_current, valid_after
+            )
+
+    def _publish_current(self, valid_after: datetime):
+        self._timers.pop(valid_after, None)
+        for stock_id in sorted(self._pending.pop(valid_after, ())):
+            # the price is looked up again as the preview may have been edited
+            history = self._store.get_history(stock_id, 1, now=valid_after)
+            if history:
+                self.publish("kurs", history[0])
+
+    def subscribe(self, last_event_id: str = None) -> _Subscription:
+        subscription = _Subscription(self._backlog.maxlen or 1)
+        if last_event_id is not None:
+            resume_from = self._parse_event_id(last_event_id)
+            oldest = self._backlog[0][0] if self._backlog else self._next_id
+            if resume_from is None or not oldest - 1 <= resume_from < self._next_id:
+                subscription.put(self._format(self._next_id - 1, "reset", {}))
+            else:
+                for event_id, message in self._backlog:
+                    if event_id > resume_from:
+                        subscription.put(message)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: _Subscription):
+        self._subscriptions.discard(subscription)
+
+    async def events(self, last_event_id: str = None) -> AsyncIterator[bytes]:
+        """Yield the encoded event stream of a new client."""
+        subscription = self.subscribe(last_event_id)
+        try:
+            yield f"retry: {RECONNECT_DELAY_MS}\n\n".encode()
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(),
+                                                     self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": heartbeat\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(subscription)
+
+    def close(self):
+        """Cancel pending events and disconnect all clients."""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers = {}
+        self._pending = {}
+        for subscription in self._subscriptions:
+            subscription.close()
+        self._subscriptions = set()
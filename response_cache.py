@@ -0,0 +1,147 @@
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from typing import Union
+
+from quart import Quart, Response, current_app, make_response, request
+
+from tick_store import TickStore
+
+
+def init_app(app: Quart):
+    cache = ResponseCache(app.config["RESPONSE_CACHE_SIZE"],
+                          app.config["RESPONSE_CACHE_MAX_AGE"])
+    app.config["RESPONSE_CACHE"] = cache
+
+    @app.before_serving
+    async def connect_engine():
+        engine = app.config.get("MARKET_ENGINE")
+        if engine is not None:
+            cache.tick_store = engine.tick_store
+            engine.add_push_listener(cache.on_push)
+            engine.add_reload_listener(cache.on_reload)
+
+
+class _Entry:
+    __slots__ = ("body", "mimetype", "etag", "expires", "generation")
+    body: bytes
+    mimetype: str
+    etag: str
+    expires: datetime
+    generation: int
+
+    def __init__(self, body: bytes, mimetype: str, expires: datetime,
+                 generation: int):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.expires = expires
+        self.generation = generation
+
+    def respond(self, now: datetime) -> Response:
+        """Answer the current request, with 304 if the client is up to date."""
+        if request.if_none_match.contains(self.etag):
+            response = Response(b"", status=304)
+        else:
+            response = Response(self.body, mimetype=self.mimetype)
+        response.set_etag(self.etag)
+        response.expires = self.expires
+        response.cache_control.public = True
+        response.cache_control.max_age = max(
+            int((self.expires - now).total_seconds()), 0
+        )
+        return response
+
+
+class ResponseCache:
+    """Cache of serialized API responses which are valid until the next tick.
+
+    Price data only changes when a preview becomes valid, the engine pushes
+    new previews or values are edited. Responses are therefore cached until
+    the next known `valid_after` of any stock (at most `max_age` seconds) and
+    dropped as a whole on pushes and edits (see `invalidate`). Clients are
+    told the same expiry and can revalidate with the strong ETag of the body.
+    """
+    size: int
+    max_age: timedelta
+    tick_store: Union[TickStore, None]
+    generation: int
+    _entries: OrderedDict[str, _Entry]
+
+    def __init__(self, size: int, max_age: Union[int, float]):
+        self.size = size
+        self.max_age = timedelta(seconds=max_age)
+        self.tick_store = None
+        self.generation = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self):
+        """Drop all cached responses (after prices or stocks were changed)."""
+        self.generation += 1
+        self._entries.clear()
+
+    def on_push(self, stock, new_price, new_valid):
+        """Push listener for `MarketEngineStock.on_push_listeners`."""
+        self.invalidate()
+
+    def on_reload(self, stock_ids, stocks_changed):
+        """Reload listener (see `BaseMarketEngine.add_reload_listener`)."""
+        self.invalidate()
+
+    def expiry(self, now: datetime) -> datetime:
+        expires = now + self.max_age
+        if self.tick_store is not None:
+            next_change = self.tick_store.next_change(now)
+            if next_change is not None:
+                expires = min(expires, next_change)
+        return expires
+
+    def get(self, key: str, now: datetime) -> Union[_Entry, None]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.generation != self.generation or entry.expires <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, body: bytes, mimetype: str, generation: int,
+            now: datetime) -> _Entry:
+        """Store a response rendered while `generation` was current."""
+        entry = _Entry(body, mimetype, self.expiry(now), generation)
+        if generation == self.generation:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+
+def cached(view):
+    """Serve successful responses of `view` from the `ResponseCache`.
+
+    Responses are keyed by path and query string. Requests with a matching
+    `If-None-Match` are answered with 304.
+    """
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        cache = current_app.config.get("RESPONSE_CACHE")
+        if cache is None:
+            return await view(*args, **kwargs)
+        now = datetime.now(timezone.utc)
+        key = request.full_path
+        entry = cache.get(key, now)
+        if entry is None:
+            generation = cache.generation
+            response = await make_response(await view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            entry = cache.put(key, await response.get_data(), response.mimetype,
+                              generation, now)
+        return entry.respond(now)
+    return wrapper
@@ -1,4 +1,8 @@
 function deepCompare(old, cur) {
+    if (old === cur) {
+        // e.g. untouched parts of a value updated by a reducer
+        return { type: 'unchanged' };
+    }
     if (typeof old !== typeof cur) {
         // type mismatch
         if (cur === undefined) {
@@ -51,6 +55,27 @@ function deepCompare(old, cur) {
     return { type: 'changed', changes: changes };
 }
 
+/**
+ * Convert a history in column format (`?format=spalten`: epoch seconds and
+ * cents, newest first) to rows as returned by the default format.
+ */
+function historyFromColumns(stockId, {valid_after, price}) {
+    return valid_after.map((timestamp, i) => ({
+        stock_id: stockId,
+        valid_after: new Date(timestamp * 1000).toUTCString(),
+        price: (price[i] / 100).toFixed(2),
+    }));
+}
+
+/**
+ * Convert the histories of several stocks (`{stock_id: columns}`) to rows.
+ */
+function historiesFromColumns(stocks) {
+    return Object.fromEntries(Object.entries(stocks).map(
+        ([stockId, columns]) => [stockId, historyFromColumns(Number(stockId), columns)]
+    ));
+}
+
 class ApiValue extends EventTarget {
     #value;
 
@@ -103,12 +128,67 @@ class ApiValue extends EventTarget {
         this.#value = updated;
         this.#emitChangeEvent(diff);
     }
+
+    /**
+     * Prepend new rows to the histories of a value shaped `{key: rows}`
+     * (newest first), keeping at most `maxLength` rows per key.
+     *
+     * `appended` has the same shape and must only contain rows newer than the
+     * current ones (e.g. a `?seit=` response). The change is emitted without
+     * comparing the whole value: as `appended` diffs (the newest row in `val`,
+     * all new rows in `vals`) for existing keys and `added` for new keys.
+     */
+    appendRows(appended, maxLength = Infinity) {
+        if (!this.is_running) {
+            throw new Error(
+                "Cannot update unsynchronized value. This function should only be called"
+                + " from a subclass while it is running.");
+        }
+        let updated = { ...this.#value };
+        let changes = [];
+        for (const [key, rows] of Object.entries(appended)) {
+            if (!rows?.length) {
+                continue;
+            }
+            let hist = updated[key];
+            updated[key] = [...rows, ...(hist ?? [])].slice(0, maxLength);
+            if (hist === undefined) {
+                changes.push({ type: 'added', key: key, val: updated[key] });
+            } else {
+                changes.push({
+                    type: 'updated', key: key, val: updated[key],
+                    diff: { type: 'appended', val: rows[0], vals: rows },
+                });
+            }
+        }
+        if (changes.length === 0) {
+            return;
+        }
+        this.#value = updated;
+        this.#emitChangeEvent({ type: 'changed', changes: changes });
+    }
 }
 
+/**
+ * Value synchronized by polling `server + format(params)`.
+ *
+ * Responses are revalidated with their ETag (`If-None-Match`), so unchanged
+ * values cost a 304 without body. The next poll is scheduled when the
+ * response expires according to its `Cache-Control: max-age` (i.e. when the
+ * next price becomes valid), falling back to `delay` ms.
+ *
+ * `format(params, cursor)` may request a history delta (`?seit=${cursor}`,
+ * starting with `seit=0`). Responses carrying a `cursor` replace the value
+ * with their `kurse` once and only append the new rows afterwards (see
+ * `appendRows`, at most `maxLength` rows per key).
+ */
 class PollingValue extends ApiValue {
     delay;
-    #interval;
+    maxLength = Infinity;
+    #timeout;
     #errHandler;
+    #etag;
+    #cursor;
 
     #server;
     #format;
@@ -119,8 +199,10 @@ class PollingValue extends ApiValue {
                 pollErrHandler = (e) => { throw e; }, interval = 5000) {
         super();
         this.delay = interval;
-        this.#interval = undefined;
+        this.#timeout = undefined;
         this.#errHandler = pollErrHandler;
+        this.#etag = undefined;
+        this.#cursor = undefined;
 
         this.#server = server;
         this.#format = format;
@@ -129,38 +211,181 @@ class PollingValue extends ApiValue {
     }
 
     start() {
-        if (!this.#interval) {
-            this.#interval = setInterval(this.#refreshValue.bind(this), this.delay);
+        if (!this.#timeout) {
+            this.#timeout = setTimeout(this.#tick.bind(this), this.delay);
         }
     }
 
     stop() {
-        if (this.#interval) {
-            clearInterval(this.#interval);
-            this.#interval = undefined;
+        if (this.#timeout) {
+            clearTimeout(this.#timeout);
+            this.#timeout = undefined;
         }
     }
 
     get is_running() {
-        return this.#interval !== undefined;
+        return this.#timeout !== undefined;
     }
 
     poll() {
         return this.#refreshValue().then(() => this.value);
     }
 
+    async #tick() {
+        let delay = await this.#refreshValue();
+        if (this.is_running) {
+            this.#timeout = setTimeout(this.#tick.bind(this), delay);
+        }
+    }
+
+    /**
+     * Return the delay until `res` expires (plus some slack for the server to
+     * pass the next tick) or `this.delay` if it doesn't tell.
+     */
+    #nextDelay(res) {
+        let maxAge = /max-age=(\d+)/.exec(res?.headers.get('Cache-Control') ?? '');
+        if (!maxAge) {
+            return this.delay;
+        }
+        return Math.max(Number(maxAge[1]) * 1000 + 250, 1000);
+    }
+
     async #refreshValue() {
+        let res;
         try {
-            let updated = await fetch(this.#server + this.#format(this.#params),
-                                      this.#options)
-                .then(res => res.json())
-                .catch(this.#errHandler);
-            this.tryUpdateValue(await updated);
+            let headers = new Headers(this.#options.headers);
+            if (this.#etag !== undefined) {
+                headers.set('If-None-Match', this.#etag);
+            }
+            let updated;
+            try {
+                res = await fetch(
+                    this.#server + this.#format(this.#params, this.#cursor ?? 0),
+                    { ...this.#options, headers });
+                if (res.status === 304) {
+                    return this.#nextDelay(res);
+                }
+                updated = await res.json();
+                this.#etag = res.ok ? res.headers.get('ETag') ?? undefined : undefined;
+            } catch (e) {
+                updated = await this.#errHandler(e);
+            }
+            if (!this.is_running) {
+                // stopped while fetching
+            } else if (updated?.cursor === undefined) {
+                this.tryUpdateValue(updated);
+            } else if (this.#cursor === undefined) {
+                this.#cursor = updated.cursor;
+                this.tryUpdateValue(updated.kurse);
+            } else {
+                this.#cursor = updated.cursor;
+                this.appendRows(updated.kurse, this.maxLength);
+            }
         } catch (e) {
             this.dispatchEvent(new CustomEvent("pollErr", { detail: e }));
             console.error("Stopped polling:");
             console.error(e);
             this.stop();
         }
+        return this.#nextDelay(res);
+    }
+}
+
+/**
+ * Value synchronized through a server-sent event stream.
+ *
+ * The initial value is fetched from `snapshotPath`. Afterwards every event
+ * named in `reducers` is applied via `reducers[name](value, data)`, which has
+ * to return the updated value without modifying `value` in place. Reducers
+ * should ignore data that is already contained in the value, as events
+ * arriving while the snapshot is fetched are applied on top of it. A `reset`
+ * event (sent if the server can't resume the stream) fetches a new snapshot.
+ * `parseSnapshot` converts the fetched snapshot (e.g. `historiesFromColumns`).
+ */
+class StreamingValue extends ApiValue {
+    #source;
+    #errHandler;
+    #pending;
+
+    #server;
+    #streamPath;
+    #snapshotPath;
+    #reducers;
+    #parseSnapshot;
+
+    constructor(server, streamPath, snapshotPath, reducers,
+                streamErrHandler = (e) => { console.error(e); },
+                parseSnapshot = (snapshot) => snapshot) {
+        super();
+        this.#source = undefined;
+        this.#errHandler = streamErrHandler;
+        this.#pending = undefined;
+
+        this.#server = server;
+        this.#streamPath = streamPath;
+        this.#snapshotPath = snapshotPath;
+        this.#reducers = reducers;
+        this.#parseSnapshot = parseSnapshot;
+    }
+
+    start() {
+        if (this.#source) {
+            return;
+        }
+        this.#source = new EventSource(this.#server + this.#streamPath);
+        for (const [name, reducer] of Object.entries(this.#reducers)) {
+            this.#source.addEventListener(name, (e) => {
+                this.#applyEvent(reducer, JSON.parse(e.data));
+            });
+        }
+        this.#source.addEventListener('reset', () => this.#refreshSnapshot());
+        // the browser reconnects by itself, resuming from the last event id
+        this.#source.addEventListener('error', (e) => {
+            this.dispatchEvent(new CustomEvent("streamErr", { detail: e }));
+            this.#errHandler(e);
+        });
+        this.#refreshSnapshot();
+    }
+
+    stop() {
+        if (this.#source) {
+            this.#source.close();
+            this.#source = undefined;
+            this.#pending = undefined;
+        }
+    }
+
+    get is_running() {
+        return this.#source !== undefined;
+    }
+
+    #applyEvent(reducer, data) {
+        if (this.#pending !== undefined) {
+            // snapshot is still being fetched
+            this.#pending.push([reducer, data]);
+            return;
+        }
+        this.tryUpdateValue(reducer(this.value, data));
+    }
+
+    async #refreshSnapshot() {
+        this.#pending = [];
+        try {
+            let snapshot = await fetch(this.#server + this.#snapshotPath)
+                .then(res => res.json())
+                .then(this.#parseSnapshot);
+            if (!this.is_running) {
+                return;
+            }
+            let pending = this.#pending;
+            this.#pending = undefined;
+            this.tryUpdateValue(pending.reduce(
+                (value, [reducer, data]) => reducer(value, data), snapshot));
+        } catch (e) {
+            this.dispatchEvent(new CustomEvent("streamErr", { detail: e }));
+            console.error("Stopped streaming:");
+            console.error(e);
+            this.stop();
+        }
     }
 }
@@ -1,5 +1,20 @@
-const verlauf = new PollingValue(
-    window.location.origin, () => "/api/kurse/verlauf/?eintraege=20", {},
+const EINTRAEGE = 20;
+
+function appendPrice(stocks, {stock_id, valid_after, price}) {
+    let hist = stocks[stock_id] ?? [];
+    if (hist.some(p => p.valid_after === valid_after)) {
+        return stocks;
+    }
+    return {
+        ...stocks,
+        [stock_id]: [{stock_id, valid_after, price}, ...hist].slice(0, EINTRAEGE),
+    };
+}
+
+const verlauf = new StreamingValue(
+    window.location.origin, "/api/kurse/stream",
+    `/api/kurse/verlauf/?eintraege=${EINTRAEGE}&format=spalten`, { kurs: appendPrice },
+    undefined, historiesFromColumns,
 );
 
 async function getStockName(stockId) {
@@ -20,6 +20,9 @@ document.addEventListener('DOMContentLoaded', async () => {
         container.innerHTML = '';
         container.appendChild(shopHeader);
 
+        // Gekaufte Aktien aller Firmen mit einer Anfrage laden
+        const summaries = loadStockSummaries();
+
         // Dynamisch Zeilen für jede Firma hinzufügen
         for (const stock of stocks) {
             const row = createStockRow(stock);
@@ -28,8 +31,8 @@ document.addEventListener('DOMContentLoaded', async () => {
             // Lade den aktuellen Kurs
             loadStockPrice(stock.id, row);
 
-            // Lade die gekauften Aktien
-            loadStockSummary(stock.id, row);
+            // Zeige die gekauften Aktien an
+            summaries.then((data) => showStockSummary(data?.[stock.id], row));
 
             // Event-Listener für Plus-, Minus- und Kauf-Buttons hinzufügen
             setupRowEventListeners(stock.id, row);
@@ -75,20 +78,42 @@ async function loadStockPrice(stockId, row) {
     }
 }
 
+// Lädt die gekauften Aktien aller Firmen (Objekt: stock_id -> Summary)
+async function loadStockSummaries() {
+    try {
+        const summaryResp = await fetch('/api/aktien/summary/');
+        if (summaryResp.ok) {
+            return await summaryResp.json();
+        }
+        console.error(`HTTP-Fehler! Status: ${summaryResp.status}`);
+    } catch (error) {
+        console.error('Fehler beim Abrufen der Summaries:', error);
+    }
+    return null;
+}
+
+// Zeigt die gekauften Aktien einer Firma an
+function showStockSummary(summaryData, row) {
+    if (!summaryData) {
+        row.querySelector('.aktien-umlauf').textContent = 'Fehler: API nicht erreichbar';
+        return;
+    }
+    const totalAmount = summaryData.total_amount;
+
+    // Überprüfen, ob totalAmount eine Zahl ist
+    if (typeof totalAmount === 'number') {
+        row.querySelector('.aktien-umlauf').textContent = totalAmount;
+    } else {
+        row.querySelector('.aktien-umlauf').textContent = 'Fehler: Ungültige Daten';
+    }
+}
+
 // Lädt die gekauften Aktien für eine Firma
 async function loadStockSummary(stockId, row) {
     try {
         const summaryResp = await fetch(`/api/aktien/${stockId}/summary`);
         if (summaryResp.ok) {
-            const summaryData = await summaryResp.json();
-            const totalAmount = summaryData.total_amount;
-
-            // Überprüfen, ob totalAmount eine Zahl ist
-            if (typeof totalAmount === 'number') {
-                row.querySelector('.aktien-umlauf').textContent = totalAmount;
-            } else {
-                row.querySelector('.aktien-umlauf').textContent = 'Fehler: Ungültige Daten';
-            }
+            showStockSummary(await summaryResp.json(), row);
         } else {
             row.querySelector('.aktien-umlauf').textContent = 'Fehler: API nicht erreichbar';
         }
@@ -170,7 +195,10 @@ function setupRowEventListeners(stockId, row) {
             });
 
             if (response.ok) {
-                alert(`Aktien erfolgreich gekauft! Sie haben ${betragInfo.textContent} bezahlt.`);
+                // Abgerechnet wird zum Kurs beim Eingang der Anfrage
+                const data = await response.json();
+                const betrag = `${data.total_price.toFixed(2)} MA`;
+                alert(`Aktien erfolgreich gekauft! Sie haben ${betrag} bezahlt.`);
                 loadStockSummary(stockId, row); // Aktualisiere die gekauften Aktien
             } else {
                 const errorData = await response.json().catch(() => null);
@@ -197,7 +225,10 @@ function setupRowEventListeners(stockId, row) {
             });
 
             if (response.ok) {
-                alert(`Aktien erfolgreich verkauft! Sie erhalten ${betragInfo.textContent}.`);
+                // Abgerechnet wird zum Kurs beim Eingang der Anfrage
+                const data = await response.json();
+                const betrag = `${data.total_price.toFixed(2)} MA`;
+                alert(`Aktien erfolgreich verkauft! Sie erhalten ${betrag}.`);
                 loadStockSummary(stockId, row); // Aktualisiere die gekauften Aktien
             } else {
                 const errorData = await response.json().catch(() => null);
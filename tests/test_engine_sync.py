@@ -0,0 +1,89 @@
+"""Engines following changes made through another engine (i.e. process)."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks.fixtures import create_app, create_db, create_engine
+from db import stock as stock_db
+from engine_coordinator import EngineCoordinator
+
+LOOKAHEAD = 3
+
+
+async def _edit_preview(follow: str):
+    db = create_db(num_stocks=2, num_prices=5, num_previews=LOOKAHEAD)
+    app = create_app(db)
+    async with app.app_context():
+        engine = await create_engine(app, db, lookahead=LOOKAHEAD)
+        other = await create_engine(app, db, lookahead=LOOKAHEAD)
+    app.config["MARKET_ENGINE"] = engine
+    reloads = []
+    other.add_reload_listener(
+        lambda stock_ids, stocks_changed: reloads.append((stock_ids, stocks_changed))
+    )
+
+    # the next preview, not the furthest one
+    response = await app.test_client().put("/api/kurse/vorschau/1?wert=42")
+    assert response.status_code == 200
+    assert engine.tick_store.get_preview(1)["price"] == 42
+    assert other.tick_store.get_preview(1)["price"] != 42
+
+    async with app.app_context():
+        await getattr(other, follow)()
+    assert reloads == [([1], False)]
+    assert other.tick_store.get_preview(1)["price"] == 42
+    assert other.get_stock(1).get_preview()["price"] == 42
+
+
+@pytest.mark.parametrize("follow", ["reload_stocks", "sync_stocks"])
+def test_edited_preview_is_reloaded(follow):
+    asyncio.run(_edit_preview(follow))
+
+
+async def _follow_unchanged():
+    db = create_db(num_stocks=2, num_prices=5, num_previews=LOOKAHEAD)
+    app = create_app(db)
+    async with app.app_context():
+        other = await create_engine(app, db, lookahead=LOOKAHEAD)
+        reloads = []
+        other.add_reload_listener(lambda *args: reloads.append(args))
+        await other.sync_stocks()
+        await other.reload_stocks()
+    assert reloads == []
+
+
+def test_unchanged_stocks_are_kept():
+    asyncio.run(_follow_unchanged())
+
+
+async def _poll_changes():
+    db = create_db(num_stocks=2, num_prices=5, num_previews=LOOKAHEAD)
+    app = create_app(db)
+    async with app.app_context():
+        engine = await create_engine(app, db, lookahead=LOOKAHEAD)
+        coordinator = EngineCoordinator(engine, "follower")
+        coordinator._get_change_marker = lambda: stock_db.get_change_marker(db)
+        syncs = []
+
+        async def sync():
+            syncs.append(stock_db.get_change_marker(db))
+
+        await coordinator._follow(sync)
+        await coordinator._follow(sync)
+        assert len(syncs) == 1
+
+        stock_db.set_price_preview(db, 1, 42)
+        await coordinator._follow(sync)
+        await coordinator._follow(sync)
+        later = datetime.now(timezone.utc) + timedelta(days=1)
+        stock_db.add_price_previews(db, [(1, later, 5), (2, later, 6)])
+        await coordinator._follow(sync)
+        stock_db.create_stock(db, "Aktie 3")
+        await coordinator._follow(sync)
+    assert len(syncs) == 4
+    assert len(set(syncs)) == 4
+
+
+def test_versions_are_read_after_changes():
+    asyncio.run(_poll_changes())
@@ -0,0 +1,177 @@
+"""The prepared statements kept per MariaDB connection by `db.read_value`."""
+import asyncio
+
+import mariadb
+import pytest
+from quart import Quart
+
+import db
+from db import manage
+
+
+class FakeCursor:
+    """A prepared cursor returning the connection's `rows` for every
+    statement."""
+
+    def __init__(self, connection: "FakeConnection"):
+        self.connection = connection
+        self.metadata = {"field": ("id", "name")}
+        self.executed = []
+        self.closed = False
+
+    def execute(self, sql, data=()):
+        if self.closed:
+            raise mariadb.Error("cursor is closed")
+        if self.connection.error is not None:
+            raise self.connection.error
+        self.executed.append((sql, data))
+
+    def fetchone(self):
+        return self.connection.rows[0] if self.connection.rows else None
+
+    def fetchall(self):
+        return list(self.connection.rows)
+
+    def fetchmany(self, size):
+        return list(self.connection.rows[:size])
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    """Records the cursors prepared on it and fails `ping` unless healthy."""
+
+    def __init__(self):
+        self.rows = [(1, "Aktie 1"), (2, "Aktie 2")]
+        self.cursors = []
+        self.error = None
+        self.healthy = True
+        self.reconnects = 0
+
+    def cursor(self, cursor_type=None, prepared=False):
+        assert prepared
+        cursor = FakeCursor(self)
+        self.cursors.append(cursor)
+        return cursor
+
+    def ping(self):
+        if not self.healthy:
+            raise mariadb.Error("server has gone away")
+
+    def reconnect(self):
+        self.reconnects += 1
+        self.healthy = True
+
+
+class FakePool:
+
+    def __init__(self, connection: FakeConnection):
+        self.connection = connection
+
+    def get_connection(self):
+        return self.connection
+
+
+@pytest.fixture
+def connection():
+    connection = FakeConnection()
+    yield connection
+    db.clear_statements(connection)
+
+
+def test_statement_is_reused(connection):
+    sql = "SELECT id, name FROM stocks"
+    assert db.read_value(connection, sql, fetch_rows="all") == [
+        {"id": 1, "name": "Aktie 1"}, {"id": 2, "name": "Aktie 2"}
+    ]
+    assert db.read_value(connection, sql, fetch_rows="all",
+                         row_format="tuple") == [(1, "Aktie 1"), (2, "Aktie 2")]
+    db.read_value(connection, "SELECT id, name FROM stocks WHERE id = (?)", 1)
+    db.read_value(connection, sql, fetch_rows=1)
+
+    assert len(connection.cursors) == 2
+    assert [data for _, data in connection.cursors[0].executed] == [(), (), ()]
+    assert not any(cursor.closed for cursor in connection.cursors)
+
+
+def test_least_recently_used_statement_is_evicted(connection, monkeypatch):
+    monkeypatch.setattr(db, "STATEMENT_CACHE_SIZE", 2)
+    db.read_value(connection, "SELECT 1")
+    db.read_value(connection, "SELECT 2")
+    # "SELECT 1" becomes the most recently used one
+    db.read_value(connection, "SELECT 1")
+    db.read_value(connection, "SELECT 3")
+
+    first, second, third = connection.cursors
+    assert second.closed
+    assert not first.closed and not third.closed
+    db.read_value(connection, "SELECT 1")
+    assert len(connection.cursors) == 3
+    # prepared again, evicting "SELECT 3"
+    db.read_value(connection, "SELECT 2")
+    assert len(connection.cursors) == 4
+    assert third.closed and not first.closed
+
+
+def test_statement_is_discarded_after_error(connection):
+    sql = "SELECT id, name FROM stocks"
+    db.read_value(connection, sql)
+    connection.error = mariadb.Error("Lost connection to server")
+    with pytest.raises(mariadb.Error):
+        db.read_value(connection, sql)
+    assert connection.cursors[0].closed
+
+    connection.error = None
+    assert db.read_value(connection, sql) == {"id": 1, "name": "Aktie 1"}
+    assert len(connection.cursors) == 2
+    assert not connection.cursors[1].closed
+
+
+def test_statements_are_cleared(connection):
+    sql = "SELECT id, name FROM stocks"
+    db.read_value(connection, sql)
+    db.clear_statements(connection)
+    db.read_value(connection, sql)
+    assert len(connection.cursors) == 2
+
+
+@pytest.fixture
+def app():
+    app = Quart("dau_jones_tests")
+    app.config.from_object("default_config")
+    return app
+
+
+async def _in_app_context(app, func):
+    async with app.app_context():
+        return func()
+
+
+def _use_engine_db():
+    with manage.engine_db() as connection:
+        return connection
+
+
+def test_statements_are_cleared_on_reconnect(app, connection, monkeypatch):
+    monkeypatch.setattr(manage, "_pool", FakePool(connection))
+    sql = "SELECT id, name FROM stocks"
+    db.read_value(connection, sql)
+    connection.healthy = False
+
+    assert asyncio.run(_in_app_context(app, manage._checkout)) is connection
+    assert connection.reconnects == 1
+    db.read_value(connection, sql)
+    assert len(connection.cursors) == 2
+
+
+def test_engine_statements_are_cleared_on_reconnect(app, connection, monkeypatch):
+    monkeypatch.setattr(manage, "_engine_db", connection)
+    sql = "SELECT id, name FROM stocks"
+    db.read_value(connection, sql)
+    connection.healthy = False
+
+    assert asyncio.run(_in_app_context(app, _use_engine_db)) is connection
+    assert connection.reconnects == 1
+    db.read_value(connection, sql)
+    assert len(connection.cursors) == 2
@@ -0,0 +1,339 @@
+from array import array
+from bisect import insort
+from datetime import datetime, timezone
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Iterator, Union
+
+PRICE_QUANTUM = Decimal("0.01")
+
+
+def _normalize(valid_after: datetime, price: Union[int, float, Decimal]):
+    """Convert a pushed value to epoch seconds and integer cents.
+
+    `prices.valid_after` is a DATETIME without fractional seconds and
+    `prices.price` a DECIMAL with two places, so both are truncated / rounded
+    the same way the database does.
+    """
+    if valid_after.tzinfo is None:
+        valid_after = valid_after.replace(tzinfo=timezone.utc)
+    if not isinstance(price, Decimal):
+        price = Decimal(str(price))
+    cents = int(price.quantize(PRICE_QUANTUM, rounding=ROUND_HALF_UP) * 100)
+    return int(valid_after.timestamp()), cents
+
+
+def _to_datetime(timestamp: int) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def _to_decimal(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+def to_columns(rows: list[dict]) -> dict:
+    """Convert price rows to parallel lists of epoch seconds and cents."""
+    entries = [_normalize(row["valid_after"], row["price"]) for row in rows]
+    return {"valid_after": [timestamp for timestamp, _ in entries],
+            "price": [cents for _, cents in entries]}
+
+
+class PriceSeries:
+    """Bounded, chronologically ordered price history of a single stock.
+
+    Holds at most `maxlen` of the most recent (valid_after, price) entries,
+    including previews, as epoch seconds and integer cents in two ring
+    buffers. `complete` is set if the series is known to contain every price
+    stored for the stock, i.e. there are no older rows in the database which
+    could be missing from memory.
+
+    Appending, the latest entry and the current price / preview are O(1)
+    (amortized over the passing of time). Pushing an entry older than the
+    latest one rebuilds the buffers.
+    """
+    __slots__ = ("stock_id", "maxlen", "complete",
+                 "_times", "_cents", "_start", "_len", "_current")
+    stock_id: int
+    maxlen: int
+    complete: bool
+    _times: array
+    _cents: array
+    _start: int
+    _len: int
+    # logical index of the newest entry valid at the last lookup (-1 if none)
+    _current: int
+
+    def __init__(self, stock_id: int, maxlen: int):
+        self.stock_id = stock_id
+        self.maxlen = maxlen
+        self.complete = False
+        self._reset([])
+
+    def __len__(self):
+        return self._len
+
+    def _reset(self, entries: list[tuple[int, int]]):
+        self._times = array("q", (t for t, _ in entries))
+        self._cents = array("q", (c for _, c in entries))
+        self._start = 0
+        self._len = len(entries)
+        self._current = -1
+
+    def _index(self, i: int) -> int:
+        return (self._start + i) % self.maxlen
+
+    def _time(self, i: int) -> int:
+        return self._times[self._index(i)]
+
+    def _entries(self) -> Iterator[tuple[int, int]]:
+        for i in range(self._len):
+            idx = self._index(i)
+            yield self._times[idx], self._cents[idx]
+
+    def _row(self, i: int) -> tuple[datetime, Decimal]:
+        idx = self._index(i)
+        return _to_datetime(self._times[idx]), _to_decimal(self._cents[idx])
+
+    def load(self, rows: list[dict]):
+        """Replace the series with `rows` (as returned by `db.stock.get_prices`).
+
+        `rows` should be the newest `maxlen` rows of the stock. If fewer rows
+        are given, the series is assumed to be complete.
+        """
+        entries = sorted(_normalize(r["valid_after"], r["price"]) for r in rows)
+        self.complete = len(entries) < self.maxlen
+        self._reset(entries[-self.maxlen:] if self.maxlen else [])
+
+    def push(self, valid_after: datetime, price: Union[int, float, Decimal]):
+        timestamp, cents = _normalize(valid_after, price)
+        if self._len and timestamp <= self._time(self._len - 1):
+            self._insert(timestamp, cents)
+        elif len(self._times) < self.maxlen:
+            self._times.append(timestamp)
+            self._cents.append(cents)
+            self._len += 1
+        elif self.maxlen:
+            # overwrite the oldest entry
+            self._times[self._start] = timestamp
+            self._cents[self._start] = cents
+            self._start = (self._start + 1) % self.maxlen
+            self._current = max(self._current - 1, -1)
+            self.complete = False
+
+    def _insert(self, timestamp: int, cents: int):
+        """Replace or insert an entry which isn't newer than the latest one."""
+        for i in range(self._len - 1, -1, -1):
+            if self._time(i) == timestamp:
+                self._cents[self._index(i)] = cents
+                return
+            if self._time(i) < timestamp:
+                break
+        entries = list(self._entries())
+        insort(entries, (timestamp, cents))
+        if len(entries) > self.maxlen:
+            del entries[0]
+            self.complete = False
+        self._reset(entries)
+
+    def _split(self, now: datetime) -> int:
+        """Return the number of entries which are valid at `now`."""
+        timestamp = now.timestamp()
+        current = min(self._current, self._len - 1)
+        while current >= 0 and self._time(current) > timestamp:
+            current -= 1
+        while current + 1 < self._len and self._time(current + 1) <= timestamp:
+            current += 1
+        self._current = current
+        return current + 1
+
+    def latest(self) -> Union[tuple[datetime, Decimal], None]:
+        """Return the furthest pushed entry (which may be a preview)."""
+        if not self._len:
+            return None
+        return self._row(self._len - 1)
+
+    def is_latest(self, valid_after: Union[datetime, None],
+                  price: Union[int, float, Decimal, None]) -> bool:
+        """Check whether (valid_after, price) is the furthest entry.
+
+        Passing None for both checks whether the series is empty.
+        """
+        if valid_after is None:
+            return not self._len
+        if not self._len:
+            return False
+        idx = self._index(self._len - 1)
+        return (self._times[idx], self._cents[idx]) == _normalize(valid_after, price)
+
+    def latest_price(self) -> Union[float, None]:
+        if not self._len:
+            return None
+        return self._cents[self._index(self._len - 1)] / 100
+
+    def current(self, now: datetime) -> Union[tuple[datetime, Decimal], None]:
+        """Return the entry valid at `now`, if held in memory."""
+        idx = self._split(now)
+        if idx == 0:
+            return None
+        return self._row(idx - 1)
+
+    def _history_indices(self, num: int, now: datetime,
+                         since: int = None) -> Union[list[int], None]:
+        """Return the logical indices of up to `num` valid entries, newest first.
+
+        Only entries newer than `since` (epoch seconds) are included. Returns
+        None if the series doesn't hold enough entries to answer without
+        consulting the database.
+        """
+        indices = []
+        for i in range(self._split(now) - 1, -1, -1):
+            if len(indices) == num or (since is not None and self._time(i) <= since):
+                return indices
+            indices.append(i)
+        if len(indices) < num and not self.complete:
+            return None
+        return indices
+
+    def history(self, num: int, now: datetime,
+                since: int = None) -> Union[list[dict], None]:
+        """Return up to `num` valid prices (newer than `since`), newest first.
+
+        Returns None if the series doesn't hold enough entries to answer
+        without consulting the database.
+        """
+        indices = self._history_indices(num, now, since)
+        if indices is None:
+            return None
+        history = []
+        for i in indices:
+            valid_after, price = self._row(i)
+            history.append(
+                {"stock_id": self.stock_id, "valid_after": valid_after, "price": price}
+            )
+        return history
+
+    def history_columns(self, num: int, now: datetime,
+                        since: int = None) -> Union[dict, None]:
+        """Like `history`, as parallel lists of epoch seconds and cents."""
+        indices = self._history_indices(num, now, since)
+        if indices is None:
+            return None
+        indices = [self._index(i) for i in indices]
+        return {"valid_after": [self._times[i] for i in indices],
+                "price": [self._cents[i] for i in indices]}
+
+    def current_time(self, now: datetime) -> Union[int, None]:
+        """Return since when the current price is valid (epoch seconds)."""
+        idx = self._split(now)
+        return self._time(idx - 1) if idx else None
+
+    def preview(self, now: datetime) -> Union[dict, None]:
+        """Return the next price which isn't valid yet or None if there is none.
+
+        Previews are always the newest entries of a stock, so they can be
+        answered from memory even if older history is missing.
+        """
+        idx = self._split(now)
+        if idx == self._len:
+            return None
+        valid_after, price = self._row(idx)
+        return {"price": price, "valid_after": valid_after}
+
+    def next_change(self, now: datetime) -> Union[int, None]:
+        """Return when the next preview becomes valid (epoch seconds)."""
+        idx = self._split(now)
+        if idx == self._len:
+            return None
+        return self._time(idx)
+
+
+class TickStore:
+    """In-memory price history of all stocks loaded by the market engine.
+
+    The store is written through on every push of the engine (see
+    `on_push`) and loaded from the database (see `load_rows`) when the stocks
+    are (re)loaded. Lookups of stocks which aren't held in memory return None
+    so callers can fall back to the database.
+    """
+    maxlen: int
+    _series: dict[int, PriceSeries]
+
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        self._series = {}
+
+    def __contains__(self, stock_id: int):
+        return stock_id in self._series
+
+    def retain(self, stock_ids):
+        """Drop the series of all stocks not contained in `stock_ids`."""
+        for stock_id in self._series.keys() - set(stock_ids):
+            del self._series[stock_id]
+
+    def load_rows(self, stock_id: int, rows: list[dict]):
+        """Replace the series of a single stock with `rows` (newest `maxlen`)."""
+        series = PriceSeries(stock_id, self.maxlen)
+        series.load(rows)
+        self._series[stock_id] = series
+
+    def on_push(self, stock, new_price, new_valid):
+        """Push listener for `MarketEngineStock.on_push_listeners`."""
+        self.push(stock.stock_id, new_valid, new_price)
+
+    def push(self, stock_id: int, valid_after: datetime,
+             price: Union[int, float, Decimal]):
+        if stock_id not in self._series:
+            self._series[stock_id] = PriceSeries(stock_id, self.maxlen)
+        self._series[stock_id].push(valid_after, price)
+
+    def next_change(self, now: datetime = None) -> Union[datetime, None]:
+        """Return when the next preview of any stock becomes valid."""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        changes = [change for series in self._series.values()
+                   if (change := series.next_change(now)) is not None]
+        return _to_datetime(min(changes)) if changes else None
+
+    def cursor(self, now: datetime = None) -> Union[int, None]:
+        """Return when the newest current price of any stock became valid.
+
+        Histories requested with this as `since` contain exactly the prices
+        which became valid afterwards.
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        times = [time for series in self._series.values()
+                 if (time := series.current_time(now)) is not None]
+        return max(times) if times else None
+
+    def get_history(self, stock_id: int, num: int, now: datetime = None,
+                    since: int = None) -> Union[list[dict], None]:
+        """Return the `num` newest valid prices or None if not held in memory.
+
+        With `since` (epoch seconds), only newer prices are returned.
+        """
+        if stock_id not in self._series:
+            return None
+        if now is None:
+            now = datetime.now(timezone.utc)
+        return self._series[stock_id].history(num, now, since)
+
+    def get_history_columns(self, stock_id: int, num: int, now: datetime = None,
+                            since: int = None) -> Union[dict, None]:
+        """Column format of `get_history` (see `PriceSeries.history_columns`)."""
+        if stock_id not in self._series:
+            return None
+        if now is None:
+            now = datetime.now(timezone.utc)
+        return self._series[stock_id].history_columns(num, now, since)
+
+    def get_preview(self, stock_id: int, now: datetime = None) -> Union[dict, None]:
+        """Return the next preview of the stock.
+
+        Check whether the stock is held in memory (`stock_id in store`) before
+        calling this, as None is also returned if there is no preview.
+        """
+        if stock_id not in self._series:
+            return None
+        if now is None:
+            now = datetime.now(timezone.utc)
+        return self._series[stock_id].preview(now)
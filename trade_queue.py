@@ -0,0 +1,172 @@
+import asyncio
+from typing import Union
+
+from quart import Quart, current_app
+
+from db import aio, exceptions
+from db import stock as stock_db
+from db.manage import pooled_db
+from market_engine import BaseMarketEngine
+
+
+def init_app(app: Quart):
+
+    @app.before_serving
+    async def start_trade_queue():
+        queue = TradeQueue(app.config["MARKET_ENGINE"],
+                           batch_size=app.config["TRADE_BATCH_SIZE"],
+                           batch_delay=app.config["TRADE_BATCH_DELAY"],
+                           maxsize=app.config["TRADE_QUEUE_SIZE"],
+                           timeout=app.config["TRADE_QUEUE_TIMEOUT"])
+        queue.start()
+        app.config["TRADE_QUEUE"] = queue
+
+    @app.after_serving
+    async def stop_trade_queue():
+        queue = app.config.pop("TRADE_QUEUE", None)
+        if queue is not None:
+            await queue.close()
+
+
+class TradeQueueFull(Exception):
+    """Raised if a trade couldn't be enqueued in time."""
+
+
+class NoPriceError(Exception):
+    """Raised if a stock can't be traded because it has no current price."""
+
+
+class TradeQueue:
+    """Commit buy and sell requests in batches.
+
+    Requests enqueue their trade and wait until it is written. A single writer
+    task collects trades until `batch_size` trades are pending or
+    `batch_delay` seconds passed since the first one and writes them with one
+    statement and one commit. Trades arriving while a batch is written are
+    collected for the next one, so bursts need few commits.
+
+    Trades are priced from the market engine's current price at the time they
+    are enqueued. If `maxsize` trades are pending, requests wait up to
+    `timeout` seconds for room and are rejected with `TradeQueueFull`
+    afterwards.
+    """
+    _engine: BaseMarketEngine
+    batch_size: int
+    batch_delay: float
+    timeout: float
+    _queue: asyncio.Queue
+    _writer: Union[asyncio.Task, None]
+
+    def __init__(self, engine: BaseMarketEngine, batch_size: int,
+                 batch_delay: float, maxsize: int, timeout: float):
+        self._engine = engine
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.timeout = timeout
+        self._queue = asyncio.Queue(maxsize)
+        self._writer = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_batches())
+
+    async def close(self):
+        """Write all pending trades and stop the writer."""
+        if self._writer is None:
+            return
+        await self._queue.put(None)
+        await self._writer
+        self._writer = None
+
+    def price(self, stock_id: int, amount: int) -> float:
+        """Return the total price of `amount` shares at the current price."""
+        stock = self._engine.get_stock(stock_id)
+        if stock is None:
+            raise exceptions.StockIdError(stock_id)
+        price = stock.get_current_price()
+        if price is None:
+            raise NoPriceError(stock_id)
+        return round(price * amount, 2)
+
+    async def submit(self, stock_id: int, amount: int) -> float:
+        """Record a trade and return its total price once it is committed.
+
+        `amount` is positive for purchases and negative for sales.
+        """
+        if self._writer is None:
+            raise RuntimeError("trade queue isn't running")
+        if not isinstance(amount, int) or amount == 0:
+            raise exceptions.DBValueError("purchase_amount", amount)
+        total_price = self.price(stock_id, amount)
+        done = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(
+                self._queue.put(((stock_id, amount, total_price), done)),
+                self.timeout
+            )
+        except TimeoutError as e:
+            raise TradeQueueFull() from e
+        await done
+        return total_price
+
+    async def _next_batch(self) -> tuple[list, bool]:
+        """Wait for the next batch. Returns the batch and whether to stop."""
+        item = await self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_delay
+        while len(batch) < self.batch_size:
+            try:
+                if self._queue.empty():
+                    item = await asyncio.wait_for(self._queue.get(),
+                                                  deadline - loop.time())
+                else:
+                    item = self._queue.get_nowait()
+            except TimeoutError:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _write_batches(self):
+        stop = False
+        while not stop:
+            batch, stop = await self._next_batch()
+            if batch:
+                await self._write_batch(batch)
+
+    async def _write_batch(self, batch: list):
+        trades = [trade for trade, _done in batch]
+        try:
+            async with aio.reserve_connection():
+                await aio.run_sync(self._write, trades)
+        except Exception as e:
+            current_app.logger.warning(
+                "writing %d trades failed (%s), retrying one by one",
+                len(trades), e
+            )
+            await self._write_each(batch)
+        else:
+            for _trade, done in batch:
+                if not done.done():
+                    done.set_result(None)
+
+    async def _write_each(self, batch: list):
+        """Write trades individually so that one bad trade fails alone."""
+        for trade, done in batch:
+            try:
+                async with aio.reserve_connection():
+                    await aio.run_sync(self._write, [trade])
+            except Exception as e:
+                if not done.done():
+                    done.set_exception(e)
+            else:
+                if not done.done():
+                    done.set_result(None)
+
+    @staticmethod
+    def _write(trades: list[tuple[int, int, float]]):
+        with pooled_db() as db:
+            stock_db.add_transactions(db, trades)